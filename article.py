@@ -14,14 +14,16 @@
 import json
 import uuid
 from datetime import datetime
-from collections import OrderedDict, defaultdict, namedtuple
+from collections import OrderedDict, defaultdict, namedtuple, Counter
 
 from settings import Settings, NoIndexWords
-from scraperdb import Article as ArticleRow, SessionContext, Word, DataError
+from scraperdb import Article as ArticleRow, SessionContext, Word, Trigram, DataError
 from fetcher import Fetcher
 from tokenizer import TOK
-from fastparser import Fast_Parser, ParseError, ParseForestNavigator, ParseForestDumper
+from fastparser import Fast_Parser, ParseError, ParseForestNavigator
 from incparser import IncrementalParser
+from tree import pack_tree, TreeTokenList
+import metrics
 
 
 WordTuple = namedtuple("WordTuple", ["stem", "cat"])
@@ -318,12 +320,12 @@ class Article:
                             # The entity name
                             yield t["x"]
 
-    def _store_words(self, session):
-        """ Store word stems """
+    def _store_words(self, session, new = False):
+        """ Store word stems. If new is True, the article has just been
+            inserted and has no previously stored words. """
         assert session is not None
-        # Delete previously stored words for this article
-        session.execute(Word.table().delete().where(Word.article_id == self._uuid))
-        # Index the words by storing them in the words table
+        # Collect the interesting words, to be indexed in the words table
+        words = dict()
         for word, cnt in self._words.items():
             if word.cat not in _CATEGORIES_TO_INDEX:
                 # We do not index closed word categories and non-distinctive constructs
@@ -331,18 +333,45 @@ class Article:
             if (word.stem, word.cat) in NoIndexWords.SET:
                 # Specifically excluded from indexing in Reynir.conf (Main.conf)
                 continue
-            # Interesting word: let's index it
-            w = Word(
-                article_id = self._uuid,
-                stem = word.stem,
-                cat = word.cat,
-                cnt = cnt
-            )
-            session.add(w)
+            words[(word.stem, word.cat)] = cnt
+        if new:
+            # Make sure the article row exists before referring to it
+            session.flush()
+        elif Settings.WORDS_DIFF:
+            # Only write the rows that have changed since the previous parse
+            old = Word.counts(session, self._uuid)
+            stale = [ key for key, cnt in old.items() if words.get(key) != cnt ]
+            if stale:
+                Word.delete_many(session, self._uuid, stale)
+            words = { key : cnt for key, cnt in words.items() if old.get(key) != cnt }
+        else:
+            # Delete previously stored words for this article
+            Word.delete_many(session, self._uuid)
+        if words:
+            Word.insert_many(session, self._uuid,
+                ((stem, cat, cnt) for (stem, cat), cnt in words.items()))
+
+    @staticmethod
+    def _count_trigrams(tree_data):
+        """ Return a Counter of the trigrams in a stored article tree """
+        counts = Counter()
+        if tree_data:
+            tree = TreeTokenList()
+            tree.load(tree_data)
+            counts.update(Trigram.key(*tg) for tg in tree.trigrams())
+        return counts
+
+    def _store_trigrams(self, session, old_tree = None):
+        """ Update the trigrams table with the difference between the
+            trigrams of the current tree and those of the previously stored one """
+        assert session is not None
+        deltas = self._count_trigrams(self._tree)
+        deltas.subtract(self._count_trigrams(old_tree))
+        Trigram.adjust(session, deltas)
 
     def _parse(self, enclosing_session = None, verbose = False):
         """ Parse the article content to yield parse trees and annotated token list """
-        with SessionContext(enclosing_session) as session:
+        with SessionContext(enclosing_session) as session, metrics.collect("article"):
 
             # Convert the content soup to a token iterable (generator)
             toklist = Fetcher.tokenize_html(self._url, self._html, session)
@@ -372,7 +401,7 @@ class Article:
 
                     if sent.parse():
                         # Obtain a text representation of the parse tree
-                        trees[num_sent] = ParseForestDumper.dump_forest(sent.tree)
+                        trees[num_sent] = sent.tree_dump
                         pgs[-1].append(Article._dump_tokens(sent.tokens, sent.tree, words))
                     else:
                         # Error or no parse: add an error index entry for this sentence
@@ -394,8 +423,9 @@ class Article:
             self._tokens = json.dumps(pgs, separators = (',', ':'), ensure_ascii = False)
             self._words = words
             # self._tokens = "[" + ",\n".join("[" + ",\n".join(sent for sent in p) + "]" for p in pgs) + "]"
-            # Create a tree representation string out of all the accumulated parse trees
-            self._tree = "".join("S{0}\n{1}\n".format(key, val) for key, val in trees.items())
+            # Create a tree representation string out of all the accumulated parse trees,
+            # and store it in the compact binary encoding (see tree.py)
+            self._tree = pack_tree("".join("S{0}\n{1}\n".format(key, val) for key, val in trees.items()))
 
 
     def store(self, enclosing_session = None):
@@ -430,7 +460,10 @@ class Article:
                 session.add(ar)
                 if self._words:
                     # Store the word stems occurring in the article
-                    self._store_words(session)
+                    self._store_words(session, new = True)
+                if self._tree and Settings.TRIGRAMS_INCREMENTAL:
+                    # Add the trigrams of the article to the trigrams table
+                    self._store_trigrams(session)
                 return True
 
             # Update an already existing row by UUID
@@ -459,6 +492,7 @@ class Article:
             ar.num_parsed = self._num_parsed
             ar.ambiguity = self._ambiguity
             ar.html = self._html
+            old_tree = ar.tree
             ar.tree = self._tree
             ar.tokens = self._tokens
             if self._words is not None:
@@ -466,6 +500,9 @@ class Article:
                 # (This may cause all stems for the article to be deleted, if
                 # there are no successfully parsed sentences in the article)
                 self._store_words(session)
+            if old_tree != self._tree and Settings.TRIGRAMS_INCREMENTAL:
+                # The article has been reparsed: replace its trigrams
+                self._store_trigrams(session, old_tree)
             return True
 
     def prepare(self, enclosing_session = None, verbose = False, reload_parser = False):
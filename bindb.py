@@ -24,14 +24,13 @@
     for handling missing words.
 
     The database is assumed to be stored in PostgreSQL. It is accessed via
-    the Psycopg2 connector.
+    the Psycopg2 connector. If a prebuilt, memory-mapped lexicon file is
+    available (see binlexicon.py), it is used instead of the database.
 
 """
 
 from functools import lru_cache
-from collections import namedtuple
-from heapq import nsmallest
-from operator import itemgetter
+from collections import namedtuple, defaultdict, OrderedDict
 import threading
 
 # Import the Psycopg2 connector for PostgreSQL
@@ -46,6 +45,8 @@ except ImportError:
 
 from settings import Settings, Abbreviations, AdjectiveTemplate, Meanings, StaticPhrases
 from dawgdictionary import Wordbase
+from binlexicon import BIN_Lexicon
+import metrics
 
 # Make Psycopg2 and PostgreSQL happy with UTF-8
 psycopg2ext.register_type(psycopg2ext.UNICODE)
@@ -62,44 +63,153 @@ BIN_Meaning = namedtuple('BIN_Meaning', ['stofn', 'utg', 'ordfl', 'fl', 'ordmynd
 
 class LFU_Cache:
 
-    """ Least-frequently-used (LFU) cache for word lookups.
-        Based on a pattern by Raymond Hettinger:
-        http://code.activestate.com/recipes/498245-lru-and-lfu-cache-decorators/
-    """
+    """ Least-frequently-used (LFU) cache for word lookups, with
+        constant-time lookup, insertion and eviction.
+
+        Keys are kept in frequency buckets, i.e. ordered dictionaries
+        of keys that have been accessed the same number of times.
+        When the cache is full, the least recently used key in the
+        bucket with the lowest frequency is evicted. See K. Shah,
+        A. Mitra, D. Matani: "An O(1) algorithm for implementing the
+        LFU cache eviction scheme", 2010.
 
-    class Counter(dict):
-        """ Mapping where default values are zero """
-        def __missing__(self, key):
-            return 0
+        The function that obtains data for a missing key is called outside
+        the cache lock, so that lookups in multiple threads do not serialize
+        on database round trips. Concurrent lookups of the same missing key
+        wait for a single call to complete instead of repeating it.
+    """
 
-    def __init__(self, maxsize = CACHE_SIZE):
-        self.cache = {}                     # Mapping of keys to results
-        self.use_count = self.Counter()     # Times each key has been accessed
+    class _Pending:
+        """ A lookup in progress, which other threads can wait for """
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.ok = False
+
+    def __init__(self, maxsize = CACHE_SIZE, name = "cache"):
+        self.cache = {}                     # Mapping of keys to [result, frequency]
+        self._buckets = defaultdict(OrderedDict) # Frequency -> keys with that frequency
+        self._min_freq = 0                  # Lowest frequency in the cache
+        self._pending = {}                  # Keys being looked up -> _Pending
         self.maxsize = maxsize
-        self.hits = self.misses = 0
+        self.hits = self.misses = self.evictions = self.waits = 0
         self.lock = threading.Lock()        # The cache may be accessed in parallel by multiple threads
+        # Names of the per-unit-of-work hit and miss counters (see metrics.py)
+        self._hits_metric = name + ".hits"
+        self._misses_metric = name + ".misses"
+
+    def _touch(self, key, entry):
+        """ Increment the use frequency of a cached key (lock must be held) """
+        freq = entry[1]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        entry[1] = freq + 1
+        self._buckets[freq + 1][key] = None
+
+    def _insert(self, key, result):
+        """ Add a key to the cache, evicting if necessary (lock must be held) """
+        if key in self.cache:
+            return
+        if len(self.cache) >= self.maxsize:
+            # Evict the least recently used key among the least frequently used ones
+            bucket = self._buckets[self._min_freq]
+            evicted, _ = bucket.popitem(last = False)
+            if not bucket:
+                del self._buckets[self._min_freq]
+            del self.cache[evicted]
+            self.evictions += 1
+        self.cache[key] = [ result, 1 ]
+        self._buckets[1][key] = None
+        self._min_freq = 1
 
     def lookup(self, key, func):
         """ Lookup a key in the cache, calling func(key) to obtain the data if not already there """
         with self.lock:
-            self.use_count[key] += 1
-            # Get cache entry or compute if not found
-            try:
-                result = self.cache[key]
+            entry = self.cache.get(key)
+            if entry is not None:
                 self.hits += 1
-            except KeyError:
-                result = func(key)
-                self.cache[key] = result
+                self._touch(key, entry)
+                metrics.add(self._hits_metric)
+                return entry[0]
+            pending = self._pending.get(key)
+            if pending is None:
+                # We're the first to look for this key: do the lookup ourselves
+                pending = self._pending[key] = LFU_Cache._Pending()
+                owner = True
                 self.misses += 1
-
-                # Purge the 10% least frequently used cache entries
-                if len(self.cache) > self.maxsize:
-                    for key, _ in nsmallest(self.maxsize // 10,
-                        self.use_count.items(), key = itemgetter(1)):
-
-                        del self.cache[key], self.use_count[key]
-
-            return result
+            else:
+                # Another thread is already looking for this key
+                owner = False
+                self.waits += 1
+        metrics.add(self._misses_metric)
+        if not owner:
+            pending.event.wait()
+            if pending.ok:
+                return pending.result
+            # The other thread's lookup failed: try again on our own
+            return func(key)
+        try:
+            result = func(key)
+            pending.result = result
+            pending.ok = True
+        finally:
+            with self.lock:
+                if pending.ok:
+                    self._insert(key, result)
+                del self._pending[key]
+            pending.event.set()
+        return result
+
+    def prefetch(self, keys, func):
+        """ Add the keys that are not already in the cache, calling func(keys)
+            once for all of them to obtain a dictionary of results """
+        with self.lock:
+            missing = [ key for key in set(keys)
+                if key not in self.cache and key not in self._pending ]
+            if not missing:
+                return
+            pendings = [ ]
+            for key in missing:
+                pending = self._pending[key] = LFU_Cache._Pending()
+                pendings.append(pending)
+            self.misses += len(missing)
+        metrics.add(self._misses_metric, len(missing))
+        results = None
+        try:
+            results = func(missing)
+        finally:
+            with self.lock:
+                for key, pending in zip(missing, pendings):
+                    if results is not None:
+                        pending.result = results.get(key)
+                        pending.ok = True
+                        self._insert(key, pending.result)
+                    del self._pending[key]
+            for pending in pendings:
+                pending.event.set()
+
+    @property
+    def hit_ratio(self):
+        """ Return the ratio of lookups that were served from the cache """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """ Return a dictionary of cache statistics """
+        with self.lock:
+            return dict(
+                size = len(self.cache),
+                maxsize = self.maxsize,
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions,
+                waits = self.waits,
+                hit_ratio = self.hit_ratio
+            )
 
 
 class BIN_Db:
@@ -118,6 +228,8 @@ class BIN_Db:
     # Query strings
     _DB_Q_MEANINGS = "select stofn, utg, ordfl, fl, ordmynd, beyging " \
         "from " + _DB_TABLE + " where ordmynd=(%s);"
+    _DB_Q_MEANINGS_MULTI = "select stofn, utg, ordfl, fl, ordmynd, beyging " \
+        "from " + _DB_TABLE + " where ordmynd = any(%s);"
     _DB_Q_FORMS = "select stofn, utg, ordfl, fl, ordmynd, beyging " \
         "from " + _DB_TABLE + " where stofn=(%s);"
     _DB_Q_UTG = "select stofn, utg, ordfl, fl, ordmynd, beyging " \
@@ -131,8 +243,16 @@ class BIN_Db:
     _ADJECTIVE_TEST = "leg" # Check for adjective if word contains 'leg'
 
     # Singleton LFU caches for word meaning and form lookups
-    _meanings_cache = LFU_Cache(maxsize = CACHE_SIZE_MEANINGS)
-    _forms_cache = LFU_Cache()
+    _meanings_cache = LFU_Cache(maxsize = CACHE_SIZE_MEANINGS, name = "bin.meanings")
+    _forms_cache = LFU_Cache(name = "bin.forms")
+
+    @classmethod
+    def cache_stats(cls):
+        """ Return statistics for the word meaning and form caches """
+        return dict(
+            meanings = cls._meanings_cache.stats(),
+            forms = cls._forms_cache.stats()
+        )
 
     @classmethod
     def get_db(cls):
@@ -156,12 +276,20 @@ class BIN_Db:
         """ Initialize DB connection instance """
         self._conn = None # Connection
         self._c = None # Cursor
+        self._lex = None # Embedded lexicon, if used instead of the database
         # Cache descriptors for the lookup functions
         self._meanings_func = lambda key: self._meanings_cache.lookup(key, getattr(self, "_meanings"))
         self._forms_func = lambda key: self._forms_cache.lookup(key, getattr(self, "_forms"))
 
     def open(self, host):
-        """ Open and initialize a database connection """
+        """ Open and initialize a database connection, unless the
+            embedded lexicon is available, in which case it is used instead """
+        if Settings.BIN_LEXICON:
+            self._lex = BIN_Lexicon.get()
+            if self._lex is not None:
+                # No database connection required
+                return self
+
         self._conn = psycopg2.connect(dbname=BIN_Db._DB_NAME,
             user=BIN_Db._DB_USER, password=BIN_Db._DB_PWD,
             host=host, client_encoding="utf8")
@@ -178,55 +306,93 @@ class BIN_Db:
 
     def close(self):
         """ Close the DB connection and the associated cursor """
-        self._c.close()
-        self._conn.close()
+        if self._c is not None:
+            self._c.close()
+            self._conn.close()
         self._c = self._conn = None
+        self._lex = None
         if BIN_Db.tls.bin_db is self:
             BIN_Db.tls.bin_db = None
 
+    @staticmethod
+    def _finish_meanings(w, g):
+        """ Convert raw (stofn, utg, ordfl, fl, ordmynd, beyging) rows for
+            the word form w into a list of BIN_Meaning tuples, adding
+            meanings from the settings file and sorting by priority """
+        m = list(map(BIN_Meaning._make, g))
+        if w in Meanings.DICT:
+            # There are additional word meanings in the Meanings dictionary,
+            # coming from the settings file: append them
+            m.extend([ BIN_Meaning._make(add_m) for add_m in Meanings.DICT[w] ])
+        # Order the meanings by priority, so that the most
+        # common/likely ones are first in the list and thus
+        # matched more readily than the less common ones
+        def priority(m):
+            # Order "VH" verbs (viðtengingarháttur) after other forms
+            # Also order past tense ("ÞT") after present tense
+            # and plural after singular
+            if m.ordfl != "so":
+                return 0
+            prio = 4 if "VH" in m.beyging else 0
+            prio += 2 if "ÞT" in m.beyging else 0
+            prio += 1 if "FT" in m.beyging else 0
+            return prio
+        m.sort(key = priority)
+        return m
+
     def _meanings(self, w):
         """ Return a list of all possible grammatical meanings of the given word """
-        assert self._c is not None
         m = None
         try:
-            self._c.execute(BIN_Db._DB_Q_MEANINGS, [ w ])
-            # Map the returned data from fetchall() to a list of instances
-            # of the BIN_Meaning namedtuple
-            g = self._c.fetchall()
+            if self._lex is not None:
+                g = self._lex.lookup(w)
+            else:
+                assert self._c is not None
+                self._c.execute(BIN_Db._DB_Q_MEANINGS, [ w ])
+                g = self._c.fetchall()
             if g is not None:
-                m = list(map(BIN_Meaning._make, g))
-                if w in Meanings.DICT:
-                    # There are additional word meanings in the Meanings dictionary,
-                    # coming from the settings file: append them
-                    m.extend([ BIN_Meaning._make(add_m) for add_m in Meanings.DICT[w] ])
-                # Order the meanings by priority, so that the most
-                # common/likely ones are first in the list and thus
-                # matched more readily than the less common ones
-                def priority(m):
-                    # Order "VH" verbs (viðtengingarháttur) after other forms
-                    # Also order past tense ("ÞT") after present tense
-                    # and plural after singular
-                    if m.ordfl != "so":
-                        return 0
-                    prio = 4 if "VH" in m.beyging else 0
-                    prio += 2 if "ÞT" in m.beyging else 0
-                    prio += 1 if "FT" in m.beyging else 0
-                    return prio
-                m.sort(key = priority)
+                m = BIN_Db._finish_meanings(w, g)
         except (psycopg2.DataError, psycopg2.ProgrammingError) as e:
             print("Word {0} causing DB exception {1}".format(w, e))
             m = None
         return m
 
+    def _meanings_multi(self, wlist):
+        """ Return a dictionary of the meanings of each of the word forms
+            in the given list, using a single database query """
+        result = dict()
+        try:
+            if self._lex is not None:
+                for w in wlist:
+                    result[w] = BIN_Db._finish_meanings(w, self._lex.lookup(w))
+                return result
+            assert self._c is not None
+            self._c.execute(BIN_Db._DB_Q_MEANINGS_MULTI, [ list(wlist) ])
+            rows = dict()
+            for r in self._c.fetchall():
+                # Group the rows by word form (ordmynd)
+                rows.setdefault(r[4], []).append(r)
+            for w in wlist:
+                result[w] = BIN_Db._finish_meanings(w, rows.get(w, []))
+        except (psycopg2.DataError, psycopg2.ProgrammingError) as e:
+            print("Word list {0} causing DB exception {1}".format(wlist, e))
+            # Fall back to looking up the words one by one
+            for w in wlist:
+                result[w] = self._meanings(w)
+        return result
+
     def _forms(self, w):
         """ Return a list of all possible forms of a particular root (stem) """
-        assert self._c is not None
         m = None
         try:
-            self._c.execute(BIN_Db._DB_Q_FORMS, [ w ])
-            # Map the returned data from fetchall() to a list of instances
+            if self._lex is not None:
+                g = self._lex.lookup_stem(w)
+            else:
+                assert self._c is not None
+                self._c.execute(BIN_Db._DB_Q_FORMS, [ w ])
+                g = self._c.fetchall()
+            # Map the returned data to a list of instances
             # of the BIN_Meaning namedtuple
-            g = self._c.fetchall()
             if g is not None:
                 m = list(map(BIN_Meaning._make, g))
                 if w in Meanings.ROOT:
@@ -241,16 +407,19 @@ class BIN_Db:
     @lru_cache(maxsize = CACHE_SIZE)
     def lookup_utg(self, utg, beyging = None):
         """ Return a list of meanings with the given integer id ('utg' column) """
-        assert self._c is not None
         m = None
         try:
-            if beyging:
-                self._c.execute(BIN_Db._DB_Q_UTG_BEYGING, [ utg, beyging ])
+            if self._lex is not None:
+                g = self._lex.lookup_utg(utg, beyging or None)
             else:
-                self._c.execute(BIN_Db._DB_Q_UTG, [ utg ])
-            # Map the returned data from fetchall() to a list of instances
+                assert self._c is not None
+                if beyging:
+                    self._c.execute(BIN_Db._DB_Q_UTG_BEYGING, [ utg, beyging ])
+                else:
+                    self._c.execute(BIN_Db._DB_Q_UTG, [ utg ])
+                g = self._c.fetchall()
+            # Map the returned data to a list of instances
             # of the BIN_Meaning namedtuple
-            g = self._c.fetchall()
             if g is not None:
                 m = list(map(BIN_Meaning._make, g))
         except (psycopg2.DataError, psycopg2.ProgrammingError) as e:
@@ -262,6 +431,24 @@ class BIN_Db:
         """ Given a word form, look up all its possible meanings """
         return self._lookup(w, at_sentence_start, auto_uppercase, self._meanings_func)
 
+    def lookup_words(self, words, auto_uppercase = False):
+        """ Look up the meanings of a batch of word forms, such as those of a
+            sentence, with a single query for all forms that are not already
+            in the meanings cache. Returns a dictionary of word forms and their
+            meanings. This also prepares the cache for subsequent lookup_word()
+            calls, including lowercase and, if auto_uppercase is True,
+            capitalized variants of the words. """
+        forms = set()
+        for w in words:
+            forms.add(w)
+            lower_w = w.lower()
+            if lower_w != w:
+                forms.add(lower_w)
+            elif auto_uppercase and len(w) > 1:
+                forms.add(w.capitalize())
+        self._meanings_cache.prefetch(forms, self._meanings_multi)
+        return { w : self._meanings_func(w) for w in words }
+
     def lookup_form(self, w, at_sentence_start):
         """ Given a word root (stem), look up all its forms """
         return self._lookup(w, at_sentence_start, False, self._forms_func)
@@ -269,14 +456,17 @@ class BIN_Db:
     @lru_cache(maxsize = CACHE_SIZE)
     def lookup_name_gender(self, name):
         """ Given a person name, lookup its gender """
-        assert self._c is not None
         if not name:
             return "hk" # Unknown gender
         w = name.split(maxsplit = 1)[0] # First name
         try:
             # Query the database for the first name
-            self._c.execute(BIN_Db._DB_Q_NAMES, [ w ])
-            g = self._c.fetchall()
+            if self._lex is not None:
+                g = [ m for m in self._lex.lookup_stem(w) if m[3] == "ism" ]
+            else:
+                assert self._c is not None
+                self._c.execute(BIN_Db._DB_Q_NAMES, [ w ])
+                g = self._c.fetchall()
             if g is not None:
                 # Appear to have found some ism entries where stofn=w
                 m = next(map(BIN_Meaning._make, g), None)
@@ -0,0 +1,276 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Embedded BIN lexicon module
+
+    Copyright (C) 2016 Vilhjálmur Þorsteinsson
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module provides read-only access to a compact binary image of the
+    BIN (Beygingarlýsing íslensks nútímamáls) word form table. The image
+    is built offline from a CSV export of the 'ord' table by
+    utils/binlexbuilder.py and is memory-mapped at run time, so its pages
+    are shared between all processes that use it. When present, it
+    replaces per-word PostgreSQL queries in bindb.py.
+
+    The file layout is as follows (all integers are 32-bit little-endian):
+
+    Signature           16 bytes, "Reynir BINlex01\n"
+    Header              num_strings, num_records, num_forms,
+                        and the byte offsets of the string offsets, string data,
+                        records, stem index and utg index sections
+    Form index          (num_forms + 1) x (string index of form, first record),
+                        sorted by the UTF-8 bytes of the form
+    String offsets      (num_strings + 1) x UINT, into the string data
+    String data         UTF-8 encoded strings, back to back
+    Records             num_records x (stofn, ordmynd, ordfl, fl, beyging, utg),
+                        where all but utg are string indices, sorted by ordmynd
+    Stem index          num_records x UINT, record indices sorted by stofn
+    Utg index           num_records x UINT, record indices sorted by utg
+
+"""
+
+import os
+import mmap
+import struct
+import threading
+
+
+class BIN_Lexicon:
+
+    """ Read-only, memory-mapped lexicon of BIN word forms """
+
+    SIGNATURE = "Reynir BINlex01\n".encode('ascii') # 16 bytes
+    LEXICON_FILE = os.path.join("resources", "ord.lexicon")
+
+    _HEADER = struct.Struct("<8I")
+    _UINT = struct.Struct("<I")
+    _UINT2 = struct.Struct("<2I")
+    _RECORD = struct.Struct("<5Ii")
+
+    # Singleton instance, or False if the lexicon file is not available
+    _lexicon = None
+    _lock = threading.Lock()
+
+    def __init__(self, fname):
+        self._fname = fname
+        with open(fname, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[0:16] != self.SIGNATURE:
+            mm.close()
+            raise ValueError("{0} is not a BIN lexicon file".format(fname))
+        (self._num_strings, self._num_records, self._num_forms,
+            self._off_stroffsets, self._off_strdata, self._off_records,
+            self._off_stems, self._off_utg) = self._HEADER.unpack_from(mm, 16)
+        self._off_forms = 16 + self._HEADER.size
+        # Cache of decoded strings for the small vocabularies of
+        # word categories (ordfl), fields (fl) and inflections (beyging),
+        # ensuring that each such string exists only once in memory
+        self._interned = dict()
+
+    @classmethod
+    def get(cls):
+        """ Return the singleton lexicon instance, or None if not available """
+        if cls._lexicon is None:
+            with cls._lock:
+                if cls._lexicon is None:
+                    lex = False
+                    if os.path.isfile(cls.LEXICON_FILE):
+                        try:
+                            lex = cls(cls.LEXICON_FILE)
+                        except (IOError, OSError, ValueError) as e:
+                            print("Unable to load BIN lexicon {0}: {1}".format(cls.LEXICON_FILE, e))
+                    # Do not assign the singleton until fully loaded
+                    cls._lexicon = lex
+        return cls._lexicon or None
+
+    def _bytes(self, ix):
+        """ Return the UTF-8 bytes of the string with the given index """
+        start, end = self._UINT2.unpack_from(self._mm, self._off_stroffsets + 4 * ix)
+        base = self._off_strdata
+        return self._mm[base + start : base + end]
+
+    def _str(self, ix):
+        """ Return the string with the given index """
+        return self._bytes(ix).decode('utf-8')
+
+    def _interned_str(self, ix):
+        """ Return the string with the given index, from the interned set """
+        s = self._interned.get(ix)
+        if s is None:
+            s = self._interned[ix] = self._bytes(ix).decode('utf-8')
+        return s
+
+    def _record(self, rix):
+        """ Return the raw record with the given index """
+        return self._RECORD.unpack_from(self._mm, self._off_records + rix * self._RECORD.size)
+
+    def _meaning(self, rix, ordmynd = None):
+        """ Return a (stofn, utg, ordfl, fl, ordmynd, beyging) tuple for the given record """
+        stofn, form, ordfl, fl, beyging, utg = self._record(rix)
+        return (self._str(stofn), utg, self._interned_str(ordfl),
+            self._interned_str(fl), ordmynd or self._str(form), self._interned_str(beyging))
+
+    def _bisect(self, lo, hi, key, keyfunc):
+        """ Return the lowest index i in [lo, hi) where keyfunc(i) >= key """
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keyfunc(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _form_entry(self, i):
+        """ Return the (string index, first record) entry for form i """
+        return self._UINT2.unpack_from(self._mm, self._off_forms + 8 * i)
+
+    def _stem_record(self, i):
+        """ Return the record index at position i of the stem index """
+        return self._UINT.unpack_from(self._mm, self._off_stems + 4 * i)[0]
+
+    def _utg_record(self, i):
+        """ Return the record index at position i of the utg index """
+        return self._UINT.unpack_from(self._mm, self._off_utg + 4 * i)[0]
+
+    def lookup(self, w):
+        """ Return a list of meaning tuples for the given word form """
+        key = w.encode('utf-8')
+        n = self._num_forms
+        i = self._bisect(0, n, key, lambda i: self._bytes(self._form_entry(i)[0]))
+        if i >= n or self._bytes(self._form_entry(i)[0]) != key:
+            return []
+        first = self._form_entry(i)[1]
+        last = self._form_entry(i + 1)[1] # There is a sentinel entry at the end
+        return [ self._meaning(rix, w) for rix in range(first, last) ]
+
+    def lookup_stem(self, stofn):
+        """ Return a list of meaning tuples for all forms of the given stem """
+        key = stofn.encode('utf-8')
+        n = self._num_records
+        stem_key = lambda i: self._bytes(self._record(self._stem_record(i))[0])
+        i = self._bisect(0, n, key, stem_key)
+        result = []
+        while i < n and stem_key(i) == key:
+            result.append(self._meaning(self._stem_record(i)))
+            i += 1
+        return result
+
+    def lookup_utg(self, utg, beyging = None):
+        """ Return a list of meaning tuples with the given integer id,
+            optionally only those with the given inflection """
+        n = self._num_records
+        utg_key = lambda i: self._record(self._utg_record(i))[5]
+        i = self._bisect(0, n, utg, utg_key)
+        result = []
+        while i < n and utg_key(i) == utg:
+            m = self._meaning(self._utg_record(i))
+            if beyging is None or m[5] == beyging:
+                result.append(m)
+            i += 1
+        return result
+
+    @property
+    def num_forms(self):
+        """ Return the number of distinct word forms in the lexicon """
+        return self._num_forms
+
+    @property
+    def num_records(self):
+        """ Return the number of word meanings in the lexicon """
+        return self._num_records
+
+    def close(self):
+        """ Release the memory map """
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @staticmethod
+    def write(fname, rows):
+        """ Write a lexicon file from an iterable of
+            (stofn, utg, ordfl, fl, ordmynd, beyging) tuples """
+
+        strings = dict() # String -> index
+        records = []
+
+        def intern(s):
+            ix = strings.get(s)
+            if ix is None:
+                ix = strings[s] = len(strings)
+            return ix
+
+        for stofn, utg, ordfl, fl, ordmynd, beyging in rows:
+            records.append((intern(stofn), intern(ordmynd), intern(ordfl),
+                intern(fl), intern(beyging), int(utg)))
+
+        # Encode the string table
+        encoded = [ None ] * len(strings)
+        for s, ix in strings.items():
+            encoded[ix] = s.encode('utf-8')
+        strings = None
+
+        # Sort the records by the UTF-8 bytes of the word form,
+        # which is also the comparison used by the lookup functions
+        records.sort(key = lambda r: encoded[r[1]])
+
+        # Build the form index, with a sentinel entry at the end
+        forms = []
+        last_form = None
+        for rix, r in enumerate(records):
+            if r[1] != last_form:
+                forms.append((r[1], rix))
+                last_form = r[1]
+        forms.append((0, len(records)))
+
+        stems = sorted(range(len(records)), key = lambda rix: encoded[records[rix][0]])
+        utgs = sorted(range(len(records)), key = lambda rix: records[rix][5])
+
+        hdr = BIN_Lexicon._HEADER
+        num_strings = len(encoded)
+        off_forms = 16 + hdr.size
+        off_stroffsets = off_forms + 8 * len(forms)
+        off_strdata = off_stroffsets + 4 * (num_strings + 1)
+        off_records = off_strdata + sum(len(b) for b in encoded)
+        off_stems = off_records + BIN_Lexicon._RECORD.size * len(records)
+        off_utg = off_stems + 4 * len(records)
+
+        # Write to a temporary file and rename it when complete, since
+        # running processes may have the previous version memory-mapped
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as f:
+            f.write(BIN_Lexicon.SIGNATURE)
+            f.write(hdr.pack(num_strings, len(records), len(forms) - 1,
+                off_stroffsets, off_strdata, off_records, off_stems, off_utg))
+            for entry in forms:
+                f.write(BIN_Lexicon._UINT2.pack(*entry))
+            offset = 0
+            for b in encoded:
+                f.write(BIN_Lexicon._UINT.pack(offset))
+                offset += len(b)
+            f.write(BIN_Lexicon._UINT.pack(offset))
+            for b in encoded:
+                f.write(b)
+            for r in records:
+                f.write(BIN_Lexicon._RECORD.pack(*r))
+            for rix in stems:
+                f.write(BIN_Lexicon._UINT.pack(rix))
+            for rix in utgs:
+                f.write(BIN_Lexicon._UINT.pack(rix))
+        os.replace(tmpname, fname)
+        return len(records), len(forms) - 1
+
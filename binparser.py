@@ -34,6 +34,7 @@ import time
 
 from datetime import datetime
 from functools import reduce
+from collections import defaultdict
 import json
 
 from tokenizer import TOK
@@ -156,10 +157,14 @@ class BIN_Token(Token):
     GENDERS_MAP = { "kk" : "KK", "kvk" : "KVK", "hk" : "HK" }
 
     VBIT_CASES = VBIT["nf"] | VBIT["þf"] | VBIT["þgf"] | VBIT["ef"]
+    VBIT_GENDERS = VBIT_KK | VBIT_KVK | VBIT_HK
 
     # Variants to be checked for verbs
     VERB_VARIANTS = ["p1", "p2", "p3", "nh", "vh", "lh", "bh", "fh",
         "sagnb", "lhþt", "nt", "kk", "kvk", "hk", "sb", "vb", "gm", "mm"]
+    VBIT_VERB_VARIANTS = reduce(lambda x, y: x | y, map(VBIT.__getitem__, VERB_VARIANTS), 0)
+    # Verb forms that only match terminals that explicitly specify them
+    VERB_RESTRICTIVE = ["sagnb", "lhþt", "bh"]
     # Pre-calculate a dictionary of associated BIN forms
     _VERB_FORMS = None # Initialized later
 
@@ -196,6 +201,20 @@ class BIN_Token(Token):
         "í", "á", "af", "um", "að", "með", "til", "frá", "búist", "annars", "samkvæmt", "en", "og",
         "sem"])
 
+    # Corporation identifiers, matched by the 'fyrirtæki' terminal
+    _CORPORATION_IDS = frozenset([
+        "ehf.", "ehf", "hf.", "hf",
+        "bs.", "bs", "sf.", "sf", "slhf.", "slhf", "slf.", "slf", "svf.", "svf", "ohf.", "ohf",
+        "Inc", "Inc.", "Incorporated",
+        "Corp", "Corp.", "Corporation",
+        "Ltd", "Ltd.", "Limited",
+        "Co", "Co.", "Company",
+        "AS", "ASA",
+        "SA", "S.A.",
+        "GmbH", "AG",
+        "SARL", "S.à.r.l."
+    ])
+
     # Numbers that can be used in the singular even if they are nominally plural.
     # This applies to the media company 365, where it is OK to say "365 skuldaði 389 milljónir",
     # as it would be incorrect to say "365 skulduðu 389 milljónir".
@@ -328,31 +347,16 @@ class BIN_Token(Token):
             # Make sure that the subject case (last variant) matches the terminal
             return subject_matches(terminal.variant(-1))
 
-        if terminal.is_singular and "FT" in form:
-            # Can't use plural verb if singular terminal
+        # print("verb_matches {0} terminal {1} form {2}".format(verb, terminal, form))
+        fbits = BIN_Token.get_fbits(form)
+        # Check that person (1st, 2nd, 3rd), number and other variant requirements match,
+        # and that the form has no restrictive variants (sagnb, lhþt, bh, and vb for lhþt)
+        # or a number that the terminal does not allow (see VariantHandler._compile())
+        if fbits & terminal.verb_forbidden:
             return False
-        if terminal.is_plural and "ET" in form:
-            # Can't use singular verb if plural terminal
+        required = terminal.verb_required
+        if (fbits & required) != required:
             return False
-        # print("verb_matches {0} terminal {1} form {2}".format(verb, terminal, form))
-        # Check that person (1st, 2nd, 3rd) and other variant requirements match
-        for v in terminal.variants:
-            # Lookup variant to see if it is one of the required ones for verbs
-            rq = BIN_Token._VERB_FORMS.get(v)
-            if rq is not None and not rq in form:
-                # If this is required variant that is not found in the form we have,
-                # return False
-                return False
-        # Check restrictive variants, i.e. we don't accept meanings
-        # that have those unless they are explicitly present in the terminal
-        for v in [ "sagnb", "lhþt", "bh" ]: # Be careful with "lh" here - !!! add mm?
-            if BIN_Token.VARIANT[v] in form and not terminal.has_variant(v):
-                return False
-        if terminal.is_lh:
-            if "VB" in form and not terminal.has_variant("vb"):
-                # We want only the strong declinations ("SB") of lhþt, not the weak ones,
-                # unless explicitly requested
-                return False
         if terminal.has_variant("bh") and "ST" in form:
             # We only want the explicit request forms (boðháttur), i.e. "bónaðu"/"bónið",
             # not "bóna" which causes ambiguity vs. the nominal mode (nafnháttur)
@@ -360,16 +364,17 @@ class BIN_Token(Token):
         # Check whether the verb token can potentially match the argument number
         # of the terminal in question. If the verb is known to take fewer
         # arguments than the terminal wants, this is not a match.
-        if terminal.variant(0) not in "012":
+        nargs = terminal.nargs
+        if nargs is None:
             # No argument number: all verbs match, except...
             if terminal.is_lh:
                 # Special check for lhþt: may specify a case without it being an argument case
-                if any(terminal.has_variant(c) and BIN_Token.VARIANT[c] not in form for c in BIN_Token.CASES):
+                cases = terminal.vbits & BIN_Token.VBIT_CASES
+                if (fbits & cases) != cases:
                     # Terminal specified a non-argument case but the token doesn't have it:
                     # no match
                     return False
             return True
-        nargs = int(terminal.variant(0))
         if verb in VerbObjects.VERBS[nargs]:
             # Seems to take the correct number of arguments:
             # do a further check on the supported cases
@@ -598,201 +603,182 @@ class BIN_Token(Token):
         """ An ordinal token matches an ordinal (raðnr) terminal """
         return terminal.first == "raðnr"
 
-    def matches_WORD(self, terminal):
-        """ Match a word token, having the potential part-of-speech meanings
-            from the BIN database, with the terminal """
-
-        def matcher_so(m):
-            """ Check verb """
-            if m.ordfl != "so":
-                return False
-            # Special case for verbs: match only the appropriate
-            # argument number, i.e. so_0 for verbs having no noun argument,
-            # so_1 for verbs having a single noun argument, and
-            # so_2 for verbs with two noun arguments. A verb may
-            # match more than one argument number category.
-            return self.verb_matches(m.stofn, terminal, m.beyging)
-
-        def matcher_no(m):
-            """ Check noun """
-            if BIN_Token._KIND[m.ordfl] != "no":
-                return False
-            no_info = m.beyging == "-"
-            if terminal.is_abbrev:
-                # Only match abbreviations; gender, case and number do not matter
-                return no_info
-            if m.fl == "nafn":
-                # Names are only matched by person terminals
-                return False
-            for v in terminal.variants:
-                if v in BIN_Token.GENDERS_SET:
-                    if m.ordfl != v:
-                        # Mismatched gender
-                        return False
-                elif no_info:
-                    # No case and number info: probably a foreign word
-                    # Match all cases and numbers
-                    #if v == "ft":
-                    #    return False
-                    if v == "gr":
-                        # Do not match a demand for the definitive article ('greinir')
-                        return False
-                elif BIN_Token.VARIANT[v] not in m.beyging:
-                    # Required case or number not found: no match
-                    return False
-            return True
-
-        def matcher_gata(m):
-            """ Check street name """
-            if m.fl != "göt": # Götuheiti
+    def _matcher_so(self, terminal, m):
+        """ Check verb """
+        if m.ordfl != "so":
+            return False
+        # Special case for verbs: match only the appropriate
+        # argument number, i.e. so_0 for verbs having no noun argument,
+        # so_1 for verbs having a single noun argument, and
+        # so_2 for verbs with two noun arguments. A verb may
+        # match more than one argument number category.
+        return self.verb_matches(m.stofn, terminal, m.beyging)
+
+    def _matcher_no(self, terminal, m):
+        """ Check noun """
+        if BIN_Token._KIND[m.ordfl] != "no":
+            return False
+        no_info = m.beyging == "-"
+        if terminal.is_abbrev:
+            # Only match abbreviations; gender, case and number do not matter
+            return no_info
+        if m.fl == "nafn":
+            # Names are only matched by person terminals
+            return False
+        for g in terminal.genders:
+            if m.ordfl != g:
+                # Mismatched gender
                 return False
-            if BIN_Token._KIND[m.ordfl] != "no":
+        if no_info:
+            # No case and number info: probably a foreign word
+            # Match all cases and numbers, but do not match a demand
+            # for the definitive article ('greinir')
+            return not terminal.has_vbits(BIN_Token.VBIT_GR)
+        # Required case, number and definite article must be found
+        required = terminal.noun_fbits
+        return (BIN_Token.get_fbits(m.beyging) & required) == required
+
+    def _matcher_gata(self, terminal, m):
+        """ Check street name """
+        if m.fl != "göt": # Götuheiti
+            return False
+        if BIN_Token._KIND[m.ordfl] != "no":
+            return False
+        for g in terminal.genders:
+            if m.ordfl != g:
+                # Mismatched gender
                 return False
-            for v in terminal.variants:
-                if v in BIN_Token.GENDERS_SET:
-                    if m.ordfl != v:
-                        # Mismatched gender
-                        return False
-                elif BIN_Token.VARIANT[v] not in m.beyging:
-                    # Required case or number not found: no match
-                    return False
-            return True
+        # Required case and number must be found
+        required = terminal.noun_fbits
+        return (BIN_Token.get_fbits(m.beyging) & required) == required
+
+    def _matcher_eo(self, terminal, m):
+        """ 'Einkunnarorð': adverb (atviksorð) that is not the same
+            as a preposition (forsetning) """
+        if m.ordfl != "ao":
+            return False
+        # This token can match an adverb:
+        # Cache whether it can also match a preposition
+        if self._is_eo is None:
+            if self.t1_lower in BIN_Token._NOT_EO:
+                # Explicitly forbidden, no need to check further
+                self._is_eo = False
+            elif self.t1_lower in BIN_Token._NOT_NOT_EO:
+                # Explicitly allowed, no need to check further
+                self._is_eo = True
+            else:
+                # Check whether also a preposition or pronoun and return False in that case
+                self._is_eo = not any(mm.ordfl in {"fs", "fn"} for mm in self.t2)
+        # Return True if this token cannot also match a preposition
+        return self._is_eo
 
-        def matcher_eo(m):
-            """ 'Einkunnarorð': adverb (atviksorð) that is not the same
-                as a preposition (forsetning) """
-            if m.ordfl != "ao":
-                return False
-            # This token can match an adverb:
-            # Cache whether it can also match a preposition
-            if self._is_eo is None:
-                if self.t1_lower in BIN_Token._NOT_EO:
-                    # Explicitly forbidden, no need to check further
-                    self._is_eo = False
-                elif self.t1_lower in BIN_Token._NOT_NOT_EO:
-                    # Explicitly allowed, no need to check further
-                    self._is_eo = True
-                else:
-                    # Check whether also a preposition or pronoun and return False in that case
-                    self._is_eo = not any(mm.ordfl in {"fs", "fn"} for mm in self.t2)
-            # Return True if this token cannot also match a preposition
-            return self._is_eo
-
-        def matcher_fs(m):
-            """ Check preposition """
-            if not terminal.num_variants:
-                return False
-            # Note that in the case of abbreviated prepositions,
-            # such as 'skv.' for 'samkvæmt', the full expanded form
-            # is found in m.stofn - not self.t1_lower or m.ordmynd
-            fs = self.t1_lower
-            if '.' in fs:
-                fs = m.stofn
-            # !!! Note that this will match a word and return True even if the
-            # meanings of the token (the list in self.t2) do not include
-            # the fs category. This effectively makes the prepositions
-            # exempt from the ambiguous_phrases optimization.
-            return fs in Prepositions.PP and terminal.variant(0) in Prepositions.PP[fs]
-
-        def matcher_person(m):
-            """ Check name from static phrases, coming from the Reynir.conf file """
-            if m.fl != "nafn":
-                return False
-            if terminal.has_vbits(BIN_Token.VBIT_HK):
-                # Never match neutral terminals
-                return False
-            # Check case, if present
-            if m.beyging != "-":
-                if any(BIN_Token.VARIANT[c] in m.beyging and not terminal.has_variant(c) for c in BIN_Token.CASES):
-                    # The name has an associated case, but this is not it: quit
-                    return False
-            if terminal.has_vbits(BIN_Token.VBIT_KK) and m.ordfl != "kk":
-                # Masculine specified but the name is feminine: no match
-                return False
-            if terminal.has_vbits(BIN_Token.VBIT_KVK) and m.ordfl != "kvk":
-                # Feminine specified but the name is masculine: no match
+    def _matcher_fs(self, terminal, m):
+        """ Check preposition """
+        if not terminal.num_variants:
+            return False
+        # Note that in the case of abbreviated prepositions,
+        # such as 'skv.' for 'samkvæmt', the full expanded form
+        # is found in m.stofn - not self.t1_lower or m.ordmynd
+        fs = self.t1_lower
+        if '.' in fs:
+            fs = m.stofn
+        # !!! Note that this will match a word and return True even if the
+        # meanings of the token (the list in self.t2) do not include
+        # the fs category. This effectively makes the prepositions
+        # exempt from the ambiguous_phrases optimization.
+        return fs in Prepositions.PP and terminal.variant(0) in Prepositions.PP[fs]
+
+    def _matcher_person(self, terminal, m):
+        """ Check name from static phrases, coming from the Reynir.conf file """
+        if m.fl != "nafn":
+            return False
+        vbits = terminal.vbits
+        if vbits & BIN_Token.VBIT_HK:
+            # Never match neutral terminals
+            return False
+        # Check case, if present
+        if m.beyging != "-":
+            if BIN_Token.get_fbits(m.beyging) & BIN_Token.VBIT_CASES & ~vbits:
+                # The name has an associated case, but this is not it: quit
                 return False
-            return True
+        if (vbits & BIN_Token.VBIT_KK) and m.ordfl != "kk":
+            # Masculine specified but the name is feminine: no match
+            return False
+        if (vbits & BIN_Token.VBIT_KVK) and m.ordfl != "kvk":
+            # Feminine specified but the name is masculine: no match
+            return False
+        return True
 
-        def matcher_corporation(m):
-            """ Check whether the token text matches a set of corporation identfiers """
-            # Note: these must have a meaning for this to work, so specifying them
-            # as abbreviations to Main.conf is recommended
-            return self.t1 in {
-                "ehf.", "ehf", "hf.", "hf",
-                "bs.", "bs", "sf.", "sf", "slhf.", "slhf", "slf.", "slf", "svf.", "svf", "ohf.", "ohf",
-                "Inc", "Inc.", "Incorporated",
-                "Corp", "Corp.", "Corporation",
-                "Ltd", "Ltd.", "Limited",
-                "Co", "Co.", "Company",
-                "AS", "ASA",
-                "SA", "S.A.",
-                "GmbH", "AG",
-                "SARL", "S.à.r.l."
-            }
-
-        def matcher_default(m):
-            """ Check other word categories """
-            if m.beyging != "-": # Tokens without a form specifier are assumed to be universally matching
-                # If the meaning is a noun, its gender is coded in the ordfl attribute
-                # In that case, add it to the beyging field so that the relevant fbits
-                # are included and can be matched against the terminal if it requires
-                # a gender
-                fbits = BIN_Token.get_fbits(m.beyging + BIN_Token.GENDERS_MAP.get(m.ordfl, ""))
-                # Check whether variants required by the terminal are present
-                # in the meaning string
-                if not terminal.fbits_match(fbits):
-                    return False
-            return terminal.matches_first(m.ordfl, m.stofn, self.t1_lower)
-
-        def matches_proper_name():
-            # Proper name?
-            # Only allow a potential interpretation as a proper name if
-            # the token is uppercase but there is no uppercase meaning of
-            # the word in BÍN. This excludes for instance "Ísland" which
-            # should be treated purely as a noun, not as a proper name.
-            #if any(m.ordmynd[0].isupper() and m.beyging != "-" for m in self.t2):
-            #    return False
-            if self.t1_lower in BIN_Token._NOT_PROPER_NAME:
+    def _matcher_corporation(self, terminal, m):
+        """ Check whether the token text matches a set of corporation identfiers """
+        # Note: these must have a meaning for this to work, so specifying them
+        # as abbreviations to Main.conf is recommended
+        return self.t1 in BIN_Token._CORPORATION_IDS
+
+    def _matcher_default(self, terminal, m):
+        """ Check other word categories """
+        if m.beyging != "-": # Tokens without a form specifier are assumed to be universally matching
+            # If the meaning is a noun, its gender is coded in the ordfl attribute
+            # In that case, add it to the beyging field so that the relevant fbits
+            # are included and can be matched against the terminal if it requires
+            # a gender
+            fbits = BIN_Token.get_fbits(m.beyging + BIN_Token.GENDERS_MAP.get(m.ordfl, ""))
+            # Check whether variants required by the terminal are present
+            # in the meaning string
+            if not terminal.fbits_match(fbits):
                 return False
-            if " " in self.t1_lower:
-                return False
-            if not terminal.num_variants:
-                return self.t2[0] if self.t2 else True # Return first meaning, or just plain True if no meanings
-            # The terminal is sérnafn_case: We only accept nouns or adjectives
-            # that match the given case
-            for m in self.t2:
-                fbits = BIN_Token.get_fbits(m.beyging) & BIN_Token.VBIT_CASES
-                if BIN_Token._KIND[m.ordfl] in {"no", "lo"} and terminal.fbits_match(fbits):
-                    return m # Return the matching meaning
+        return terminal.matches_first(m.ordfl, m.stofn, self.t1_lower)
+
+    def _matches_proper_name(self, terminal):
+        """ Check whether the token can be a proper name ('sérnafn') """
+        # Only allow a potential interpretation as a proper name if
+        # the token is uppercase but there is no uppercase meaning of
+        # the word in BÍN. This excludes for instance "Ísland" which
+        # should be treated purely as a noun, not as a proper name.
+        #if any(m.ordmynd[0].isupper() and m.beyging != "-" for m in self.t2):
+        #    return False
+        if self.t1_lower in BIN_Token._NOT_PROPER_NAME:
             return False
+        if " " in self.t1_lower:
+            return False
+        if not terminal.num_variants:
+            return self.t2[0] if self.t2 else True # Return first meaning, or just plain True if no meanings
+        # The terminal is sérnafn_case: We only accept nouns or adjectives
+        # that match the given case
+        for m in self.t2:
+            fbits = BIN_Token.get_fbits(m.beyging) & BIN_Token.VBIT_CASES
+            if BIN_Token._KIND[m.ordfl] in {"no", "lo"} and terminal.fbits_match(fbits):
+                return m # Return the matching meaning
+        return False
+
+    # Meaning matchers for word tokens, indexed by the matcher id of the terminal.
+    # The terminal categories in _WORD_MATCHER_CATEGORIES have special matchers;
+    # all other terminals use _matcher_default. The matcher for 'sérnafn' is None,
+    # since proper names are matched by _matches_proper_name().
+    _WORD_MATCHER_CATEGORIES = ("so", "no", "eo", "fs", "person", "gata", "fyrirtæki", "sérnafn")
+    _WORD_MATCHERS = (_matcher_default, _matcher_so, _matcher_no, _matcher_eo, _matcher_fs,
+        _matcher_person, _matcher_gata, _matcher_corporation, None)
+
+    def matches_WORD(self, terminal):
+        """ Match a word token, having the potential part-of-speech meanings
+            from the BIN database, with the terminal """
 
         # We have a match if any of the possible part-of-speech meanings
         # of this token match the terminal
         if self.t2:
-            # The dispatch table has to be constructed each time because
-            # the calls will have a wrong self pointer otherwise
-            matchers = {
-                "so" : matcher_so,
-                "no" : matcher_no,
-                "eo" : matcher_eo,
-                "fs" : matcher_fs,
-                "person" : matcher_person,
-                "gata" : matcher_gata, # Götuheiti = Street name
-                "fyrirtæki" : matcher_corporation, # Company identifier, i.e. hf., ehf., Inc., Corp. etc.
-                "sérnafn" : None
-            }
-            matcher = matchers.get(terminal.first, matcher_default)
-            if matcher:
+            matcher = BIN_Token._WORD_MATCHERS[terminal.matcher_id]
+            if matcher is not None:
                 # Return the first matching meaning, or False if none
                 # !!! TODO: Prioritize matching meanings, if more than one
                 # !!! Example: don't select a VH meaning for a verb if the
                 # !!! terminal doesn't specify VH; apply a priority between
                 # !!! different nouns that have the same spelling (incl. names)
-                return next((m for m in self.t2 if matcher(m)), False)
-                # return any(matcher(m) for m in self.t2)
+                for m in self.t2:
+                    if matcher(self, terminal, m):
+                        return m
+                return False
             # Terminal is a proper name ('sérnafn')
-            return self.is_upper and matches_proper_name()
+            return self.is_upper and self._matches_proper_name(terminal)
 
         # Unknown word, i.e. no meanings in BÍN (might be foreign, unknown name, etc.)
         if self.is_upper:
@@ -822,6 +808,52 @@ class BIN_Token(Token):
         TOK.WORD: matches_WORD
     }
 
+    # Terminal categories that can match tokens of each type, other than
+    # words and punctuation; see match_categories()
+    _MATCH_CATEGORIES = {
+        TOK.PERSON: frozenset(("person", "sérnafn")),
+        TOK.ENTITY: frozenset(("entity",)),
+        TOK.CURRENCY: frozenset(("no",)),
+        TOK.AMOUNT: frozenset(("no",)),
+        TOK.NUMBER: frozenset(("tala", "töl", "to")),
+        TOK.PERCENT: frozenset(("töl", "no")),
+        TOK.ORDINAL: frozenset(("raðnr",)),
+        TOK.YEAR: frozenset(("töl", "ártal", "tala")),
+        TOK.DATE: frozenset(("dags",)),
+        TOK.TIME: frozenset(("tími",)),
+        TOK.TIMESTAMP: frozenset(("tímapunktur",)),
+    }
+
+    def match_categories(self):
+        """ Return the set of terminal categories, i.e. first parts of terminal names,
+            that this token can possibly match. The token does not match any
+            terminal of another category. This mirrors the matches_XXX() functions
+            and allows a full token/terminal match table to be calculated by
+            checking only a fraction of the terminals. """
+        if self.t0 == TOK.PUNCTUATION:
+            # Literal terminals have the literal text as their first part
+            return { "punctuation", self.t1 }
+        if self.t0 != TOK.WORD:
+            return BIN_Token._MATCH_CATEGORIES.get(self.t0, frozenset())
+        if not self.t2:
+            # Unknown word
+            return { "sérnafn" } if self.is_upper else { "no" }
+        # Prepositions and corporation identifiers are matched by token text
+        cats = { "fs", "fyrirtæki", self.t1_lower }
+        if self.is_upper:
+            cats.add("sérnafn")
+        for m in self.t2:
+            cats.add(BIN_Token._KIND.get(m.ordfl, m.ordfl))
+            # Literal terminals match the word stem
+            cats.add(m.stofn)
+            if m.ordfl == "ao":
+                cats.add("eo")
+            if m.fl == "nafn":
+                cats.add("person")
+            elif m.fl == "göt":
+                cats.add("gata")
+        return cats
+
     @classmethod
     def is_understood(cls, t):
         """ Return True if the token type is understood by the BIN Parser """
@@ -908,6 +940,39 @@ class VariantHandler:
             self._cases = "".join("_" + self._vparts[1 + i] for i in range(ncases))
         else:
             self._cases = ""
+        self._compile()
+
+    def _compile(self):
+        """ Precompile the variants of this terminal into bit masks,
+            so that matching against BIN meanings can be done with
+            a few bitwise operations instead of string searches """
+        # Index of the word matcher for this terminal in BIN_Token._WORD_MATCHERS
+        cats = BIN_Token._WORD_MATCHER_CATEGORIES
+        self._matcher_id = cats.index(self._first) + 1 if self._first in cats else 0
+        # Genders required by the terminal, in variant order
+        self._genders = tuple(v for v in self._vparts if v in BIN_Token.GENDERS_SET)
+        # Noun forms must have all fbits of the terminal, except genders,
+        # which are coded in the word category of the meaning
+        self._noun_fbits = self._fbits & ~BIN_Token.VBIT_GENDERS
+        # Verb forms must have all verb variants of the terminal...
+        self._verb_required = self._vbits & BIN_Token.VBIT_VERB_VARIANTS
+        # ...and none of the restrictive variants that the terminal does not specify
+        bit = BIN_Token.VBIT
+        forbidden = reduce(lambda x, y: x | y,
+            (bit[v] for v in BIN_Token.VERB_RESTRICTIVE if v not in self._vset), 0)
+        if self.is_lh and "vb" not in self._vset:
+            # We want only the strong declinations ("SB") of lhþt, not the weak ones,
+            # unless explicitly requested
+            forbidden |= bit["vb"]
+        if self.is_singular:
+            # Can't use plural verb if singular terminal
+            forbidden |= BIN_Token.VBIT_FT
+        if self.is_plural:
+            # Can't use singular verb if plural terminal
+            forbidden |= BIN_Token.VBIT_ET
+        self._verb_forbidden = forbidden
+        # Number of verb arguments, i.e. so_0, so_1 or so_2, or None if not given
+        self._nargs = int(self._vparts[0]) if self._vcount >= 1 and self._vparts[0] in "012" else None
 
     def startswith(self, part):
         """ Returns True if the terminal name starts with the given string """
@@ -942,6 +1007,41 @@ class VariantHandler:
     def verb_cases(self):
         """ Return the verb cases associated with a so_ terminal, or empty string """
         return self._cases
+
+    @property
+    def matcher_id(self):
+        """ Return the index of the word matcher for this terminal """
+        return self._matcher_id
+
+    @property
+    def vbits(self):
+        """ Return the variant bits of this terminal """
+        return self._vbits
+
+    @property
+    def genders(self):
+        """ Return a tuple of the genders specified in the terminal name """
+        return self._genders
+
+    @property
+    def noun_fbits(self):
+        """ Return the fbits that a noun meaning must have to match this terminal """
+        return self._noun_fbits
+
+    @property
+    def verb_required(self):
+        """ Return the fbits that a verb form must have to match this terminal """
+        return self._verb_required
+
+    @property
+    def verb_forbidden(self):
+        """ Return the fbits that a verb form must not have to match this terminal """
+        return self._verb_forbidden
+
+    @property
+    def nargs(self):
+        """ Return the number of arguments of a so_ terminal, or None """
+        return self._nargs
     
     def has_variant(self, v):
         """ Returns True if the terminal name has the given variant """
@@ -1068,6 +1168,18 @@ class BIN_Grammar(Grammar):
     def __init__(self):
         super().__init__()
 
+    @property
+    def terminal_groups(self):
+        """ Return a dictionary of lists of (index, terminal) tuples, keyed by
+            the first part of the terminal name, i.e. the terminal category """
+        groups = getattr(self, "_terminal_groups", None)
+        if groups is None:
+            groups = defaultdict(list)
+            for ix, t in sorted(self.terminals_by_ix.items()):
+                groups[t.first].append((ix, t))
+            groups = self._terminal_groups = dict(groups)
+        return groups
+
     def _make_terminal(self, name):
         """ Make BIN_Terminal instances instead of plain-vanilla Terminals """
         return BIN_Terminal(name)
@@ -4,7 +4,9 @@
 DIR = '/usr/share/nginx/greynir.is/'
 
 bind = 'unix:' + DIR + 'gunicorn.sock'
-worker_class = 'eventlet'
+# Use real threads within each worker process: the C++ parser runs
+# without the GIL, so requests can be parsed in parallel threads
+worker_class = 'gthread'
 workers = 3
 threads = 2
 timeout = 120
@@ -16,7 +16,10 @@
     of storage and speed.
 
     The graph is pre-built and stored in a pickled file that
-    is loaded at run-time by DawgDictionary.
+    is loaded at run-time by DawgDictionary. Alternatively, it is stored
+    in a packed binary file that is memory-mapped at run-time by
+    PackedDawgDictionary, which avoids creating Python objects for the
+    graph nodes and allows the pages to be shared between processes.
 
 """
 
@@ -27,6 +30,9 @@ import time
 import pickle
 import platform
 import codecs
+import mmap
+import struct
+from functools import lru_cache
 
 
 class _Node:
@@ -40,6 +46,9 @@ class _Node:
 
 class DawgDictionary:
 
+    # Number of compound word slicing results to cache
+    _SLICE_CACHE_SIZE = 2048
+
     def __init__(self):
         # Initialize an empty graph
         # The root entry will eventually be self._nodes[0]
@@ -48,6 +57,8 @@ class DawgDictionary:
         self._index = 1
         # Lock to ensure that only one thread loads the dictionary
         self._lock = threading.Lock()
+        # Bounded cache of compound word slicing results, keyed by word
+        self._slice_cache = lru_cache(maxsize = self._SLICE_CACHE_SIZE)(self._slice_compound_word)
 
     def load(self, fname):
         """ Load a DAWG from a text file """
@@ -115,6 +126,10 @@ class DawgDictionary:
         with open(fname, "wb") as pf:
             pickle.dump(self._nodes, pf, pickle.HIGHEST_PROTOCOL)
 
+    def store_packed(self, fname):
+        """ Store a DAWG in a packed binary file, for use with PackedDawgDictionary """
+        PackedDawgDictionary.write(fname, self._nodes[0])
+
     def load_pickle(self, fname):
         """ Load a DAWG from a Python pickle file """
         with self._lock:
@@ -161,9 +176,12 @@ class DawgDictionary:
     def slice_compound_word(self, word):
         """ Attempt to slice an unknown word into parts, where each part is
             a valid word form in itself, and the parts form a valid compound word. """
-        nav = CompoundNavigator(self, word)
-        self.navigate(nav)
-        w = nav.result()
+        cw = self._slice_cache(word)
+        return None if cw is None else list(cw)
+
+    def _slice_compound_word(self, word):
+        """ Slice a word into compound parts; the result is cached by slice_compound_word() """
+        w = self._compound_combinations(word)
         # We get back a list of lists, i.e. all possible compound word combinations
         # where each combination is a list of word parts. We return
         # the combination with the longest last part and the shortest overall
@@ -172,7 +190,53 @@ class DawgDictionary:
         # Cut out interpretations that end with closed word categories,
         # i.e. conjunctions and prepositions
         # gr, st, abfn, nhm, fs?
-        return w[0] if w else None
+        return tuple(w[0]) if w else None
+
+    def _compound_combinations(self, word):
+        """ Return a list of all combinations of word parts that together
+            form the given word, in the same order as CompoundNavigator would.
+            Each suffix of the word is navigated only once, and the combinations
+            for each suffix are computed once, from the end of the word towards
+            its start, instead of recursively for every prefix that leads to it. """
+        lenw = len(word)
+        # Forward pass: find the end positions of the valid word prefixes
+        # starting at each position that can be reached from the start of the word
+        ends = dict()
+        agenda = [ 0 ]
+        while agenda:
+            i = agenda.pop()
+            if i in ends:
+                continue
+            nav = PrefixNavigator(word, i)
+            self.navigate(nav)
+            ends[i] = e = nav.result()
+            for k in e:
+                if k < lenw:
+                    # Continue with the remainder, with or without a joiner
+                    for j in CompoundNavigator._JOINERS:
+                        lenj = len(j)
+                        if (lenj == 0) or (k + lenj < lenw and word[k:k + lenj] == j):
+                            agenda.append(k + lenj)
+        # Backward pass: calculate the combinations for each reachable position
+        combinations = dict()
+        for i in sorted(ends.keys(), reverse = True):
+            parts = []
+            for k in ends[i]:
+                matched = word[i:k]
+                if k == lenw:
+                    # Complete match: a single part
+                    parts = [ [ matched ] ]
+                else:
+                    for j in CompoundNavigator._JOINERS:
+                        lenj = len(j)
+                        if (lenj == 0) or (k + lenj < lenw and word[k:k + lenj] == j):
+                            result = combinations[k + lenj]
+                            if result:
+                                parts.extend([ [ matched + j ] + tail for tail in result ])
+                                break
+                            # Else, try next joiner
+            combinations[i] = parts
+        return combinations[0]
 
     def navigate(self, nav):
         """ A generic function to navigate through the DAWG under
@@ -202,6 +266,150 @@ class DawgDictionary:
         Navigation(nav).go(root)
 
 
+class PackedDawgDictionary:
+
+    """ A DAWG stored in a packed binary file, which is memory-mapped
+        and navigated directly without creating Python node objects.
+
+        The file layout is as follows (all integers are 32-bit little-endian):
+
+        Signature       16 bytes, "Reynir PDAWG 01\n"
+        Header          offset of root node, number of nodes, offset of label data
+        Nodes           for each node: a UINT with the number of edges,
+                        with bit 31 set if the node is final, followed by
+                        (label offset, label length, next node offset) for
+                        each edge. A next node offset of zero means None.
+        Label data      UTF-8 encoded edge prefixes, identical ones stored once
+
+        The interface is the same as for DawgDictionary.
+    """
+
+    SIGNATURE = "Reynir PDAWG 01\n".encode('ascii') # 16 bytes
+
+    _HEADER = struct.Struct("<3I")
+    _UINT = struct.Struct("<I")
+    _EDGE = struct.Struct("<3I")
+
+    _FINAL_BIT = 0x80000000
+
+    # Number of nodes whose decoded edges are cached
+    _EDGE_CACHE_SIZE = 4096
+
+    def __init__(self):
+        self._mm = None
+        self._root = None
+        self._num_nodes = 0
+        self._labels = 0
+        # Lock to ensure that only one thread loads the dictionary
+        self._lock = threading.Lock()
+        # Bounded cache of compound word slicing results, keyed by word
+        self._slice_cache = lru_cache(maxsize = DawgDictionary._SLICE_CACHE_SIZE)(self._slice_compound_word)
+        # Cache of decoded edges for the most recently visited nodes
+        self.edges = lru_cache(maxsize = self._EDGE_CACHE_SIZE)(self._read_edges)
+
+    def load(self, fname):
+        """ Memory-map a packed DAWG file """
+        with self._lock:
+            if self._mm is not None:
+                # Already loaded
+                return
+            with open(fname, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            if mm[0:16] != self.SIGNATURE:
+                mm.close()
+                raise ValueError("{0} is not a packed DAWG file".format(fname))
+            self._root, self._num_nodes, self._labels = self._HEADER.unpack_from(mm, 16)
+            self._mm = mm
+
+    def _read_edges(self, node):
+        """ Return a tuple of the (prefix, nextnode) edges of the node at the given offset """
+        mm = self._mm
+        n = self._UINT.unpack_from(mm, node)[0] & ~self._FINAL_BIT
+        labels = self._labels
+        edges = []
+        offset = node + 4
+        for _ in range(n):
+            lab, lablen, nextnode = self._EDGE.unpack_from(mm, offset)
+            offset += self._EDGE.size
+            prefix = mm[labels + lab : labels + lab + lablen].decode('utf-8')
+            edges.append((prefix, nextnode or None))
+        return tuple(edges)
+
+    def is_final(self, node):
+        """ Return True if the node at the given offset is final """
+        return bool(self._UINT.unpack_from(self._mm, node)[0] & self._FINAL_BIT)
+
+    @staticmethod
+    def write(fname, root):
+        """ Write a graph of _Node objects, starting at the root, to a packed file """
+        # Assign offsets to the nodes in depth-first order
+        order = []
+        offsets = dict()
+        hdr_size = 16 + PackedDawgDictionary._HEADER.size
+        offset = hdr_size
+        stack = [ root ]
+        while stack:
+            node = stack.pop()
+            if id(node) in offsets:
+                continue
+            offsets[id(node)] = offset
+            order.append(node)
+            offset += 4 + PackedDawgDictionary._EDGE.size * len(node.edges)
+            stack.extend(nextnode for nextnode in node.edges.values()
+                if nextnode is not None and id(nextnode) not in offsets)
+        labels_offset = offset
+        # Collect the edge labels, storing identical ones only once
+        labels = dict()
+        label_data = []
+        label_len = 0
+        for node in order:
+            for prefix in node.edges:
+                if prefix not in labels:
+                    b = prefix.encode('utf-8')
+                    labels[prefix] = (label_len, len(b))
+                    label_data.append(b)
+                    label_len += len(b)
+        # Write to a temporary file and rename it when complete, since
+        # running processes may have the previous version memory-mapped
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as f:
+            f.write(PackedDawgDictionary.SIGNATURE)
+            f.write(PackedDawgDictionary._HEADER.pack(offsets[id(root)], len(order), labels_offset))
+            for node in order:
+                n = len(node.edges)
+                f.write(PackedDawgDictionary._UINT.pack(
+                    n | PackedDawgDictionary._FINAL_BIT if node.final else n))
+                for prefix, nextnode in node.edges.items():
+                    lab, lablen = labels[prefix]
+                    f.write(PackedDawgDictionary._EDGE.pack(lab, lablen,
+                        0 if nextnode is None else offsets[id(nextnode)]))
+            for b in label_data:
+                f.write(b)
+        os.replace(tmpname, fname)
+
+    def num_nodes(self):
+        """ Return a count of unique nodes in the DAWG """
+        return self._num_nodes
+
+    # The query functions are shared with DawgDictionary
+    find = DawgDictionary.find
+    __contains__ = DawgDictionary.__contains__
+    find_matches = DawgDictionary.find_matches
+    find_permutations = DawgDictionary.find_permutations
+    slice_compound_word = DawgDictionary.slice_compound_word
+    _slice_compound_word = DawgDictionary._slice_compound_word
+    _compound_combinations = DawgDictionary._compound_combinations
+
+    def navigate(self, nav):
+        """ Navigate through the DAWG under the control of a navigation object.
+            See DawgDictionary.navigate() for a description of the interface. """
+        if self._mm is None:
+            # No graph: no navigation
+            nav.done()
+            return
+        PackedNavigation(nav, self).go(self._root)
+
+
 class Wordbase:
 
     """ Container for a singleton instance of the word database """
@@ -212,8 +420,18 @@ class Wordbase:
 
     @staticmethod
     def _load_resource(resource):
-        """ Load a DawgDictionary, from either a text file or a pickle file """
+        """ Load a DawgDictionary, from either a packed binary file,
+            a text file or a pickle file """
         # Assumes that the appropriate lock has been acquired
+        # A packed (memory-mapped) DAWG file is preferred if available
+        bname = os.path.abspath(os.path.join("resources", resource + ".dawg.bin"))
+        if os.path.isfile(bname):
+            t0 = time.time()
+            dawg = PackedDawgDictionary()
+            dawg.load(bname)
+            t1 = time.time()
+            logging.info(u"Mapped {0} graph nodes in {1:.2f} seconds".format(dawg.num_nodes(), t1 - t0))
+            return dawg
         # When running under PyPy, we prefer to parse the text representation
         # of the DAWG since reading .pickle files is quite slow
         is_pypy = platform.python_implementation() == "PyPy"
@@ -265,11 +483,21 @@ class Navigation:
         # plain accept()
         self._resumable = callable(getattr(nav, "accept_resumable", None))
 
+    # noinspection PyMethodMayBeStatic
+    def _edges(self, node):
+        """ Return an iterable of the (prefix, nextnode) edges of a node """
+        return node.edges.items()
+
+    # noinspection PyMethodMayBeStatic
+    def _is_final(self, node):
+        """ Return True if the node is final, i.e. completes a word """
+        return node.final
+
     def _navigate_from_node(self, node, matched):
         """ Starting from a given node, navigate outgoing edges """
         # Go through the edges of this node and follow the ones
         # okayed by the navigator
-        for prefix, nextnode in node.edges.items():
+        for prefix, nextnode in self._edges(node):
             if self._nav.push_edge(prefix[0]):
                 # This edge is a candidate: navigate through it
                 self._navigate_from_edge(prefix, nextnode, matched)
@@ -295,7 +523,7 @@ class Navigation:
             if j < lenp and prefix[j] == u'|':
                 final = True
                 j += 1
-            elif (j >= lenp) and ((nextnode is None) or nextnode.final):
+            elif (j >= lenp) and ((nextnode is None) or self._is_final(nextnode)):
                 # If we're at the final char of the prefix and the next node is final,
                 # set the final flag as well (there is no trailing vertical bar in this case)
                 final = True
@@ -335,6 +563,22 @@ class Navigation:
         self._navigate_from_edge(prefix, nextnode, matched)
 
 
+class PackedNavigation(Navigation):
+
+    """ Manages the state for a navigation through a PackedDawgDictionary,
+        where nodes are represented by their offsets within the packed file """
+
+    def __init__(self, nav, dawg):
+        super().__init__(nav)
+        self._dawg = dawg
+
+    def _edges(self, node):
+        return self._dawg.edges(node)
+
+    def _is_final(self, node):
+        return self._dawg.is_final(node)
+
+
 class FindNavigator:
 
     """ A navigation class to be used with DawgDictionary.navigate()
@@ -509,6 +753,54 @@ class MatchNavigator:
         return self._result
 
 
+class PrefixNavigator:
+
+    """ A navigation class to be used with DawgDictionary.navigate()
+        to find all valid words that are prefixes of a word, starting
+        at a given position within it. The result is a list of the
+        end positions of the prefixes, in ascending order.
+    """
+
+    def __init__(self, word, start = 0):
+        self._word = word
+        self._len = len(word)
+        self._index = start
+        self._ends = []
+
+    def push_edge(self, firstchar):
+        """ Returns True if the edge should be entered or False if not """
+        return self._word[self._index] == firstchar
+
+    def accepting(self):
+        """ Returns False if the navigator does not want more characters """
+        return self._index < self._len
+
+    def accepts(self, newchar):
+        """ Returns True if the navigator will accept the new character """
+        if newchar != self._word[self._index]:
+            return False
+        self._index += 1
+        return True
+
+    def accept(self, matched, final):
+        """ Called to inform the navigator of a match and whether it is a final word """
+        if final:
+            self._ends.append(self._index)
+
+    # noinspection PyMethodMayBeStatic
+    def pop_edge(self):
+        """ Called when leaving an edge that has been navigated """
+        return False
+
+    # noinspection PyMethodMayBeStatic
+    def done(self):
+        """ Called when the whole navigation is done """
+        pass
+
+    def result(self):
+        return self._ends
+
+
 class CompoundNavigator:
 
     """ A navigation class to be used with DawgDictionary.navigate()
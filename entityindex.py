@@ -0,0 +1,173 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Entity name index module
+
+    Copyright (C) 2016 Vilhjálmur Þorsteinsson
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a process-wide, in-memory index of the names
+    in the entities table, used by the entity recognition phase of the
+    tokenizer instead of issuing a database query for each capitalized word.
+
+    The index is a trie at the word level, where each node holds the
+    entities whose names consist of the words on the path to it. Looking
+    up a (possibly multi-word) name returns the entities having that name,
+    or a name beginning with it - as does the query
+    Entity.name.like(w + " %") | (Entity.name == w).
+
+    The index is loaded in bulk on first use. Thereafter, rows added to the
+    table, e.g. by processors/entities.py, are loaded incrementally by
+    ascending id at most every Settings.ENTITY_INDEX_REFRESH seconds,
+    or at the next lookup after invalidate() has been called. If rows have
+    been deleted, or committed out of id order, the index is reloaded.
+
+"""
+
+import time
+from threading import Lock
+from collections import namedtuple
+
+from sqlalchemy import func
+
+from settings import Settings
+from scraperdb import Entity
+
+
+# An entity as returned from a lookup, compatible with the rows
+# returned from a session.query(Entity.name, Entity.verb, Entity.definition)
+EntityRow = namedtuple('EntityRow', ['name', 'verb', 'definition'])
+
+
+class _TrieNode:
+
+    """ A node in the entity name trie """
+
+    __slots__ = ('children', 'entities')
+
+    def __init__(self):
+        self.children = { } # Next word -> _TrieNode
+        self.entities = [ ] # EntityRows with the name ending at this node
+
+    def collect(self, result):
+        """ Append the entities in the subtree rooted at this node to result """
+        result.extend(self.entities)
+        for child in self.children.values():
+            child.collect(result)
+
+
+class EntityIndex:
+
+    """ A process-wide trie of entity names, kept up to date with the database """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._count = 0 # Number of rows in the index
+        self._max_id = 0 # Highest row id in the index
+        self._next_refresh = 0.0 # Time of the next check for new rows
+        self._lock = Lock() # The index may be accessed in parallel by multiple threads
+
+    @classmethod
+    def instance(cls):
+        """ Return the process-wide index, or None if it is disabled """
+        if not Settings.ENTITY_INDEX_REFRESH:
+            return None
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        """ Check for new rows at the next lookup, e.g. after the entities
+            table has been modified within this process """
+        if cls._instance is not None:
+            cls._instance._next_refresh = 0.0
+
+    def _add(self, row):
+        """ Add an entity row to the trie """
+        node = self._root
+        for w in row.name.split():
+            child = node.children.get(w)
+            if child is None:
+                child = node.children[w] = _TrieNode()
+            node = child
+        node.entities.append(EntityRow(row.name, row.verb, row.definition))
+
+    def _load(self, session, min_id = 0):
+        """ Load the rows with an id above min_id into the trie """
+        q = session.query(Entity.id, Entity.name, Entity.verb, Entity.definition) \
+            .filter(Entity.id > min_id) \
+            .filter(Entity.name != None) \
+            .order_by(Entity.id)
+        cnt = 0
+        for row in q.yield_per(10000):
+            if row.name.strip():
+                self._add(row)
+            self._max_id = row.id
+            cnt += 1
+        self._count += cnt
+        return cnt
+
+    def _refresh(self, session):
+        """ Bring the index up to date with the entities table """
+        count, max_id = session.query(func.count(Entity.id), func.max(Entity.id)) \
+            .filter(Entity.name != None).one()
+        max_id = max_id or 0
+        if count == self._count and max_id == self._max_id:
+            # No change
+            return
+        if max_id > self._max_id and self._max_id > 0:
+            # Check whether all rows up to our highest id are unchanged,
+            # in which case it suffices to load the new ones
+            old_count = session.query(func.count(Entity.id)) \
+                .filter(Entity.name != None) \
+                .filter(Entity.id <= self._max_id).scalar()
+            if old_count == self._count:
+                cnt = self._load(session, self._max_id)
+                if Settings.DEBUG:
+                    print("Added {0} entities to the entity index".format(cnt))
+                return
+        # Rows have been deleted or committed out of order: reload
+        self._root = _TrieNode()
+        self._count = self._max_id = 0
+        cnt = self._load(session)
+        if Settings.DEBUG:
+            print("Loaded {0} entities into the entity index".format(cnt))
+
+    def lookup(self, session, w):
+        """ Return a list of the entities named w, or having names
+            beginning with the word(s) in w """
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_refresh:
+                self._refresh(session)
+                self._next_refresh = now + Settings.ENTITY_INDEX_REFRESH
+            parts = w.split()
+            if not parts:
+                return []
+            node = self._root
+            for part in parts:
+                node = node.children.get(part)
+                if node is None:
+                    return []
+            result = []
+            node.collect(result)
+            return result
@@ -40,6 +40,11 @@
 #include <stdint.h>
 #include <assert.h>
 #include <time.h>
+#include <chrono>
+#include <vector>
+#include <unordered_map>
+#include <unordered_set>
+#include <algorithm>
 
 #include "eparser.h"
 
@@ -62,6 +67,81 @@ public:
 
 };
 
+
+class ForestReducer {
+
+   // Scores a parse forest and prunes it in place so that only the
+   // highest-scoring family of children survives at each place of
+   // ambiguity. This is the native counterpart of the ParseForestReducer
+   // class in reducer.py, using token/terminal scores calculated by the
+   // Python Reducer. Also includes other utility functions that
+   // visit each packed node of a forest once.
+
+private:
+
+   typedef Node::FamilyEntry FamilyEntry;
+   typedef std::pair<UINT, UINT> TokenTerminal;
+
+   struct Option {
+      UINT nTerminal;
+      INT iScore;
+   };
+
+   std::vector<std::vector<Option> > m_options; // Terminal scores by token index
+   UINT m_nNonterminals;
+   const INT* m_piNtScores;                      // Score adjustments by ~iNt
+   std::unordered_map<Node*, INT> m_scores;      // Scores of already reduced nodes
+
+   static BOOL isToken(const Node* pNode)
+      { return pNode->m_label.m_iNt >= 0; }
+   static BOOL isCompleted(const Node* pNode)
+      {
+         const Label& lb = pNode->m_label;
+         return lb.m_pProd == NULL || lb.m_nDot >= lb.m_pProd->getLength();
+      }
+   // Return the production position of the first child of a family
+   static UINT firstChildPos(const Node* pNode, const FamilyEntry* p);
+
+   static void findOptions(Node* pNode, std::unordered_set<Node*>& visited,
+      std::vector<TokenTerminal>& options);
+   static UINT64 numCombinations(Node* pNode, std::unordered_map<Node*, UINT64>& counts);
+
+   INT tokenScore(UINT nToken, UINT nTerminal) const;
+
+protected:
+public:
+
+   ForestReducer(UINT nOptions, const UINT* pnTokens, const UINT* pnTerminals,
+      const INT* piScores, UINT nNonterminals, const INT* piNtScores);
+   ~ForestReducer(void);
+
+   INT reduce(Node* pNode);
+
+   static UINT findOptions(Node* pNode, UINT* pnTokens, UINT* pnTerminals, UINT nMax);
+   static UINT64 numCombinations(Node* pNode);
+
+};
+
+// Work counters of the current (or last) parse on each thread
+static thread_local ParseStats tlsParseStats = { 0, 0, 0, 0 };
+
+// Number of states processed between checks of the work budget
+static const UINT BUDGET_CHECK_INTERVAL = 64;
+
+typedef std::chrono::steady_clock SteadyClock;
+
+static BOOL budgetExceeded(const ParseLimits* pLimits, const SteadyClock::time_point& tpDeadline)
+{
+   // Check the work counters of the current parse against the budget
+   if (pLimits->nMaxStates && tlsParseStats.nStates > pLimits->nMaxStates)
+      return true;
+   if (pLimits->nMaxNodes && tlsParseStats.nNodes > pLimits->nMaxNodes)
+      return true;
+   if (pLimits->nMaxMillis && SteadyClock::now() > tpDeadline)
+      return true;
+   return false;
+}
+
 void printAllocationReport(void)
 {
    AllocReporter reporter;
@@ -182,7 +262,7 @@ public:
    UINT getToken(void) const
       { return this->m_nToken; }
 
-   void startParse(UINT nHandle);
+   void startParse(UINT nHandle, BYTE* pbMatchTable);
    void stopParse(void);
 
    // Add a state to the column, at the end of the state list
@@ -379,7 +459,7 @@ static void freeStates(StateChunk*& pChunkHead)
    pChunkHead = NULL;
 }
 
-static UINT nDiscardedStates = 0;
+static std::atomic<UINT> nDiscardedStates(0);
 
 static void discardState(StateChunk* pChunkHead, State* pState)
 {
@@ -501,14 +581,23 @@ Column::~Column(void)
    Column::ac--;
 }
 
-void Column::startParse(UINT nHandle)
+void Column::startParse(UINT nHandle, BYTE* pbMatchTable)
 {
    // Called when the parser starts processing this column
    ASSERT(this->m_abCache == NULL);
+   if (this->m_nToken == (UINT)-1)
+      // Sentinel column
+      return;
+   if (pbMatchTable) {
+      // Use the row of the precomputed match table for our token
+      UINT nRowSize = this->m_pParser->getNumTerminals() + 1;
+      this->m_abCache = pbMatchTable + (size_t)this->m_nToken * nRowSize;
+      this->m_bNeedsRelease = false;
+      return;
+   }
    // Ask the parser to create a matching cache for us
    // (or eventually re-use a previous one)
-   if (this->m_nToken != (UINT)-1)
-      this->m_abCache = this->m_pParser->allocCache(nHandle, this->m_nToken, &this->m_bNeedsRelease);
+   this->m_abCache = this->m_pParser->allocCache(nHandle, this->m_nToken, &this->m_bNeedsRelease);
 }
 
 void Column::stopParse(void)
@@ -610,6 +699,7 @@ BOOL Column::matches(UINT nHandle, UINT nTerminal) const
    // Not cached: obtain a result and store it in the cache
    BOOL b = this->m_pMatchingFunc(nHandle, this->m_nToken, nTerminal) != 0;
    Column::acMatches++; // Count calls to the matching function
+   tlsParseStats.nMatches++;
    // Mark our cache
    this->m_abCache[nTerminal] = b ? (BYTE)0x81 : (BYTE)0x80;
    return b;
@@ -833,6 +923,7 @@ Node::Node(const Label& label)
    : m_label(label), m_pHead(NULL), m_nRefCount(1)
 {
    Node::ac++;
+   tlsParseStats.nNodes++;
 }
 
 Node::~Node(void)
@@ -955,6 +1046,184 @@ UINT Node::numCombinations(Node* pNode)
 }
 
 
+ForestReducer::ForestReducer(UINT nOptions, const UINT* pnTokens, const UINT* pnTerminals,
+   const INT* piScores, UINT nNonterminals, const INT* piNtScores)
+   : m_nNonterminals(nNonterminals), m_piNtScores(piNtScores)
+{
+   for (UINT i = 0; i < nOptions; i++) {
+      UINT nToken = pnTokens[i];
+      if (nToken >= this->m_options.size())
+         this->m_options.resize(nToken + 1);
+      Option opt = { pnTerminals[i], piScores[i] };
+      this->m_options[nToken].push_back(opt);
+   }
+}
+
+ForestReducer::~ForestReducer(void)
+{
+}
+
+UINT ForestReducer::firstChildPos(const Node* pNode, const FamilyEntry* p)
+{
+   // The children of a family end at the dot position of an interior
+   // node, or at the end of the production of a completed node
+   UINT nEnd = isCompleted(pNode) ? p->pProd->getLength() : pNode->m_label.m_nDot;
+   return (p->p1 && p->p2) ? nEnd - 2 : nEnd - 1;
+}
+
+INT ForestReducer::tokenScore(UINT nToken, UINT nTerminal) const
+{
+   if (nToken < this->m_options.size()) {
+      const std::vector<Option>& v = this->m_options[nToken];
+      for (UINT i = 0; i < v.size(); i++)
+         if (v[i].nTerminal == nTerminal)
+            return v[i].iScore;
+   }
+   return 0;
+}
+
+INT ForestReducer::reduce(Node* pNode)
+{
+   std::unordered_map<Node*, INT>::const_iterator it = this->m_scores.find(pNode);
+   if (it != this->m_scores.end())
+      // Already reduced: return the previously calculated score
+      return it->second;
+   BOOL bCompleted = isCompleted(pNode);
+   // Calculate the score of each family as the sum of its children's scores,
+   // and find the highest priority (lowest number) of the families' productions
+   std::vector<INT> scores;
+   BOOL bUsePrio = false;
+   UINT nHighestPrio = 0;
+   for (FamilyEntry* p = pNode->m_pHead; p; p = p->pNext) {
+      INT iScore = 0;
+      UINT nPos = firstChildPos(pNode, p);
+      Node* apChildren[2] = { p->p1, p->p2 };
+      for (UINT i = 0; i < 2; i++) {
+         Node* pChild = apChildren[i];
+         if (!pChild)
+            // Epsilon: score 0
+            continue;
+         if (isToken(pChild))
+            iScore += this->tokenScore(pChild->m_label.m_nI, (UINT)(*p->pProd)[nPos]);
+         else
+            iScore += this->reduce(pChild);
+         nPos++;
+      }
+      scores.push_back(iScore);
+      if (bCompleted) {
+         // Priorities only apply to completed nonterminals
+         UINT nPrio = p->pProd->getPriority();
+         if (p != pNode->m_pHead && nPrio != nHighestPrio)
+            bUsePrio = true;
+         if (p == pNode->m_pHead || nPrio < nHighestPrio)
+            nHighestPrio = nPrio;
+      }
+   }
+   // Find the best scoring family among those with the highest priority,
+   // preferring the first one in case of a tie
+   FamilyEntry* pBest = NULL;
+   INT iBest = 0;
+   UINT ix = 0;
+   for (FamilyEntry* p = pNode->m_pHead; p; p = p->pNext, ix++) {
+      if (bUsePrio && p->pProd->getPriority() != nHighestPrio)
+         continue;
+      if (!pBest || scores[ix] > iBest) {
+         pBest = p;
+         iBest = scores[ix];
+      }
+   }
+   if (pBest) {
+      // Eliminate all families except the best scoring one
+      FamilyEntry* p = pNode->m_pHead;
+      while (p) {
+         FamilyEntry* pNext = p->pNext;
+         if (p != pBest) {
+            if (p->p1)
+               p->p1->delRef();
+            if (p->p2)
+               p->p2->delRef();
+            delete p;
+         }
+         p = pNext;
+      }
+      pBest->pNext = NULL;
+      pNode->m_pHead = pBest;
+   }
+   if (bCompleted) {
+      // Add the score adjustment for this nonterminal, if any
+      // (this is the $score(+/-N) pragma from Reynir.grammar)
+      UINT nIx = (UINT)~pNode->m_label.m_iNt;
+      if (this->m_piNtScores && nIx < this->m_nNonterminals)
+         iBest += this->m_piNtScores[nIx];
+   }
+   this->m_scores[pNode] = iBest;
+   return iBest;
+}
+
+void ForestReducer::findOptions(Node* pNode, std::unordered_set<Node*>& visited,
+   std::vector<TokenTerminal>& options)
+{
+   if (!visited.insert(pNode).second)
+      // Already visited
+      return;
+   for (FamilyEntry* p = pNode->m_pHead; p; p = p->pNext) {
+      UINT nPos = firstChildPos(pNode, p);
+      Node* apChildren[2] = { p->p1, p->p2 };
+      for (UINT i = 0; i < 2; i++) {
+         Node* pChild = apChildren[i];
+         if (!pChild)
+            continue;
+         if (isToken(pChild))
+            options.push_back(TokenTerminal(pChild->m_label.m_nI, (UINT)(*p->pProd)[nPos]));
+         else
+            findOptions(pChild, visited, options);
+         nPos++;
+      }
+   }
+}
+
+UINT ForestReducer::findOptions(Node* pNode, UINT* pnTokens, UINT* pnTerminals, UINT nMax)
+{
+   std::unordered_set<Node*> visited;
+   std::vector<TokenTerminal> options;
+   findOptions(pNode, visited, options);
+   std::sort(options.begin(), options.end());
+   options.erase(std::unique(options.begin(), options.end()), options.end());
+   for (UINT i = 0; i < nMax && i < options.size(); i++) {
+      pnTokens[i] = options[i].first;
+      pnTerminals[i] = options[i].second;
+   }
+   return (UINT)options.size();
+}
+
+UINT64 ForestReducer::numCombinations(Node* pNode, std::unordered_map<Node*, UINT64>& counts)
+{
+   if (!pNode || isToken(pNode))
+      return 1;
+   std::unordered_map<Node*, UINT64>::const_iterator it = counts.find(pNode);
+   if (it != counts.end())
+      return it->second;
+   const UINT64 nMax = UINT64_MAX;
+   UINT64 nComb = 0;
+   for (FamilyEntry* p = pNode->m_pHead; p; p = p->pNext) {
+      UINT64 n1 = numCombinations(p->p1, counts);
+      UINT64 n2 = numCombinations(p->p2, counts);
+      UINT64 n = (n2 && n1 > nMax / n2) ? nMax : n1 * n2;
+      nComb = (nComb > nMax - n) ? nMax : nComb + n;
+   }
+   if (!nComb)
+      nComb = 1;
+   counts[pNode] = nComb;
+   return nComb;
+}
+
+UINT64 ForestReducer::numCombinations(Node* pNode)
+{
+   std::unordered_map<Node*, UINT64> counts;
+   return numCombinations(pNode, counts);
+}
+
+
 NodeDict::NodeDict(void)
    : m_pHead(NULL)
 {
@@ -1062,14 +1331,19 @@ Node* Parser::makeNode(State* pState, UINT nEnd, Node* pV, NodeDict& ndV)
 BOOL Parser::push(UINT nHandle, State* pState, Column* pE, State*& pQ)
 {
    INT iItem = pState->prodDot();
-   if (iItem <= 0)
+   if (iItem <= 0) {
       // Nonterminal or epsilon: add state to column
-      return pE->addState(pState);
+      if (!pE->addState(pState))
+         return false;
+      tlsParseStats.nStates++;
+      return true;
+   }
    if (pE->matches(nHandle, (UINT)iItem)) {
       // Terminal matching the current token
       // Link into list whose head is pQ
       pState->setNext(pQ);
       pQ = pState;
+      tlsParseStats.nStates++;
       return true;
    }
    // Return false to indicate that we did not take ownership of the State
@@ -1077,7 +1351,7 @@ BOOL Parser::push(UINT nHandle, State* pState, Column* pE, State*& pQ)
 }
 
 Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
-   UINT nTokens, const UINT pnToklist[])
+   UINT nTokens, const UINT pnToklist[], const ParseLimits* pLimits, BYTE* pbMatchTable)
 {
    // If pnToklist is NULL, a sequence of integers 0..nTokens-1 will be used
    // Sanity checks
@@ -1095,6 +1369,19 @@ Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
    if (pnErrorToken)
       *pnErrorToken = 0;
 
+   // Reset the work counters for this parse
+   tlsParseStats.nColumns = 0;
+   tlsParseStats.nStates = 0;
+   tlsParseStats.nMatches = 0;
+   tlsParseStats.nNodes = 0;
+
+   // Establish the wall-clock deadline, if any
+   SteadyClock::time_point tpDeadline;
+   if (pLimits && pLimits->nMaxMillis)
+      tpDeadline = SteadyClock::now() + std::chrono::milliseconds(pLimits->nMaxMillis);
+   UINT nSinceCheck = 0;
+   BOOL bAborted = false;
+
    // Initialize the Earley columns
    UINT i;
    Column** pCol = new Column* [nTokens + 1];
@@ -1107,7 +1394,7 @@ Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
    StateChunk* pChunkHead = NULL;
 
    // Prepare the the first column
-   pCol[0]->startParse(nHandle);
+   pCol[0]->startParse(nHandle, pbMatchTable);
 
    // Prepare the initial state
    Production* p = pRootNt->getHead();
@@ -1209,6 +1496,15 @@ Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
             }
          }
 
+         if (pLimits && ++nSinceCheck >= BUDGET_CHECK_INTERVAL) {
+            nSinceCheck = 0;
+            if (budgetExceeded(pLimits, tpDeadline)) {
+               // Out of budget: stop processing this column and abort the parse
+               bAborted = true;
+               break;
+            }
+         }
+
          // Move to the next item on the agenda
          // (which may have been enlarged by the previous code)
          pState = pEi->nextState();
@@ -1229,11 +1525,23 @@ Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
       // Done processing this column: let it clean up
       pEi->stopParse();
 
+      if (bAborted) {
+         // Discard the states that were waiting for the scanner
+         while (pQ) {
+            State* psNext = pQ->getNext();
+            pQ->~State();
+            pQ = psNext;
+         }
+         if (pnErrorToken)
+            *pnErrorToken = PARSE_ABORTED;
+         break;
+      }
+
       if (pQ) {
          Label label(pEi->getToken(), 0, NULL, i, i + 1);
          pV = new Node(label); // Reference is deleted below
          // Open up the next column
-         pCol[i + 1]->startParse(nHandle);
+         pCol[i + 1]->startParse(nHandle, pbMatchTable);
       }
 
       while (pQ) {
@@ -1274,8 +1582,10 @@ Node* Parser::parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
    ASSERT(pQ == NULL);
    ASSERT(pQ0 == NULL);
 
+   tlsParseStats.nColumns = i;
+
    Node* pResult = NULL;
-   if (i > nTokens) {
+   if (!bAborted && i > nTokens) {
       // Completed the token loop
       pCol[nTokens]->resetEnum();
       State* ps = pCol[nTokens]->nextState();
@@ -1335,7 +1645,7 @@ void AllocReporter::report(void) const
    printf("Grammars        : %6d %8d\n", Grammar::ac.getBalance(), Grammar::ac.numAllocs());
    printf("Nodes           : %6d %8d\n", Node::ac.getBalance(), Node::ac.numAllocs());
    printf("States          : %6d %8d\n", State::ac.getBalance(), State::ac.numAllocs());
-   printf("...discarded    : %6s %8d\n", "", nDiscardedStates);
+   printf("...discarded    : %6s %8d\n", "", nDiscardedStates.load());
    printf("StateChunks     : %6d %8d\n", acChunks.getBalance(), acChunks.numAllocs());
    printf("Columns         : %6d %8d\n", Column::ac.getBalance(), Column::ac.numAllocs());
    printf("HNodes          : %6d %8d\n", HNode::ac.getBalance(), HNode::ac.numAllocs());
@@ -1407,7 +1717,39 @@ UINT numCombinations(Node* pNode)
    return pNode ? Node::numCombinations(pNode) : 0;
 }
 
-Node* earleyParse(Parser* pParser, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken)
+UINT findOptions(Node* pNode, UINT* pnTokens, UINT* pnTerminals, UINT nMax)
+{
+   if (!pNode)
+      return 0;
+   if (!pnTokens || !pnTerminals)
+      nMax = 0;
+   return ForestReducer::findOptions(pNode, pnTokens, pnTerminals, nMax);
+}
+
+INT reduceForest(Node* pNode, UINT nOptions, const UINT* pnTokens, const UINT* pnTerminals,
+   const INT* piScores, UINT nNonterminals, const INT* piNtScores)
+{
+   if (!pNode)
+      return 0;
+   if (!pnTokens || !pnTerminals || !piScores)
+      nOptions = 0;
+   ForestReducer reducer(nOptions, pnTokens, pnTerminals, piScores, nNonterminals, piNtScores);
+   return reducer.reduce(pNode);
+}
+
+UINT64 countCombinations(Node* pNode)
+{
+   return pNode ? ForestReducer::numCombinations(pNode) : 0;
+}
+
+void getParseStats(ParseStats* pStats)
+{
+   if (pStats)
+      *pStats = tlsParseStats;
+}
+
+Node* earleyParse(Parser* pParser, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken,
+   const ParseLimits* pLimits, BYTE* pbMatchTable)
 {
    // Preparation and sanity checks
    if (!nTokens)
@@ -1428,7 +1770,7 @@ Node* earleyParse(Parser* pParser, UINT nTokens, INT iRoot, UINT nHandle, UINT*
 #ifdef DEBUG
    printf("Calling pParser->parse()\n"); fflush(stdout);
 #endif
-   Node* pNode = pParser->parse(nHandle, iRoot, pnErrorToken, nTokens);
+   Node* pNode = pParser->parse(nHandle, iRoot, pnErrorToken, nTokens, NULL, pLimits, pbMatchTable);
 #ifdef DEBUG
    printf("Back from pParser->parse()\n"); fflush(stdout);
 #endif
@@ -37,6 +37,8 @@
 #include <stdlib.h>
 #include <string.h>
 #include <wchar.h>
+#include <stdint.h>
+#include <atomic>
 
 
 // Assert macro
@@ -53,6 +55,7 @@ typedef wchar_t WCHAR;
 typedef char CHAR;
 typedef unsigned char BYTE;
 typedef bool BOOL;
+typedef uint64_t UINT64;
 
 
 class Production;
@@ -69,12 +72,13 @@ class AllocCounter {
    // of an instrumented class. Add this as a static
    // member (named e.g. 'ac') of the class to be watched
    // and call ac++ and ac-- in the constructor and destructor,
-   // respectively.
+   // respectively. The counters are atomic since parses may
+   // run concurrently in multiple threads.
 
 private:
 
-   UINT m_nAllocs;
-   UINT m_nFrees;
+   std::atomic<UINT> m_nAllocs;
+   std::atomic<UINT> m_nFrees;
 
 public:
 
@@ -229,6 +233,7 @@ class Label {
    // A Label is associated with a Node.
 
 friend class Node;
+friend class ForestReducer;
 
 private:
 
@@ -253,6 +258,7 @@ public:
 class Node {
 
 friend class AllocReporter;
+friend class ForestReducer;
 
 private:
 
@@ -304,6 +310,25 @@ typedef BYTE* (*AllocFunc)(UINT nHandle, UINT nToken, UINT nTerminals);
 // compares the token value with the terminal number
 BOOL defaultMatcher(UINT nHandle, UINT nToken, UINT nTerminal);
 
+// Work counters for a single parse
+struct ParseStats {
+   UINT nColumns;    // Number of Earley columns processed
+   UINT nStates;     // Number of states added to columns
+   UINT nMatches;    // Number of calls to the token/terminal matching function
+   UINT nNodes;      // Number of parse forest nodes created
+};
+
+// Work budget for a single parse (zero means no limit)
+struct ParseLimits {
+   UINT nMaxStates;  // Maximum number of states added to columns
+   UINT nMaxNodes;   // Maximum number of parse forest nodes created
+   UINT nMaxMillis;  // Maximum wall-clock time in milliseconds
+};
+
+// Error token value reported when a parse is aborted
+// because its work budget has been exceeded
+const UINT PARSE_ABORTED = (UINT)-1;
+
 
 class Parser {
 
@@ -343,17 +368,28 @@ public:
    Grammar* getGrammar(void) const
       { return this->m_pGrammar; }
 
-   // If pnToklist is NULL, a sequence of integers 0..nTokens-1 will be used
+   // If pnToklist is NULL, a sequence of integers 0..nTokens-1 will be used.
+   // If pLimits is given and the budget is exceeded, the parse is aborted,
+   // NULL is returned and *pnErrorToken is set to PARSE_ABORTED.
+   // If pbMatchTable is given, it contains a row of getNumTerminals() + 1
+   // matching cache bytes for each token value, precomputed by the caller,
+   // and the matching function is only called for entries not marked as known.
    Node* parse(UINT nHandle, INT iStartNt, UINT* pnErrorToken,
-      UINT nTokens, const UINT pnToklist[] = NULL);
+      UINT nTokens, const UINT pnToklist[] = NULL, const ParseLimits* pLimits = NULL,
+      BYTE* pbMatchTable = NULL);
 
 };
 
 // Print a report on memory allocation
 extern "C" void printAllocationReport(void);
 
-// Parse a token stream
-extern "C" Node* earleyParse(Parser*, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken);
+// Obtain the work counters of the last parse on the calling thread
+extern "C" void getParseStats(ParseStats*);
+
+// Parse a token stream, optionally within a work budget
+// and with a precomputed token/terminal match table
+extern "C" Node* earleyParse(Parser*, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken,
+   const ParseLimits* pLimits, BYTE* pbMatchTable);
 
 extern "C" Grammar* newGrammar(const CHAR* pszGrammarFile);
 
@@ -369,3 +405,19 @@ extern "C" void dumpForest(Node*, Grammar*);
 
 extern "C" UINT numCombinations(Node*);
 
+// Find the distinct (token, terminal) matches within a parse forest,
+// sorted by token index and terminal. Up to nMax matches are stored
+// in the arrays; the total number of matches is returned.
+extern "C" UINT findOptions(Node*, UINT* pnTokens, UINT* pnTerminals, UINT nMax);
+
+// Reduce a parse forest in place to its highest-scoring tree, given the
+// scores of the (token, terminal) matches found by findOptions() and
+// score adjustments for completed nonterminals, indexed by ~iNt.
+// Returns the score of the surviving tree.
+extern "C" INT reduceForest(Node*, UINT nOptions, const UINT* pnTokens, const UINT* pnTerminals,
+   const INT* piScores, UINT nNonterminals, const INT* piNtScores);
+
+// Count the trees in a parse forest, visiting each packed node once.
+// The count saturates at the maximum 64-bit value.
+extern "C" UINT64 countCombinations(Node*);
+
@@ -51,6 +51,8 @@
 
 import os
 from threading import Lock
+from collections import OrderedDict
+from weakref import WeakValueDictionary
 
 from cffi import FFI
 
@@ -58,6 +60,7 @@ from binparser import BIN_Parser
 from grammar import GrammarError
 from settings import Settings
 from glock import GlobalLock
+import metrics
 
 ffi = FFI()
 
@@ -112,7 +115,14 @@ declarations = """
     typedef BOOL (*MatchingFunc)(UINT nHandle, UINT nToken, UINT nTerminal);
     typedef BYTE* (*AllocFunc)(UINT nHandle, UINT nToken, UINT nSize);
 
-    struct Node* earleyParse(struct Parser*, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken);
+    struct ParseLimits {
+        UINT nMaxStates;
+        UINT nMaxNodes;
+        UINT nMaxMillis;
+    };
+
+    struct Node* earleyParse(struct Parser*, UINT nTokens, INT iRoot, UINT nHandle, UINT* pnErrorToken,
+        struct ParseLimits* pLimits, BYTE* pbMatchTable);
     struct Grammar* newGrammar(const CHAR* pszGrammarFile);
     void deleteGrammar(struct Grammar*);
     struct Parser* newParser(struct Grammar*, MatchingFunc fpMatcher, AllocFunc fpAlloc);
@@ -120,14 +130,131 @@ declarations = """
     void deleteForest(struct Node*);
     void dumpForest(struct Node*, struct Grammar*);
     UINT numCombinations(struct Node*);
+    UINT findOptions(struct Node*, UINT* pnTokens, UINT* pnTerminals, UINT nMax);
+    INT reduceForest(struct Node*, UINT nOptions, const UINT* pnTokens, const UINT* pnTerminals,
+        const INT* piScores, UINT nNonterminals, const INT* piNtScores);
+    uint64_t countCombinations(struct Node*);
 
     void printAllocationReport(void);
 
+    struct ParseStats {
+        UINT nColumns;
+        UINT nStates;
+        UINT nMatches;
+        UINT nNodes;
+    };
+
+    void getParseStats(struct ParseStats*);
+
 """
 
 ffi.cdef(declarations)
 
 
+class MatchingCache:
+
+    """ A size-bounded, least-recently-used (LRU) cache of token/terminal
+        matching buffers, shared between all parser instances in a process.
+
+        Each buffer holds a byte for every terminal in the grammar, recording
+        whether the corresponding token has been matched against the terminal
+        and if so, the result. Buffers are keyed by the (hashable) key of the
+        BIN_Token and the buffer size. Complete rows of the match table
+        (see ParseJob.match_table()) are cached separately from the buffers
+        that the C++ parser fills in lazily.
+
+        When the total size of the cached buffers exceeds the memory ceiling,
+        the least recently used buffers are evicted. Buffers that are in use by
+        a running parse job are kept alive by the job itself, so evicting them
+        from the cache is safe.
+    """
+
+    # Estimated per-entry overhead in bytes, in addition to the buffer itself
+    _ENTRY_OVERHEAD = 128
+
+    def __init__(self, maxbytes):
+        self._cache = OrderedDict() # Mapping of keys to buffers, in LRU order
+        self._maxbytes = maxbytes
+        self._nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._lock = Lock() # The cache may be accessed in parallel by multiple threads
+
+    def lookup(self, key, size):
+        """ Return a matching buffer of the given size for the token key,
+            creating a fresh (zero-initialized) one if not already in the cache """
+        key = (key, size)
+        with self._lock:
+            b = self._cache.get(key)
+            if b is not None:
+                # Found: mark the buffer as most recently used
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return b
+            self.misses += 1
+            b = ffi.new("BYTE[]", size)
+            self._add(key, b)
+            return b
+
+    def lookup_row(self, key, size, compute):
+        """ Return a complete match table row of the given size for the token key,
+            calling compute() to create it if not already in the cache """
+        key = (key, size, "row")
+        with self._lock:
+            b = self._cache.get(key)
+            if b is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return b
+            self.misses += 1
+        # Compute the row outside the lock, as this may take a while
+        b = compute()
+        with self._lock:
+            if key not in self._cache:
+                self._add(key, b)
+        return b
+
+    def _add(self, key, b):
+        """ Add a buffer to the cache. The caller must hold the lock. """
+        self._cache[key] = b
+        self._nbytes += len(b) + self._ENTRY_OVERHEAD
+        # Evict least recently used buffers until we're below the ceiling
+        while self._nbytes > self._maxbytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last = False)
+            self._nbytes -= len(evicted) + self._ENTRY_OVERHEAD
+            self.evictions += 1
+
+    def clear(self):
+        """ Empty the cache, e.g. when the grammar (and thus the terminal indices) changes """
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    @property
+    def maxbytes(self):
+        """ Return the memory ceiling of the cache, in bytes """
+        return self._maxbytes
+
+    @property
+    def nbytes(self):
+        """ Return the estimated current memory usage of the cache, in bytes """
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        """ Return a dictionary of cache statistics """
+        with self._lock:
+            return dict(
+                entries = len(self._cache),
+                nbytes = self._nbytes,
+                maxbytes = self._maxbytes,
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions
+            )
+
+
 class ParseJob:
 
     """ Dispatch token matching requests coming in from the C++ code """
@@ -143,8 +270,10 @@ class ParseJob:
         self.tokens = tokens
         self.terminals = terminals
         self.grammar = grammar
-        self.c_dict = dict() # Node pointer conversion dictionary
         self.matching_cache = matching_cache # Token/terminal matching buffers
+        # Keep references to the buffers handed to the C++ parser, so that
+        # they stay alive for the duration of the job even if evicted from the cache
+        self._buffers = []
 
     def matches(self, token, terminal):
         """ Convert the token reference from a 0-based token index
@@ -152,15 +281,42 @@ class ParseJob:
             1-based terminal index to a terminal object. """
         return self.tokens[token].matches(self.terminals[terminal])
 
+    def _match_row(self, token, size):
+        """ Match a token against all terminals, returning a row of matching
+            cache bytes: 0x81 for a match and 0x80 for a known mismatch.
+            Only the terminals in the token's possible categories are checked. """
+        row = bytearray(b"\x80") * size
+        groups = self.grammar.terminal_groups
+        for cat in token.match_categories():
+            for ix, terminal in groups.get(cat, ()):
+                if token.matches(terminal):
+                    row[ix] = 0x81
+        return bytes(row)
+
+    def match_table(self):
+        """ Compute the token/terminal match table for the sentence in one pass,
+            as a contiguous buffer with a row for each token. The C++ parser
+            reads the table directly instead of calling back for each match. """
+        size = self.grammar.num_terminals + 1
+        table = ffi.new("BYTE[]", len(self.tokens) * size)
+        for i, token in enumerate(self.tokens):
+            try:
+                row = self.matching_cache.lookup_row(token.key, size,
+                    lambda: self._match_row(token, size))
+            except TypeError:
+                print("match_table() unable to hash key: {0}".format(repr(token.key)))
+                row = self._match_row(token, size)
+            ffi.memmove(table + i * size, row, size)
+        return table
+
     def alloc_cache(self, token, size):
         """ Allocate a token/terminal matching cache buffer for the given token """
         key = self.tokens[token].key # Obtain the (hashable) key of the BIN_Token
         try:
-            # Do we already have a token/terminal cache match buffer for this key?
-            b = self.matching_cache.get(key)
-            if b is None:
-                # No: create a fresh one (assumed to be initialized to zero)
-                b = self.matching_cache[key] = ffi.new("BYTE[]", size)
+            # Obtain a previously used token/terminal cache match buffer
+            # for this key, or a fresh one (initialized to zero) if none
+            b = self.matching_cache.lookup(key, size)
+            self._buffers.append(b)
         except TypeError:
             print("alloc_cache() unable to hash key: {0}".format(repr(key)))
             b = ffi.NULL
@@ -179,6 +335,8 @@ class ParseJob:
         """ Python context manager protocol """
         self.__class__.delete(self._handle)
         #self.delete(self._handle)
+        # The C++ parser is done with the matching buffers
+        self._buffers = []
         # Return False to re-throw exception from the context, if any
         return False
 
@@ -231,6 +389,31 @@ def alloc_func(handle, token, size):
     return ParseJob.alloc(handle, token, size)
 
 
+class Forest:
+
+    """ Owner of a C++ parse forest. The C++ nodes are deleted when the
+        last Python reference to the Forest goes away, i.e. when all the
+        Node objects that have not yet created their children are gone. """
+
+    def __init__(self, job, c_root, c_grammar):
+        self.grammar = job.grammar
+        self.tokens = job.tokens
+        # Keep the C++ grammar alive while its productions
+        # may still be referenced from the forest
+        self._c_grammar = c_grammar
+        # Node pointer conversion dictionary. The values are weak references
+        # so that the dictionary does not keep the Python nodes alive, which
+        # would in turn keep the Forest alive.
+        self.c_dict = WeakValueDictionary()
+        # Take ownership of the C++ forest
+        self._c_root = ffi.gc(c_root, Fast_Parser.eparser.deleteForest)
+
+    @property
+    def c_root(self):
+        """ Return the root C++ node of the forest """
+        return self._c_root
+
+
 class Node:
 
     """ Shared Packed Parse Forest (SPPF) node representation.
@@ -245,9 +428,13 @@ class Node:
         A forest of Nodes can be navigated using a subclass of
         ParseForestNavigator.
 
+        Nodes are materialized lazily from the underlying C++ forest:
+        the children of a node are created upon first access, and the
+        node keeps a reference to its Forest until then.
+
     """
 
-    def __init__(self, job, c_node, parent = None, index = 0):
+    def __init__(self, forest, c_node, parent = None, index = 0):
         """ Initialize a Python SPPF node from a C++ node structure """
         lb = c_node.label
         self._start = lb.nI
@@ -256,44 +443,72 @@ class Node:
         self._families = None # Families of children
         if lb.iNt < 0:
             # Nonterminal node, completed or not
-            self._nonterminal = job.grammar.lookup(lb.iNt)
+            self._nonterminal = forest.grammar.lookup(lb.iNt)
             #assert isinstance(self._nonterminal, Nonterminal), \
             #    "nonterminal {0} is a {1}, i.e. {2}".format(lb.iNt, type(self._nonterminal), self._nonterminal)
             self._completed = (lb.pProd == ffi.NULL) or lb.nDot >= lb.pProd.n
             self._terminal = None
             self._token = None
-            job.c_dict[c_node] = self # Re-use nonterminal nodes if identical
+            forest.c_dict[c_node] = self # Re-use nonterminal nodes if identical
         else:
             # Token node: find the corresponding terminal
             assert parent is not None
             assert parent != ffi.NULL
             tix = parent.pList[index + parent.n] if index < 0 else parent.pList[index]
-            self._terminal = job.grammar.lookup(tix)
+            self._terminal = forest.grammar.lookup(tix)
             #assert isinstance(self._terminal, Terminal), \
             #    "index is {0}, parent.n is {1}, tix is {2}, production {3}".format(index, parent.n, tix, grammar.productions_by_ix[parent.nId])
-            self._token = job.tokens[lb.iNt]
+            self._token = forest.tokens[lb.iNt]
             self._nonterminal = None
             self._completed = True
+        if c_node.pHead != ffi.NULL:
+            # Children to be created on first access
+            self._forest = forest
+            self._c_node = c_node
+            self._index = index
+        else:
+            self._forest = self._c_node = None
+
+    def _expand(self):
+        """ Create the families of children of this node from the C++ node """
+        forest, c_node = self._forest, self._c_node
+        # Release the reference to the forest: when all nodes
+        # have been expanded, the C++ forest can be deleted
+        self._forest = self._c_node = None
+        child_ix = -1 if self._completed else self._index
         fe = c_node.pHead
         while fe != ffi.NULL:
-            child_ix = -1 if self._completed else index
-            self._add_family(job, fe.pProd, fe.p1, fe.p2, child_ix)
+            self._add_family(forest, fe.pProd, fe.p1, fe.p2, child_ix)
             fe = fe.pNext
 
-    def _add_family(self, job, prod, ch1, ch2, child_ix):
+    def expand_all(self):
+        """ Materialize the entire subforest under this node """
+        stack = [ self ]
+        while stack:
+            w = stack.pop()
+            if w._c_node is not None:
+                w._expand()
+            if w._families:
+                for _, children in w._families:
+                    if isinstance(children, tuple):
+                        stack.extend(ch for ch in children if ch is not None and ch._c_node is not None)
+                    elif children is not None and children._c_node is not None:
+                        stack.append(children)
+
+    def _add_family(self, forest, prod, ch1, ch2, child_ix):
         """ Add a family of children to this node, in parallel with other families """
         if ch1 != ffi.NULL and ch2 != ffi.NULL:
             child_ix -= 1
         if ch1 == ffi.NULL:
             n1 = None
         else:
-            n1 = job.c_dict.get(ch1) or Node(job, ch1, prod, child_ix)
+            n1 = forest.c_dict.get(ch1) or Node(forest, ch1, prod, child_ix)
         if n1 is not None:
             child_ix += 1
         if ch2 == ffi.NULL:
             n2 = None
         else:
-            n2 = job.c_dict.get(ch2) or Node(job, ch2, prod, child_ix)
+            n2 = forest.c_dict.get(ch2) or Node(forest, ch2, prod, child_ix)
         if n1 is not None and n2 is not None:
             children = (n1, n2)
         elif n2 is not None:
@@ -302,12 +517,27 @@ class Node:
             # n1 may be None if this is an epsilon node
             children = n1
         # Recreate the pc tuple from the production index
-        pc = (job.grammar.productions_by_ix[prod.nId], children)
+        pc = (forest.grammar.productions_by_ix[prod.nId], children)
         if self._families is None:
             self._families = [ pc ]
             return
         self._families.append(pc)
 
+    @property
+    def forest(self):
+        """ Return the Forest of this node, if its children have not been created yet """
+        return self._forest
+
+    @property
+    def native_root(self):
+        """ Return the C++ root node of the forest if this is the root node
+            and its children have not been created yet, otherwise None.
+            Such a forest can be processed natively before conversion to Python. """
+        c_node = self._c_node
+        if c_node is None or c_node != self._forest.c_root:
+            return None
+        return c_node
+
     @property
     def start(self):
         """ Return the start token index """
@@ -326,6 +556,8 @@ class Node:
     @property
     def is_ambiguous(self):
         """ Return True if this node has more than one family of children """
+        if self._c_node is not None:
+            self._expand()
         return self._families is not None and len(self._families) >= 2
 
     @property
@@ -356,23 +588,30 @@ class Node:
     @property
     def has_children(self):
         """ Return True if there are any families of children of this node """
-        return bool(self._families)
+        # Only C++ nodes with families are expanded, so this doesn't require expansion
+        return self._c_node is not None or bool(self._families)
 
     @property
     def is_empty(self):
         """ Return True if there is only a single empty family of this node """
+        if self._c_node is not None:
+            self._expand()
         if not self._families:
             return True
         return len(self._families) == 1 and self._families[0][1] is None
 
     def enum_children(self):
         """ Enumerate families of children """
+        if self._c_node is not None:
+            self._expand()
         if self._families:
             for prod, children in self._families:
                 yield (prod, children)
 
     def reduce_to(self, child_ix):
         """ Eliminate all child families except the given one """
+        if self._c_node is not None:
+            self._expand()
         #if not self._families or child_ix >= len(self._families):
         #    raise IndexError("Child index out of range")
         f = self._families[child_ix] # The survivor
@@ -387,6 +626,8 @@ class Node:
         """ Create a reasonably nice text representation of this node
             and its families of children, if any """
         label_rep = repr(self._nonterminal or self._token)
+        if self._c_node is not None:
+            self._expand()
         families_rep = ""
         if self._families:
             if len(self._families) == 1:
@@ -514,6 +755,15 @@ class ParseError(Exception):
         return self._token_index
 
 
+class ParseTimeout(ParseError):
+
+    """ Exception raised when a parse is aborted because it exceeded
+        its work budget, i.e. the maximum number of states or nodes,
+        or the maximum wall-clock time (see Settings.PARSE_TIMEOUT) """
+
+    pass
+
+
 class Fast_Parser(BIN_Parser):
 
     """ This class wraps an Earley-Scott parser written in C++.
@@ -538,9 +788,16 @@ class Fast_Parser(BIN_Parser):
     GRAMMAR_BINARY_FILE = "Reynir.grammar.bin"
     GRAMMAR_BINARY_FILE_BYTES = GRAMMAR_BINARY_FILE.encode('ascii')
 
+    # Error token value returned by earleyParse() if the work budget is exceeded
+    PARSE_ABORTED = 0xFFFFFFFF
+
     _c_grammar = None
     _c_grammar_ts = None
 
+    # Token/terminal matching cache, shared by all Fast_Parser instances
+    # in this process and bounded by Settings.MATCHING_CACHE_SIZE
+    _matching_cache = None
+
     @classmethod
     def _load_binary_grammar(cls):
         """ Load the binary grammar file into memory, if required """
@@ -553,15 +810,20 @@ class Fast_Parser(BIN_Parser):
         if cls._c_grammar is None or cls._c_grammar_ts != ts:
             # Need to load or reload the grammar
             ep = cls.eparser
-            if cls._c_grammar is not None:
-                # Delete previous grammar instance, if any
-                ep.deleteGrammar(cls._c_grammar)
-                cls._c_grammar = None
-            cls._c_grammar = ep.newGrammar(fname)
+            # Release our reference to the previous grammar instance, if any.
+            # Other threads may still be parsing with it, since the C++ parser
+            # runs without the GIL, so the C++ grammar is only deleted when
+            # the last parser instance and parse forest using it are gone.
+            cls._c_grammar = None
+            c_grammar = ep.newGrammar(fname)
             cls._c_grammar_ts = ts
-            if cls._c_grammar is None or cls._c_grammar == ffi.NULL:
+            # Terminal indices may have changed: previous matching results are void
+            if cls._matching_cache is not None:
+                cls._matching_cache.clear()
+            if c_grammar is None or c_grammar == ffi.NULL:
                 raise GrammarError("Unable to load binary grammar file " +
                     cls.GRAMMAR_BINARY_FILE)
+            cls._c_grammar = ffi.gc(c_grammar, ep.deleteGrammar)
         return cls._c_grammar
 
     def __init__(self, verbose = False, root = None):
@@ -573,15 +835,28 @@ class Fast_Parser(BIN_Parser):
             super().__init__(verbose) # Reads and parses the grammar text file
             # Create instances of the C++ Grammar and Parser classes
             c_grammar = Fast_Parser._load_binary_grammar()
-            # Create a C++ parser object for the grammar
+            # Create a C++ parser object for the grammar,
+            # keeping a reference to the grammar for its lifetime
+            self._c_grammar = c_grammar
             self._c_parser = Fast_Parser.eparser.newParser(c_grammar, matching_func, alloc_func)
             # Find the index of the root nonterminal for this parser instance
             self._root_index = 0 if root is None else self.grammar.nonterminals[root].index
-            # Maintain a token/terminal matching cache for the duration
-            # of this parser instance. Note that this cache will grow with use,
-            # as it includes an entry (about 2K bytes) for every distinct token that the parser
-            # encounters.
-            self._matching_cache = dict()
+            # Use the process-wide token/terminal matching cache. It contains
+            # an entry (about 2K bytes) for every distinct token that the parsers
+            # encounter, up to the configured memory ceiling.
+            if Fast_Parser._matching_cache is None:
+                Fast_Parser._matching_cache = MatchingCache(Settings.MATCHING_CACHE_SIZE)
+            self._matching_cache = Fast_Parser._matching_cache
+            # Work budget for each sentence, or NULL if unlimited
+            max_millis = int(Settings.PARSE_TIMEOUT * 1000)
+            if Settings.PARSE_MAX_STATES or Settings.PARSE_MAX_NODES or max_millis:
+                self._limits = ffi.new("struct ParseLimits*", dict(
+                    nMaxStates = Settings.PARSE_MAX_STATES,
+                    nMaxNodes = Settings.PARSE_MAX_NODES,
+                    nMaxMillis = max_millis
+                ))
+            else:
+                self._limits = ffi.NULL
 
     def __enter__(self):
         """ Python context manager protocol """
@@ -593,10 +868,19 @@ class Fast_Parser(BIN_Parser):
         self.cleanup()
         return False
 
+    @property
+    def root_index(self):
+        """ Return the index of the root nonterminal of this parser instance """
+        return self._root_index
+
     def go(self, tokens):
         """ Call the C++ parser module to parse the tokens """
+        return self.go_wrapped(self._wrap(tokens)) # _wrap() is inherited from BIN_Parser
+
+    def go_wrapped(self, wrapped_tokens):
+        """ Call the C++ parser module to parse tokens that have
+            already been wrapped by BIN_Parser._wrap() """
 
-        wrapped_tokens = self._wrap(tokens) # Inherited from BIN_Parser
         lw = len(wrapped_tokens)
         ep = Fast_Parser.eparser
         err = ffi.new("unsigned int*")
@@ -606,10 +890,35 @@ class Fast_Parser(BIN_Parser):
 
         with ParseJob.make(self.grammar, wrapped_tokens, self._terminals, self._matching_cache) as job:
 
-            node = ep.earleyParse(self._c_parser, lw, self._root_index, job.handle, err)
+            if Settings.MATCH_TABLE:
+                with metrics.timer("match.time"):
+                    table = job.match_table()
+            else:
+                # Match lazily, via callbacks from the C++ parser
+                table = ffi.NULL
+
+            # CFFI releases the GIL for the duration of the call. Given a
+            # precomputed match table, the C++ parser does not call back into
+            # Python, so other threads can run - and parse - in the meantime.
+            # Without the table, the GIL is re-acquired for every callback.
+            with metrics.timer("earley.time"):
+                node = ep.earleyParse(self._c_parser, lw, self._root_index, job.handle, err,
+                    self._limits, table)
+
+            if metrics.current() is not None:
+                # Collect the work counters of the C++ parser
+                stats = ffi.new("struct ParseStats*")
+                ep.getParseStats(stats)
+                metrics.add("earley.columns", stats.nColumns)
+                metrics.add("earley.states", stats.nStates)
+                metrics.add("earley.matches", stats.nMatches)
+                metrics.add("earley.nodes", stats.nNodes)
 
             if node == ffi.NULL:
                 ix = err[0] # Token index
+                if ix == Fast_Parser.PARSE_ABORTED:
+                    raise ParseTimeout("Parse aborted after exceeding its work budget ({0} tokens in input)"
+                        .format(lw))
                 if ix >= 1:
                     # Find the error token index in the original (unwrapped) token list
                     orig_ix = wrapped_tokens[ix].index if ix < lw else ix
@@ -620,11 +929,15 @@ class Fast_Parser(BIN_Parser):
                     raise ParseError("No parse available at token {0} ({1} tokens in input)"
                         .format(ix, len(wrapped_tokens)), 0)
 
-            # Create a new Python-side node forest corresponding to the C++ one
-            result = Node(job, node)
+            # Create a new Python-side node forest corresponding to the C++ one.
+            # The Forest object takes ownership of the C++ nodes and deletes
+            # them when they are no longer needed.
+            with metrics.timer("forest.time"):
+                result = Node(Forest(job, node, self._c_grammar), node)
+                if not Settings.LAZY_FOREST:
+                    # Create all nodes up front, releasing the C++ forest
+                    result.expand_all()
 
-        # Delete the C++ nodes
-        ep.deleteForest(node)
         return result
 
     def go_no_exc(self, tokens):
@@ -641,13 +954,27 @@ class Fast_Parser(BIN_Parser):
         ep = Fast_Parser.eparser
         ep.deleteParser(self._c_parser)
         self._c_parser = None
+        self._c_grammar = None
         if Settings.DEBUG:
             ep.printAllocationReport()
+            print("Matching cache: {0}".format(Fast_Parser.matching_cache_stats()))
+
+    @classmethod
+    def matching_cache_stats(cls):
+        """ Return statistics for the shared token/terminal matching cache """
+        mc = cls._matching_cache
+        return None if mc is None else mc.stats()
 
     @classmethod
     def num_combinations(cls, w):
         """ Count the number of possible parse tree combinations in the given forest """
 
+        if isinstance(w, Node):
+            c_root = w.native_root
+            if c_root is not None:
+                # The forest has not been converted to Python: count natively
+                return cls.eparser.countCombinations(c_root)
+
         nc = dict()
 
         def _num_comb(w):
@@ -24,7 +24,7 @@ from datetime import datetime
 from bs4 import BeautifulSoup, NavigableString
 
 from settings import Settings
-from tokenizer import tokenize
+from tokenizer import tokenize_stream
 
 from scraperdb import SessionContext, Root, Article as ArticleRow
 
@@ -53,6 +53,7 @@ class Fetcher:
     _WHITESPACE_TAGS = frozenset(["img"]) # Inserted as whitespace
 
     _BREAK_TAGS = frozenset(["br", "hr"]) # Cause paragraph breaks at outermost level
+    _INVISIBLE = re.compile('\u00AD|\u200B') # Soft hyphen and zero width space
 
     # Cache of instantiated scrape helpers
     _helpers = dict()
@@ -105,6 +106,14 @@ class Fetcher:
                 self._result.append(" ]] [[ ")
                 self._white = True
 
+        def chunks(self):
+            """ Generator yielding the accumulated result as a sequence of text
+                chunks, without joining them into one string """
+            assert self._nesting == 0
+            for w in self._result:
+                # Eliminate soft hyphen and zero width space characters
+                yield Fetcher._INVISIBLE.sub('', w)
+
         def result(self):
             """ Return the accumulated result as a string """
             assert self._nesting == 0
@@ -167,11 +176,9 @@ class Fetcher:
         # Extract the text content of the HTML into a list
         tlist = Fetcher.TextList()
         Fetcher.extract_text(soup, tlist)
-        text = tlist.result()
-        tlist = None # Free memory
 
-        # Tokenize the resulting text, returning a generator
-        return tokenize(text, enclosing_session = enclosing_session)
+        # Tokenize the resulting text chunks as they are consumed, returning a generator
+        return tokenize_stream(tlist.chunks(), enclosing_session = enclosing_session)
 
 
     @classmethod
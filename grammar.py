@@ -54,6 +54,8 @@
 
 import os
 import struct
+import pickle
+import hashlib
 
 from datetime import datetime
 from collections import defaultdict, OrderedDict
@@ -165,6 +167,11 @@ class Terminal:
     def __hash__(self):
         return self._hash
 
+    def __setstate__(self, state):
+        """ Restore a terminal from a pickled grammar, recalculating the cached hash """
+        self.__dict__.update(state)
+        self._hash = id(self).__hash__()
+
     def __repr__(self):
         return '{0}'.format(self._name)
 
@@ -409,6 +416,10 @@ class Grammar:
 
     """
 
+    # Version of the pickled grammar cache format. Change this when
+    # the grammar classes are modified in ways that affect their pickled state.
+    _PICKLE_VERSION = "Reynir/1.01"
+
     def __init__(self):
 
         self._nonterminals = OrderedDict()
@@ -537,7 +548,10 @@ class Grammar:
     def _write_binary(self, fname):
         """ Write grammar to binary file. Called after reading a grammar text file
             that is newer than the corresponding binary file, unless write_binary is False. """
-        with open(fname, "wb") as f:
+        # Write to a temporary file and then rename it, so that other
+        # processes never see a partially written file
+        tmpname = "{0}.{1}.tmp".format(fname, os.getpid())
+        with open(tmpname, "wb") as f:
             if Settings.DEBUG:
                 print("Writing binary grammar file {0}".format(fname))
             # Version header
@@ -562,15 +576,80 @@ class Grammar:
                     f.write(struct.pack("I", lenp))
                     if lenp:
                         f.write(struct.pack(str(lenp)+"i", *p.prod))
+        os.replace(tmpname, fname)
         if Settings.DEBUG:
             print("Writing of binary grammar file completed")
             print("num_terminals was {0}, num_nonterminals {1}".format(self.num_terminals, num_nt))
 
-    def read(self, fname, verbose = False, write_binary = True):
+    def _pickle_key(self, fname):
+        """ Return a key identifying the contents of the grammar text file,
+            along with the pickle format and grammar class versions """
+        h = hashlib.sha1()
+        with open(fname, "rb") as f:
+            h.update(f.read())
+        return "{0}/{1}/{2}".format(self._PICKLE_VERSION,
+            self.__class__.__name__, h.hexdigest())
+
+    def _write_pickle(self, fname, key):
+        """ Write the fully processed grammar to a pickle file,
+            for fast loading by subsequent processes """
+        if Settings.DEBUG:
+            print("Writing pickled grammar file {0}".format(fname))
+        # Write to a temporary file and then rename it, so that other
+        # processes never see a partially written file
+        tmpname = "{0}.{1}.tmp".format(fname, os.getpid())
+        try:
+            with open(tmpname, "wb") as f:
+                pickle.dump((key, self.__dict__), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            # Not being able to write the cache is not fatal
+            if Settings.DEBUG:
+                print("Unable to write pickled grammar file {0}: {1}".format(fname, e))
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+
+    def _read_pickle(self, fname, key):
+        """ Load the grammar from a pickle file, if it exists and
+            corresponds to the given key. Returns True if successful. """
+        try:
+            with open(fname, "rb") as f:
+                pkey, state = pickle.load(f)
+        except Exception:
+            # Missing, unreadable or incompatible file: parse the text instead
+            return False
+        if pkey != key:
+            # The grammar text file has changed since the pickle was written
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def read(self, fname, verbose = False, write_binary = True, use_pickle = True):
         """ Read grammar from a text file. Set verbose = True to get diagnostic messages
             about unused nonterminals and nonterminals that are unreachable from the root.
             Set write_binary = False to avoid writing a fresh binary file if the
-            grammar text file is newer than the existing binary file. """
+            grammar text file is newer than the existing binary file.
+            Unless use_pickle is False, a pickled copy of the processed grammar
+            (fname + ".pickle") is used if its key matches the text file contents,
+            and written otherwise. """
+
+        pickle_key = None
+        if use_pickle:
+            try:
+                pickle_key = self._pickle_key(fname)
+            except (IOError, OSError):
+                raise GrammarError("Unable to open or read grammar file", fname, 0)
+            if self._read_pickle(fname + ".pickle", pickle_key):
+                # Loaded: note the current file name and timestamp
+                self._file_name = fname
+                self._file_time = datetime.fromtimestamp(os.path.getmtime(fname))
+                if Settings.DEBUG:
+                    print("Grammar loaded from pickled file {0}.pickle".format(fname))
+                if write_binary:
+                    self._check_binary(fname, fname + ".pickle")
+                return
 
         # Clear previous file info, if any
         self._file_time = self._file_name = None
@@ -1051,17 +1130,36 @@ class Grammar:
         self._file_name = fname
         self._file_time = datetime.fromtimestamp(os.path.getmtime(fname))
 
-        if write_binary:
-            # Check whether to write a fresh binary file
-            fname += ".bin"  # By default Reynir.grammar.bin
+        if pickle_key is not None:
+            # Store the processed grammar for fast loading next time
+            self._write_pickle(fname + ".pickle", pickle_key)
+            if write_binary:
+                # The pickle pins the nonterminal and terminal indices,
+                # so the binary file must always be written along with it
+                self._write_binary(fname + ".bin")
+        elif write_binary:
+            self._check_binary(fname)
+
+    def _check_binary(self, fname, pickle_fname = None):
+        """ Write a fresh binary grammar file if there is none,
+            or if it is older than the grammar text file or the
+            pickle file that the grammar was loaded from, if any """
+        source_time = self._file_time
+        if pickle_fname is not None:
             try:
-                binary_file_time = datetime.fromtimestamp(os.path.getmtime(fname))
+                source_time = max(source_time,
+                    datetime.fromtimestamp(os.path.getmtime(pickle_fname)))
             except os.error:
-                binary_file_time = None
-            # if Settings.DEBUG or binary_file_time is None or binary_file_time < self._file_time:
-            if binary_file_time is None or binary_file_time < self._file_time:
-                # No binary file or older than text file: write a fresh one
-                self._write_binary(fname)
+                pass
+        fname += ".bin"  # By default Reynir.grammar.bin
+        try:
+            binary_file_time = datetime.fromtimestamp(os.path.getmtime(fname))
+        except os.error:
+            binary_file_time = None
+        # if Settings.DEBUG or binary_file_time is None or binary_file_time < self._file_time:
+        if binary_file_time is None or binary_file_time < source_time:
+            # No binary file or older than text file: write a fresh one
+            self._write_binary(fname)
 
 
     def follow_set(self, nonterminal):
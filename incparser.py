@@ -11,14 +11,26 @@
     that the client can take action on each paragraph and sentence as
     it is processed.
 
+    Optionally, the sentences can be parsed in parallel by a pool of
+    worker processes (see SentencePool below). In that case, all sentences
+    of the token stream are dispatched to the pool up front, and the
+    results are collected in order as the client iterates through the
+    paragraphs and sentences.
+
 """
 
 import time
+import atexit
+import multiprocessing
+from threading import Lock
 from collections import defaultdict
 
 from tokenizer import TOK, paragraphs
-from fastparser import Fast_Parser, ParseError
+from fastparser import Fast_Parser, ParseError, ParseTimeout, ParseForestDumper
 from reducer import Reducer
+from parsecache import parse_sentence, load_tree
+import metrics
+from metrics import Metrics
 from settings import Settings
 
 # Number of tree combinations that must be exceeded for a verbose
@@ -26,6 +38,78 @@ from settings import Settings
 _VERBOSE_AMBIGUITY_THRESHOLD = 1000
 
 
+# The parser and reducer of a SentencePool worker process
+_worker_parser = None
+_worker_reducer = None
+
+
+def _init_worker():
+    """ Warm up a SentencePool worker process by loading the grammar """
+    global _worker_parser, _worker_reducer
+    _worker_parser = Fast_Parser(verbose = False)
+    _worker_reducer = Reducer(_worker_parser.grammar)
+    # Discard the metrics inherited from the parent process, which
+    # would otherwise be merged back into it
+    Metrics.reset()
+
+
+def _parse_in_worker(tokens):
+    """ Parse a sentence within a SentencePool worker process. Returns a tuple
+        containing the parser version, the number of combinations, the tree dump,
+        the error token index, a timeout flag, the sentence metrics and the
+        metrics histograms collected in the process. """
+    num = 0
+    dump = None
+    err_index = None
+    timed_out = False
+    values = None
+    with metrics.collect("sentence") as c:
+        metrics.add("tokens", len(tokens))
+        try:
+            num, forest, dump = parse_sentence(_worker_parser, _worker_reducer, tokens)
+            if dump is None and forest is not None:
+                dump = ParseForestDumper.dump_forest(forest)
+        except ParseTimeout:
+            timed_out = True
+            metrics.add("timeouts")
+        except ParseError as e:
+            err_index = e.token_index
+            metrics.add("errors")
+        if c is not None:
+            values = c.values
+    return (_worker_parser.version, num, dump, err_index, timed_out, values, Metrics.drain())
+
+
+class SentencePool:
+
+    """ A process-wide pool of worker processes with warm parsers,
+        for parsing the sentences of a text in parallel """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    def __init__(self, processes):
+        self._pool = multiprocessing.Pool(processes, initializer = _init_worker)
+        atexit.register(self._pool.terminate)
+
+    @classmethod
+    def instance(cls):
+        """ Return the process-wide pool, or None if parallel parsing is disabled """
+        if multiprocessing.current_process().daemon:
+            # Worker processes, such as those of the scraper's parse pool,
+            # are not allowed to have children
+            return None
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(Settings.SENTENCE_WORKERS) if Settings.SENTENCE_WORKERS else False
+        return cls._instance or None
+
+    def submit(self, tokens):
+        """ Submit a sentence for parsing, returning an AsyncResult """
+        return self._pool.apply_async(_parse_in_worker, (tokens,))
+
+
 class IncrementalParser:
 
     """ Utility class to parse a token list as a sequence of paragraphs
@@ -41,7 +125,9 @@ class IncrementalParser:
                     # do something with sent.tree
                 else:
                     # an error occurred in the parse
-                    # the error token index is at sent.err_index
+                    # the error token index is at sent.err_index,
+                    # and sent.timed_out is True if the parse was
+                    # aborted due to the work budget being exceeded
         num_sentences = ip.num_sentences
         num_parsed = ip.num_parsed
         ambiguity = ip.num_sentences
@@ -51,29 +137,72 @@ class IncrementalParser:
 
     class _IncrementalSentence:
 
-        def __init__(self, ip, s):
+        def __init__(self, ip, s, pending = None):
             self._ip = ip
             self._s = s
             self._len = len(s)
             assert self._len > 0 # Input should be already sanitized
             self._err_index = None
             self._tree = None
+            self._dump = None
+            self._timed_out = False
+            self._pending = pending # AsyncResult from a SentencePool, if any
 
         def __len__(self):
             return self._len
 
+        def _collect(self):
+            """ Collect the result of a parse in a SentencePool worker process.
+                Returns the number of combinations, or None if the sentence
+                should be parsed locally instead. """
+            version, num, dump, err_index, timed_out, values, histograms = self._pending.get()
+            self._pending = None
+            parser = self._ip._parser
+            if version != parser.version:
+                # The worker has a different grammar than our parser
+                return None
+            tree = None
+            if dump is not None:
+                # Recreate the tree from its dump, using our own token wrappers
+                tree = load_tree(dump, parser.grammar, parser._wrap(self._s))
+                if tree is None:
+                    return None
+            # Account for the sentence metrics as metrics.collect() would have done
+            Metrics.merge(histograms)
+            if values is not None:
+                for name, value in values.items():
+                    metrics.add(name, value)
+                metrics.add("sentence.count")
+            self._tree = tree
+            self._dump = dump
+            self._err_index = err_index
+            self._timed_out = timed_out
+            return num
+
         def parse(self):
             """ Parse the sentence """
+            if self._pending is not None:
+                num = self._collect()
+                if num is not None:
+                    self._ip._add_sentence(self, num)
+                    return num > 0
             num = 0
-            try:
-                forest = self._ip._parser.go(self._s)
-                if forest is not None:
-                    num = Fast_Parser.num_combinations(forest)
-                    if num > 1:
-                        forest = self._ip._reducer.go(forest)
-            except ParseError as e:
-                forest = None
-                self._err_index = e.token_index
+            with metrics.collect("sentence"):
+                metrics.add("tokens", self._len)
+                try:
+                    # Identical sentences are parsed only once per process,
+                    # if the parse cache is enabled (see parsecache.py)
+                    num, forest, self._dump = parse_sentence(self._ip._parser,
+                        self._ip._reducer, self._s)
+                except ParseTimeout:
+                    # The sentence exceeded its work budget
+                    forest = None
+                    self._timed_out = True
+                    metrics.add("timeouts")
+                except ParseError as e:
+                    forest = None
+                    self._err_index = e.token_index
+                    metrics.add("errors")
             self._tree = forest
             self._ip._add_sentence(self, num)
             return num > 0
@@ -86,6 +215,19 @@ class IncrementalParser:
         def tree(self):
             return self._tree
 
+        @property
+        def tree_dump(self):
+            """ Return the ParseForestDumper string for the tree,
+                creating it if not already available from the parse cache """
+            if self._dump is None and self._tree is not None:
+                self._dump = ParseForestDumper.dump_forest(self._tree)
+            return self._dump
+
+        @property
+        def timed_out(self):
+            """ Return True if the parse was aborted due to the work budget """
+            return self._timed_out
+
         @property
         def err_index(self):
             return self._len - 1 if self._err_index is None else self._err_index
@@ -96,20 +238,26 @@ class IncrementalParser:
 
     class _IncrementalParagraph:
 
-        def __init__(self, ip, p):
+        def __init__(self, ip, p, pending = None):
             self._ip = ip
             self._p = p
+            self._pending = pending # List of AsyncResults, one per sentence, if any
 
         def sentences(self):
             """ Yield the sentences within the paragraph, nicely wrapped """
-            for _, sent in self._p:
-                yield IncrementalParser._IncrementalSentence(self._ip, sent)
+            for ix, (_, sent) in enumerate(self._p):
+                yield IncrementalParser._IncrementalSentence(self._ip, sent,
+                    None if self._pending is None else self._pending[ix])
 
-    def __init__(self, parser, toklist, verbose = False):
+    def __init__(self, parser, toklist, verbose = False, parallel = None):
+        """ If parallel is True, the sentences are parsed in a SentencePool,
+            if enabled in the settings. If None, the settings decide. """
         self._parser = parser
+        self._parallel = Settings.SENTENCE_WORKERS > 0 if parallel is None else parallel
         self._reducer = Reducer(parser.grammar)
         self._num_sent = 0
         self._num_parsed_sent = 0
+        self._num_timeouts = 0
         self._num_tokens = 0
         self._total_ambig = 0.0
         self._total_tokens = 0
@@ -138,6 +286,8 @@ class IncrementalParser:
             ambig_factor = num ** (1 / slen)
             self._total_ambig += ambig_factor * slen
             self._total_tokens += slen
+        elif s.timed_out:
+            self._num_timeouts += 1
         if self._verbose and Settings.DEBUG:
             print("Parsed sentence of length {0} with {1} combinations{2}"
                 .format(slen, num,
@@ -145,8 +295,15 @@ class IncrementalParser:
 
     def paragraphs(self):
         """ Yield the paragraphs from the token stream """
-        for p in paragraphs(self._toklist):
-            yield IncrementalParser._IncrementalParagraph(self, p)
+        pool = SentencePool.instance() if self._parallel else None
+        if pool is None:
+            for p in paragraphs(self._toklist):
+                yield IncrementalParser._IncrementalParagraph(self, p)
+            return
+        # Dispatch all sentences to the pool before yielding the first paragraph
+        pgs = [ (p, [ pool.submit(sent) for _, sent in p ]) for p in paragraphs(self._toklist) ]
+        for p, pending in pgs:
+            yield IncrementalParser._IncrementalParagraph(self, p, pending)
 
     @property
     def num_tokens(self):
@@ -160,6 +317,10 @@ class IncrementalParser:
     def num_parsed(self):
         return self._num_parsed_sent
 
+    @property
+    def num_timeouts(self):
+        return self._num_timeouts
+
     @property
     def ambiguity(self):
         return (self._total_ambig / self._total_tokens) if self._total_tokens > 0 else 1.0
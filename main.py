@@ -46,10 +46,11 @@ from fastparser import Fast_Parser, ParseError, ParseForestPrinter
 from incparser import IncrementalParser
 from reducer import Reducer
 from article import Article as ArticleProxy
-from scraperdb import SessionContext, desc, Root, Person, Article, ArticleTopic, Topic,\
+from scraperdb import SessionContext, desc, defer, Root, Person, Article, ArticleTopic, Topic,\
     GenderQuery, StatsQuery
 from query import Query, query_person_title, query_entity_def
 from getimage import get_image_url
+import metrics
 
 
 # Initialize Flask framework
@@ -235,7 +236,9 @@ def top_news(topic = None, start = None, limit = _TOP_NEWS_LENGTH):
 
     with SessionContext(commit = True) as session:
 
+        # Don't load the large html, tree and tokens columns, which are not needed here
         q = session.query(Article).join(Root) \
+            .options(defer(Article.html), defer(Article.tree), defer(Article.tokens)) \
             .filter(Article.tree != None) \
             .filter(Article.timestamp != None) \
             .filter(Article.timestamp < start) \
@@ -366,7 +369,7 @@ def analyze():
 
     text = request.form.get("text", "").strip()[0:_MAX_TEXT_LENGTH]
 
-    with SessionContext(commit = True) as session:
+    with SessionContext(commit = True) as session, metrics.collect("text"):
 
         # Demarcate paragraphs in the input
         text = Fetcher.mark_paragraphs(text)
@@ -393,6 +396,7 @@ def analyze():
                 num_tokens = ip.num_tokens,
                 num_sentences = ip.num_sentences,
                 num_parsed = ip.num_parsed,
+                num_timeouts = ip.num_timeouts,
                 ambiguity = ip.ambiguity
             )
             # Add a name register to the result
@@ -755,6 +759,15 @@ def stats():
         return render_template("stats.html", result = result, total = total)
 
 
+# Note: Endpoints ending with .api are configured not to be cached by nginx
+@app.route("/metrics.api", methods=['GET'])
+def metrics_api():
+    """ Return the performance metrics histograms of this process as JSON """
+    return jsonify(result = metrics.Metrics.snapshot(),
+        bin_cache = BIN_Db.cache_stats(),
+        matching_cache = Fast_Parser.matching_cache_stats())
+
+
 @app.route("/about")
 @max_age(seconds = 10 * 60)
 def about():
@@ -0,0 +1,321 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Metrics module
+
+    Copyright (C) 2016 Vilhjálmur Þorsteinsson
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module collects performance metrics from the processing pipeline,
+    i.e. the tokenizer stages, BIN lookups, the Earley parser, the conversion
+    of the parse forest to Python objects and the reducer.
+
+    Metrics are collected for units of work such as sentences and articles,
+    using the collect() context manager:
+
+        with metrics.collect("article"):
+            ...
+            with metrics.collect("sentence"):
+                metrics.add("earley.states", n)
+                with metrics.timer("reduce.time"):
+                    ...
+
+    When a unit of work is finished, its values are added to process-wide
+    histograms named after the scope, e.g. 'sentence.earley.states', and
+    summed into the enclosing unit of work, if any. Values added outside
+    of a unit of work are discarded.
+
+    The histograms can be obtained as a dictionary from Metrics.snapshot(),
+    as a text report from Metrics.report(), or drained from one process
+    and merged into another by Metrics.drain() and Metrics.merge().
+
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+from settings import Settings
+
+
+class Histogram:
+
+    """ A histogram of non-negative values, with logarithmic buckets.
+        Each power of two is divided into four buckets, so a bucket's
+        upper bound is about 19% above its lower bound. """
+
+    _BUCKETS_PER_OCTAVE = 4
+
+    def __init__(self):
+        self._buckets = defaultdict(int) # Bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _bucket(cls, value):
+        """ Return the index of the bucket for the given value """
+        if value <= 0.0:
+            return None
+        return math.floor(math.log2(value) * cls._BUCKETS_PER_OCTAVE)
+
+    @classmethod
+    def _upper_bound(cls, bucket):
+        """ Return the upper bound of the bucket with the given index """
+        if bucket is None:
+            return 0.0
+        return 2.0 ** ((bucket + 1) / cls._BUCKETS_PER_OCTAVE)
+
+    def add(self, value):
+        """ Add a value to the histogram """
+        self._buckets[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """ Add the contents of another histogram to this one """
+        for bucket, cnt in other._buckets.items():
+            self._buckets[bucket] += cnt
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """ Return an estimate of the p-th percentile (0 < p <= 100),
+            i.e. the upper bound of the bucket where it falls """
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        cum = 0
+        # The None bucket (zero values) sorts first
+        for bucket in sorted(self._buckets, key = lambda b: -math.inf if b is None else b):
+            cum += self._buckets[bucket]
+            if cum >= rank:
+                return min(self._upper_bound(bucket), self.max)
+        return self.max
+
+    def as_dict(self):
+        """ Return a summary of the histogram as a dictionary """
+        return dict(
+            count = self.count,
+            total = self.total,
+            mean = self.mean,
+            min = self.min,
+            max = self.max,
+            p50 = self.percentile(50),
+            p90 = self.percentile(90),
+            p99 = self.percentile(99)
+        )
+
+
+class Metrics:
+
+    """ Process-wide registry of named histograms """
+
+    _histograms = defaultdict(Histogram)
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, name, value):
+        """ Add a value to the named histogram """
+        with cls._lock:
+            cls._histograms[name].add(value)
+
+    @classmethod
+    def record_all(cls, prefix, values):
+        """ Add a dictionary of values to the histograms named prefix.key """
+        with cls._lock:
+            for key, value in values.items():
+                cls._histograms[prefix + key].add(value)
+
+    @classmethod
+    def snapshot(cls):
+        """ Return a dictionary of histogram summaries, by name """
+        with cls._lock:
+            return { name : h.as_dict() for name, h in sorted(cls._histograms.items()) }
+
+    @classmethod
+    def drain(cls):
+        """ Remove and return the histograms, e.g. to send them from a
+            worker process to a parent process that calls merge() """
+        with cls._lock:
+            result = dict(cls._histograms)
+            cls._histograms.clear()
+        return result
+
+    @classmethod
+    def merge(cls, histograms):
+        """ Merge a dictionary of histograms, as returned by drain() """
+        if not histograms:
+            return
+        with cls._lock:
+            for name, h in histograms.items():
+                cls._histograms[name].merge(h)
+
+    @classmethod
+    def reset(cls):
+        """ Clear all histograms """
+        with cls._lock:
+            cls._histograms.clear()
+
+    @classmethod
+    def report(cls):
+        """ Return a text report of the histograms """
+        lines = [ "{0:<40} {1:>8} {2:>12} {3:>12} {4:>12} {5:>12}"
+            .format("Metric", "Count", "Mean", "Median", "90%", "Max") ]
+        for name, d in cls.snapshot().items():
+            lines.append("{0:<40} {1:>8} {2:>12.4g} {3:>12.4g} {4:>12.4g} {5:>12.4g}"
+                .format(name, d["count"], d["mean"], d["p50"], d["p90"], d["max"] or 0.0))
+        return "\n".join(lines)
+
+
+class Collector:
+
+    """ Accumulates metric values for a unit of work, such as a sentence or an article """
+
+    def __init__(self, scope, parent = None):
+        self._scope = scope
+        self._parent = parent
+        self._values = defaultdict(float)
+        self._start = time.perf_counter()
+
+    def add(self, name, value):
+        """ Add to the named value """
+        self._values[name] += value
+
+    @property
+    def values(self):
+        """ Return a dictionary of the values collected so far """
+        return dict(self._values)
+
+    def finish(self):
+        """ Record the collected values in the histograms and
+            add them to the enclosing collector, if any """
+        values = self._values
+        values["time"] = time.perf_counter() - self._start
+        Metrics.record_all(self._scope + ".", values)
+        if self._parent is not None:
+            parent_values = self._parent._values
+            for name, value in values.items():
+                if name != "time":
+                    parent_values[name] += value
+            # Count the finished units of work within the parent
+            parent_values[self._scope + ".count"] += 1
+
+
+# Stack of active collectors, per thread
+_local = threading.local()
+
+
+def current():
+    """ Return the innermost active collector on this thread, or None """
+    return getattr(_local, "collector", None)
+
+
+def add(name, value = 1):
+    """ Add to a value in the innermost active collector, if any """
+    c = getattr(_local, "collector", None)
+    if c is not None:
+        c._values[name] += value
+
+
+@contextmanager
+def collect(scope):
+    """ Context manager to collect metrics for a unit of work """
+    if not Settings.METRICS:
+        yield None
+        return
+    parent = getattr(_local, "collector", None)
+    c = Collector(scope, parent)
+    _local.collector = c
+    try:
+        yield c
+    finally:
+        _local.collector = parent
+        c.finish()
+
+
+@contextmanager
+def timer(name):
+    """ Context manager to add the elapsed time of a block, in seconds,
+        to a value in the innermost active collector, if any """
+    c = getattr(_local, "collector", None)
+    if c is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        c._values[name] += time.perf_counter() - t0
+
+
+class StageTimer:
+
+    """ Times the stages of a pipeline of generators, such as the tokenizer.
+        Each stage is wrapped by calling wrap(), in pipeline order, and the
+        time spent in the stage itself (excluding the stages it pulls from)
+        is added to the active collector when the stage is exhausted. """
+
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self._last = None # The most recently wrapped stage
+
+    class _Stage:
+
+        def __init__(self, name, inner):
+            self.name = name
+            self.inner = inner
+            self.elapsed = 0.0
+
+        def run(self, stream):
+            clock = time.perf_counter
+            it = iter(stream)
+            try:
+                while True:
+                    t0 = clock()
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        self.elapsed += clock() - t0
+                        break
+                    self.elapsed += clock() - t0
+                    yield item
+            finally:
+                own = self.elapsed - (self.inner.elapsed if self.inner else 0.0)
+                add(self.name, own)
+
+    def wrap(self, name, stream):
+        """ Wrap a stage, returning a timed generator """
+        if not Settings.METRICS:
+            return stream
+        stage = StageTimer._Stage(self._prefix + name + ".time", self._last)
+        self._last = stage
+        return stage.run(stream)
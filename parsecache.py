@@ -0,0 +1,356 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Parse result cache module
+
+    Copyright (C) 2016 Vilhjálmur Þorsteinsson
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a process-wide cache of parse results, sitting
+    in front of Fast_Parser.go() and Reducer.go(). Sentences are identified
+    by the keys of their wrapped BIN_Tokens (see BIN_Token.key), along with
+    the parser version and root nonterminal. The reduced tree is stored in
+    the compact string format of ParseForestDumper.
+
+    Boilerplate sentences, such as bylines, captions and 'Lesa meira' links,
+    recur in many articles and are thus parsed only once per process -
+    or only once overall, if the cache is persisted to disk.
+
+    On a cache hit, a lightweight tree is recreated from the stored dump,
+    using the tokens of the sentence being parsed. The tree supports
+    the same navigation interface as the Node forest returned by Fast_Parser,
+    so it can be processed by ParseForestNavigator subclasses, including
+    ParseForestDumper which recreates the original dump.
+
+"""
+
+import os
+import pickle
+import atexit
+from threading import Lock
+from collections import OrderedDict
+
+from fastparser import Fast_Parser, ParseError, ParseTimeout, ParseForestDumper
+from settings import Settings
+import metrics
+
+
+class _CachedNode:
+
+    """ A node of a tree that has been recreated from a ParseForestDumper
+        string. It supports the navigation interface of fastparser.Node. """
+
+    __slots__ = ('_nonterminal', '_terminal', '_token', '_interior',
+        '_families', '_start', '_end')
+
+    def __init__(self, start, nonterminal = None, terminal = None, token = None, interior = False):
+        self._nonterminal = nonterminal
+        self._terminal = terminal
+        self._token = token
+        self._interior = interior
+        self._families = None
+        self._start = start
+        self._end = start + 1 if token is not None else start
+
+    def set_children(self, children, end):
+        """ Set the children of this node, creating a left-nested chain
+            of interior nodes if there are more than two of them """
+        self._end = end
+        if not children:
+            # All children were skipped (empty) optional nodes
+            return
+        if len(children) == 1:
+            self._families = [ (None, children[0]) ]
+            return
+        left = children[0]
+        pos = self._start if left is None else left._end
+        for c in children[1:-1]:
+            if c is not None:
+                pos = c._end
+            interior = _CachedNode(self._start, interior = True)
+            interior._end = pos
+            interior._families = [ (None, (left, c)) ]
+            left = interior
+        self._families = [ (None, (left, children[-1])) ]
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def nonterminal(self):
+        return self._nonterminal
+
+    @property
+    def terminal(self):
+        return self._terminal
+
+    @property
+    def token(self):
+        return self._token
+
+    @property
+    def is_ambiguous(self):
+        return False
+
+    @property
+    def is_interior(self):
+        return self._interior
+
+    @property
+    def is_completed(self):
+        return not self._interior
+
+    @property
+    def is_token(self):
+        return self._token is not None
+
+    @property
+    def has_children(self):
+        return bool(self._families)
+
+    @property
+    def is_empty(self):
+        if not self._families:
+            return True
+        return self._families[0][1] is None
+
+    def enum_children(self):
+        """ Enumerate families of children """
+        if self._families:
+            yield from self._families
+
+    def reduce_to(self, child_ix):
+        """ The tree is already reduced, having a single family of children """
+        assert child_ix == 0
+
+    def __str__(self):
+        return str(self._nonterminal or self._token)
+
+
+def load_tree(dump, grammar, tokens):
+    """ Recreate a tree from a ParseForestDumper string, associating its
+        token nodes with the given (wrapped) tokens, in order.
+        Returns None if the dump does not fit the grammar or the tokens. """
+    lines = dump.split("\n")
+    if len(lines) < 3 or lines[0] != "R1" or lines[-1] != "Q0":
+        return None
+    pos = 0 # Index of the next token
+    top = [] # Children of the (virtual) top level
+    # Stack of (level, node, children) for the nonterminals being constructed
+    stack = []
+    try:
+        for line in lines[1:-1]:
+            kind = line[0]
+            a = line[1:].split(" ", 2)
+            level = int(a[0])
+            while stack and stack[-1][0] >= level:
+                _, node, children = stack.pop()
+                node.set_children(children, pos)
+            siblings = stack[-1][2] if stack else top
+            if kind == "N":
+                node = _CachedNode(pos, nonterminal = grammar.nonterminals[a[1]])
+                siblings.append(node)
+                stack.append((level, node, []))
+            elif kind == "T":
+                siblings.append(_CachedNode(pos, terminal = grammar.terminals[a[1]],
+                    token = tokens[pos]))
+                pos += 1
+            elif kind == "P":
+                siblings.append(None)
+            else:
+                # Ambiguous (unreduced) trees are not cached
+                return None
+    except (KeyError, IndexError, ValueError):
+        return None
+    while stack:
+        _, node, children = stack.pop()
+        node.set_children(children, pos)
+    if pos != len(tokens) or len(top) != 1:
+        # The tree does not cover the tokens
+        return None
+    return top[0]
+
+
+class ParseCache:
+
+    """ A size-bounded, least-recently-used (LRU) cache of parse results,
+        shared by all parsers within a process """
+
+    # Location of the cache file, if persisted across restarts
+    PERSIST_FILE = os.path.join("resources", "parse.cache")
+
+    # Estimated per-entry overhead in bytes, in addition to the strings
+    _ENTRY_OVERHEAD = 256
+
+    _instance = None
+    _instance_lock = Lock()
+
+    def __init__(self, maxbytes):
+        self._cache = OrderedDict() # Mapping of keys to (num, dump, err_index), in LRU order
+        self._maxbytes = maxbytes
+        self._nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._lock = Lock() # The cache may be accessed in parallel by multiple threads
+
+    @classmethod
+    def instance(cls):
+        """ Return the process-wide cache instance, or None if caching is disabled """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    c = False
+                    if Settings.PARSE_CACHE_SIZE:
+                        c = cls(Settings.PARSE_CACHE_SIZE)
+                        if Settings.PARSE_CACHE_PERSIST:
+                            c.load(cls.PERSIST_FILE)
+                            atexit.register(c.save, cls.PERSIST_FILE)
+                    cls._instance = c
+        return cls._instance or None
+
+    @staticmethod
+    def _size(key, value):
+        """ Estimate the memory footprint of a cache entry """
+        dump = value[1]
+        return ParseCache._ENTRY_OVERHEAD + (len(dump) if dump else 0) + \
+            sum(len(t[1]) + 32 for t in key[2])
+
+    def get(self, key):
+        """ Return the cached (num, dump, err_index) tuple for the key, or None """
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, num, dump, err_index):
+        """ Store a parse result in the cache """
+        value = (num, dump, err_index)
+        size = self._size(key, value)
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._nbytes += size
+            # Evict least recently used entries until we're below the ceiling
+            while self._nbytes > self._maxbytes and len(self._cache) > 1:
+                k, v = self._cache.popitem(last = False)
+                self._nbytes -= self._size(k, v)
+                self.evictions += 1
+
+    def parse(self, parser, reducer, tokens):
+        """ Parse and reduce the given sentence tokens, returning a (num, tree, dump)
+            tuple where num is the number of combinations in the unreduced
+            forest. On a cache hit, the tree is recreated from the stored dump.
+            Raises ParseError if the sentence cannot be parsed. """
+        wrapped_tokens = parser._wrap(tokens) # Inherited from BIN_Parser
+        key = (parser.version, parser.root_index, tuple(t.key for t in wrapped_tokens))
+        value = self.get(key)
+        if value is not None:
+            metrics.add("parse_cache.hits")
+            num, dump, err_index = value
+            if dump is None:
+                raise ParseError("No parse available at token {0} (cached result)"
+                    .format(err_index + 1), err_index)
+            tree = load_tree(dump, parser.grammar, wrapped_tokens)
+            if tree is not None:
+                # The key does not cover the context-dependent auxiliary
+                # data (t2) of non-word tokens, so the dump is recreated
+                # from the tree, which is bound to the current tokens
+                return (num, tree, ParseForestDumper.dump_forest(tree))
+        metrics.add("parse_cache.misses")
+        try:
+            forest = parser.go_wrapped(wrapped_tokens)
+            if forest is None:
+                return (0, None, None)
+            num = Fast_Parser.num_combinations(forest)
+            if num > 1:
+                with metrics.timer("reduce.time"):
+                    forest = reducer.go(forest)
+        except ParseTimeout:
+            # Not cached, since the parse might succeed with a larger budget
+            raise
+        except ParseError as e:
+            self.put(key, 0, None, e.token_index)
+            raise
+        dump = ParseForestDumper.dump_forest(forest)
+        self.put(key, num, dump, None)
+        return (num, forest, dump)
+
+    def load(self, fname):
+        """ Load cache entries from a file written by save() """
+        try:
+            with open(fname, "rb") as f:
+                entries = pickle.load(f)
+        except Exception:
+            # Missing or incompatible file: start with an empty cache
+            return
+        with self._lock:
+            for key, value in entries:
+                if key not in self._cache:
+                    self._cache[key] = value
+                    self._nbytes += self._size(key, value)
+        if Settings.DEBUG:
+            print("Loaded {0} parse cache entries from {1}".format(len(entries), fname))
+
+    def save(self, fname):
+        """ Save the cache entries to a file, to be loaded by a subsequent process """
+        with self._lock:
+            entries = list(self._cache.items())
+        tmpname = "{0}.{1}.tmp".format(fname, os.getpid())
+        try:
+            with open(tmpname, "wb") as f:
+                pickle.dump(entries, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            print("Unable to save parse cache to {0}: {1}".format(fname, e))
+
+    def stats(self):
+        """ Return a dictionary of cache statistics """
+        with self._lock:
+            return dict(
+                entries = len(self._cache),
+                nbytes = self._nbytes,
+                maxbytes = self._maxbytes,
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions
+            )
+
+
+def parse_sentence(parser, reducer, tokens):
+    """ Parse and reduce a sentence, using the process-wide parse cache
+        if enabled. Returns a (num, tree, dump) tuple; see ParseCache.parse().
+        The dump is None if the cache is disabled, in which case it is
+        up to the caller to create it if needed. """
+    cache = ParseCache.instance()
+    if cache is not None:
+        return cache.parse(parser, reducer, tokens)
+    forest = parser.go(tokens)
+    if forest is None:
+        return (0, None, None)
+    num = Fast_Parser.num_combinations(forest)
+    if num > 1:
+        with metrics.timer("reduce.time"):
+            forest = reducer.go(forest)
+    return (num, forest, None)
@@ -0,0 +1,268 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Parse worker pool module
+
+    Copyright (C) 2016 Vilhjálmur Þorsteinsson
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a pool of long-lived worker processes that
+    parse articles, for use by the scraper.
+
+    The grammar, the BIN lexicon and the word DAWG are loaded (warmed up)
+    in the parent process before the workers are forked, so that they are
+    shared copy-on-write, and again explicitly in each worker before it
+    starts pulling work from the task queue. The caches of a worker thus
+    stay warm across articles, instead of being discarded after each
+    chunk of articles as with a fresh multiprocessing.Pool.
+
+    Workers load and parse articles but do not write to the database.
+    The parsed Article objects are returned to the parent process, which
+    is the single writer. Each worker has its own pipe to the parent and
+    at most one article in flight, so the parent does not read work
+    descriptors faster than the workers can consume them (back-pressure),
+    and a worker that dies cannot corrupt a queue shared with the others.
+
+    To contain memory creep, a worker retires after parsing a given
+    number of articles, or when its current resident memory (RSS, including
+    pages shared with the parent process) exceeds a threshold,
+    and is replaced by a freshly forked worker. A worker that dies
+    unexpectedly, for instance within the C++ parser, is also replaced;
+    the article it was working on is reported as failed.
+
+"""
+
+import gc
+import os
+import sys
+import resource
+import multiprocessing
+import multiprocessing.connection
+
+from settings import Settings, UnknownVerbs
+from fetcher import Fetcher
+from article import Article
+from bindb import BIN_Db
+from binlexicon import BIN_Lexicon
+from dawgdictionary import Wordbase
+from scraperdb import SessionContext
+from metrics import Metrics
+
+
+def warm_up(connect = True):
+    """ Load the grammar, the BIN lexicon and the word DAWG into
+        the current process, if not already loaded. If connect is True,
+        also open the BIN database connection, unless the lexicon is used. """
+    Article.get_parser()
+    if Settings.BIN_LEXICON:
+        BIN_Lexicon.get()
+    Wordbase.dawg()
+    if connect:
+        # Database connections cannot be shared with forked processes,
+        # so this is only done within the workers
+        BIN_Db.get_db()
+
+
+def _rss():
+    """ Return the current resident memory of the current process, in bytes.
+        Note that this includes pages shared with the parent process. """
+    try:
+        # The second field of statm is the number of resident pages
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    # No /proc file system: fall back to the peak resident memory
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _worker_main(conn, max_articles, max_memory):
+    """ Main function of a worker process, receiving tasks and
+        sending results through its end of a pipe """
+    pid = os.getpid()
+    # Do not share the database connections of the parent process
+    SessionContext.cleanup()
+    # Discard the metrics inherited from the parent process, which
+    # would otherwise be merged back into it
+    Metrics.reset()
+    try:
+        warm_up()
+    except Exception as e:
+        # Carry on: the errors will be reported per article
+        print("Exception when warming up parse worker {0}: {1!r}".format(pid, e))
+    cnt = 0
+    while True:
+        d = conn.recv()
+        if d is None:
+            # Sentinel: the pool is closing
+            break
+        a = None
+        try:
+            helper = Fetcher._get_helper(d.root)
+            if helper:
+                with SessionContext() as session:
+                    a = Article.load_from_url(d.url, session)
+                    if a is not None:
+                        a._parse(session)
+                # Save the unknown verbs accumulated during parsing, if any
+                UnknownVerbs.write()
+        except Exception as e:
+            print("Exception when parsing article at {0}: {1!r}".format(d.url, e))
+            a = None
+        cnt += 1
+        retire = (max_articles and cnt >= max_articles) or (max_memory and _rss() >= max_memory)
+        # Return the parsed article along with the metrics histograms
+        # collected in this process since the last article, and
+        # a flag indicating whether this worker is retiring
+        conn.send((a, Metrics.drain(), bool(retire)))
+        if retire:
+            break
+    conn.close()
+
+
+class _Worker:
+
+    """ The parent's handle on a worker process """
+
+    def __init__(self, max_articles, max_memory):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = _worker_main,
+            args = (child_conn, max_articles, max_memory))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.task = None # The descriptor of the article being parsed, if any
+
+    def assign(self, d):
+        """ Send an article to the worker for parsing """
+        self.task = d
+        self.conn.send(d)
+
+    def stop(self):
+        """ Ask the worker to exit, and wait until it does """
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, EOFError):
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+class ParsePool:
+
+    """ A pool of warm, long-lived article parsing processes """
+
+    def __init__(self, processes = None, max_articles = None, max_memory = None):
+        self._processes = processes or Settings.PARSE_WORKERS or os.cpu_count() or 1
+        self._max_articles = Settings.WORKER_MAX_ARTICLES if max_articles is None else max_articles
+        self._max_memory = Settings.WORKER_MAX_MEMORY if max_memory is None else max_memory
+        self._workers = []
+        self.recycled = 0
+        self.failed = 0
+
+    def __enter__(self):
+        """ Python context manager protocol """
+        self.start()
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Python context manager protocol """
+        self.close()
+        return False
+
+    def start(self):
+        """ Warm up the parent process and fork the worker processes """
+        warm_up(connect = False)
+        # Run garbage collection to minimize the common memory footprint,
+        # and keep the collector from touching the shared objects afterwards
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        self._workers = [ self._spawn() for _ in range(self._processes) ]
+        print("Parse pool started with {0} worker processes".format(self._processes))
+
+    def _spawn(self):
+        """ Fork a new worker process """
+        return _Worker(self._max_articles, self._max_memory)
+
+    def _replace(self, w):
+        """ Replace a worker that has exited with a fresh one """
+        w.stop()
+        self._workers[self._workers.index(w)] = self._spawn()
+
+    def parse(self, descriptors):
+        """ Parse the articles described by the given ArticleDescr iterable.
+            Yields (descriptor, article) tuples in order of completion,
+            where article is None if the article could not be parsed.
+            Each worker has at most one article in flight, so the
+            descriptors are not read faster than the workers consume them. """
+        it = iter(descriptors)
+        exhausted = False
+        while True:
+            if not exhausted:
+                # Assign articles to idle workers
+                for w in self._workers:
+                    if w.task is None:
+                        d = next(it, None)
+                        if d is None:
+                            exhausted = True
+                            break
+                        w.assign(d)
+            busy = [ w for w in self._workers if w.task is not None ]
+            if not busy:
+                break
+            # Wait for a result, or for the unexpected death of a worker
+            ready = set(multiprocessing.connection.wait(
+                [ w.conn for w in busy ] + [ w.process.sentinel for w in busy ]))
+            for w in busy:
+                d = w.task
+                if w.conn in ready:
+                    try:
+                        a, histograms, retiring = w.conn.recv()
+                    except (EOFError, OSError):
+                        # The worker died before sending a result
+                        a, histograms, retiring = None, None, None
+                elif w.process.sentinel in ready:
+                    a, histograms, retiring = None, None, None
+                else:
+                    continue
+                w.task = None
+                if retiring is None:
+                    w.process.join()
+                    print("Parse worker {0} died with exit code {1} while parsing {2}"
+                        .format(w.process.pid, w.process.exitcode, d.url))
+                    self._replace(w)
+                else:
+                    # Aggregate the metrics collected in the worker process
+                    Metrics.merge(histograms)
+                    if retiring:
+                        self.recycled += 1
+                        self._replace(w)
+                if a is None:
+                    self.failed += 1
+                yield (d, a)
+
+    def close(self):
+        """ Stop the worker processes """
+        for w in self._workers:
+            w.stop()
+        self._workers = []
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
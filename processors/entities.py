@@ -35,6 +35,7 @@
 import re
 from datetime import datetime
 from scraperdb import Entity
+from entityindex import EntityIndex
 
 
 MODULE_NAME = __name__
@@ -63,7 +64,9 @@ def article_end(state):
     """ Called at the end of article processing """
     for k, v in state["names"].items():
         print("Last name '{0}' -> full name '{1}'".format(k, v))
-    pass
+    # The entities of the article have been replaced: have the entity
+    # name index of this process pick up the changes at its next lookup
+    EntityIndex.invalidate()
 
 
 def sentence(state, result):
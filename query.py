@@ -37,6 +37,7 @@ from tree import Tree
 from tokenizer import TOK, correct_spaces
 from fastparser import Fast_Parser, ParseForestDumper, ParseForestPrinter, ParseError
 from reducer import Reducer
+from parsecache import parse_sentence
 
 
 _THIS_MODULE = sys.modules[__name__] # The module object for this module
@@ -377,19 +378,15 @@ class Query:
                     # Parse the accumulated sentence
                     num = 0
                     try:
-                        # Parse the sentence
-                        forest = bp.go(sent)
-                        if forest is not None:
-                            num = Fast_Parser.num_combinations(forest)
-                            if num > 1:
-                                # Reduce the resulting forest
-                                forest = rdc.go(forest)
+                        # Parse and reduce the sentence, or fetch
+                        # the result from the parse cache
+                        num, forest, dump = parse_sentence(bp, rdc, sent)
                     except ParseError as e:
                         forest = None
                     if num > 0:
                         num_parsed_sent += 1
                         # Obtain a text representation of the parse tree
-                        trees[num_sent] = ParseForestDumper.dump_forest(forest)
+                        trees[num_sent] = dump or ParseForestDumper.dump_forest(forest)
                         #ParseForestPrinter.print_forest(forest)
 
                 elif t[0] == TOK.P_BEGIN:
@@ -38,9 +38,9 @@
 
 from collections import defaultdict
 
-from fastparser import ParseForestNavigator
+from fastparser import Fast_Parser, ParseForestNavigator, Node, ffi
 from grammar import Terminal
-from settings import Preferences, VerbObjects
+from settings import Settings, Preferences, VerbObjects
 
 
 class Reducer:
@@ -49,6 +49,7 @@ class Reducer:
 
     def __init__(self, grammar):
         self._grammar = grammar
+        self._nt_score_array = None # Nonterminal score adjustments for the C++ reducer
 
 
     class OptionFinder(ParseForestNavigator):
@@ -85,10 +86,16 @@ class Reducer:
         self._find_options(w, finals, tokens)
 
         # Second pass: find a (partial) ordering by scoring the terminal alternatives for each token
+        return self._score_terminals(finals, tokens, w.start, w.end)
+
+
+    def _score_terminals(self, finals, tokens, start, end):
+        """ Score the possible terminals for each token within [start, end) """
+
         scores = dict()
 
         # Loop through the indices of the tokens spanned by this tree
-        for i in range(w.start, w.end):
+        for i in range(start, end):
 
             s = finals[i]
             # Initially, each alternative has a score of 0
@@ -245,7 +252,7 @@ class Reducer:
                         # BÍN meanings are available: discourage this
                         #print("sérnafn '{0}': BÍN meanings available, discouraging".format(tokens[i].t1))
                         sc[t] -= 6
-                        if i == w.start:
+                        if i == start:
                             # First token in sentence, and we have BÍN meanings:
                             # further discourage this
                             sc[t] -= 4
@@ -259,7 +266,7 @@ class Reducer:
                     # Give a bonus for exact or semi-exact matches
                     sc[t] += 1
 
-        #for i in range(w.start, w.end):
+        #for i in range(start, end):
         #    print("At token '{0}' scores dict is:\n{1}".format(tokens[i].t1, scores[i]))
         return scores
 
@@ -363,10 +370,52 @@ class Reducer:
         return self.ParseForestReducer(self._grammar, scores).go(w)
 
 
+    def _nt_scores(self):
+        """ Return an array of nonterminal score adjustments for the C++ reducer """
+        if self._nt_score_array is None:
+            g = self._grammar
+            num_nt = max(-ix for ix in g.nonterminals_by_ix) if g.nonterminals_by_ix else 0
+            a = ffi.new("INT[]", num_nt) # Initialized to zero
+            for nt, sc in g._nt_scores.items():
+                a[-1 - nt.index] = sc
+            self._nt_score_array = a
+        return self._nt_score_array
+
+
+    def _reduce_native(self, w, c_root):
+        """ Reduce a forest in the C++ parser module, before its conversion
+            to Python, so that only the surviving tree is converted """
+        ep = Fast_Parser.eparser
+        # First pass: find the (token, terminal) options in the C++ forest
+        n = ep.findOptions(c_root, ffi.NULL, ffi.NULL, 0)
+        token_ix = ffi.new("UINT[]", n)
+        terminal_ix = ffi.new("UINT[]", n)
+        ep.findOptions(c_root, token_ix, terminal_ix, n)
+        lookup = self._grammar.lookup
+        options = [ (token_ix[k], lookup(terminal_ix[k])) for k in range(n) ]
+        finals = defaultdict(set)
+        for i, t in options:
+            finals[i].add(t)
+        all_tokens = w.forest.tokens
+        tokens = { i : all_tokens[i] for i in finals }
+        # Second pass: score the terminal alternatives for each token
+        scores = self._score_terminals(finals, tokens, w.start, w.end)
+        option_scores = ffi.new("INT[]", [ scores[i][t] for i, t in options ])
+        # Third pass: prune the C++ forest, bottom-up
+        nt_scores = self._nt_scores()
+        return ep.reduceForest(c_root, n, token_ix, terminal_ix, option_scores,
+            len(nt_scores), nt_scores)
+
+
     def go_with_score(self, forest):
         """ Returns the argument forest after pruning it down to a single tree """
         if forest is None:
             return (None, 0)
+        if Settings.NATIVE_REDUCER and isinstance(forest, Node):
+            c_root = forest.native_root
+            if c_root is not None:
+                # The forest has not been converted to Python: reduce it natively
+                return (forest, self._reduce_native(forest, c_root))
         scores = self._calc_terminal_scores(forest)
         # Third pass: navigate the tree bottom-up, eliminating lower-rated
         # options (subtrees) in favor of higher rated ones
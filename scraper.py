@@ -39,9 +39,11 @@ from multiprocessing import Pool
 
 from datetime import datetime
 
-from settings import Settings, ConfigError, UnknownVerbs
+from settings import Settings, ConfigError
 from fetcher import Fetcher
 from article import Article
+from metrics import Metrics
+from parsepool import ParsePool
 
 from scraperdb import Scraper_DB, SessionContext, Root, IntegrityError
 from scraperdb import Article as ArticleRow
@@ -186,21 +188,6 @@ class Scraper:
             print("Exception when scraping article at {0}: {1!r}".format(d.url, e))
 
 
-    def _parse_single_article(self, d):
-        """ Single article parser that will be called by a process within a
-            multiprocessing pool """
-        try:
-            helper = Fetcher._get_helper(d.root)
-            if helper:
-                self.parse_article(d.url, helper)
-                # Save the unknown verbs accumulated during parsing, if any
-                UnknownVerbs.write()
-        except Exception as e:
-            print("Exception when parsing article at {0}: {1!r}".format(d.url, e))
-            #traceback.print_exc()
-            #raise e from e
-
-
     def go(self, reparse = False, limit = 0, urls = None):
         """ Run a scraping pass from all roots in the scraping database """
 
@@ -272,39 +259,31 @@ class Scraper:
                                 # Found the article: yield it
                                 yield ArticleDescr(a.root, a.url)
 
-            # Use a multiprocessing pool to parse the articles.
-            # Let the pool work on chunks of articles, recycling the
-            # processes after each chunk to contain memory creep.
+            # Use a pool of warm worker processes to parse the articles.
+            # The workers are recycled after a number of articles, or when
+            # they exceed a memory threshold, to contain memory creep.
+            # The parsed articles are stored in the database by this process.
 
-            CHUNK_SIZE = 100
             if urls is None:
                 g = iter_unparsed_articles(reparse, limit)
             else:
                 g = iter_urls(urls)
-                limit = 0
             cnt = 0
-            while True:
-                adlist = []
-                lcnt = 0
-                for ad in g:
-                    adlist.append(ad)
-                    lcnt += 1
-                    if lcnt == CHUNK_SIZE or (limit > 0 and cnt + lcnt >= limit):
-                        break
-                if lcnt:
-                    # Run garbage collection to minimize common memory footprint
-                    import gc
-                    gc.collect()
-                    print("Parser processes forking, chunk of {0} articles".format(lcnt))
-                    pool = Pool() # Defaults to using as many processes as there are CPUs
-                    pool.map(self._parse_single_article, adlist)
-                    pool.close()
-                    pool.join()
-                    # session.commit() # This seems to cause errors
-                    print("Parser processes joined, chunk of {0} articles parsed".format(lcnt))
-                    cnt += lcnt
-                if lcnt < CHUNK_SIZE:
-                    break
+            with ParsePool() as pool:
+                for ad, a in pool.parse(g):
+                    if a is None:
+                        continue
+                    try:
+                        with SessionContext(commit = True) as wsession:
+                            a.store(wsession)
+                    except Exception as e:
+                        print("Exception when storing article at {0}: {1!r}".format(ad.url, e))
+                        continue
+                    print("Parsed {2}/{1} sentences of article {0}"
+                        .format(ad.url, a.num_sentences, a.num_parsed))
+                    cnt += 1
+                print("Parse pool finished: {0} articles parsed, {1} failed, {2} workers recycled"
+                    .format(cnt, pool.failed, pool.recycled))
 
 
     @staticmethod
@@ -369,6 +348,7 @@ def scrape_articles(reparse = False, limit = 0, urls = None):
             print("Scraper terminated with exception {0}".format(e))
         finally:
             sc.stats()
+            print("\nPerformance metrics:\n{0}".format(Metrics.report()))
     finally:
         sc = None
 
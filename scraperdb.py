@@ -28,16 +28,17 @@
 import sys
 import platform
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, tuple_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, backref
+from sqlalchemy.orm import sessionmaker, relationship, backref, defer as SqlDefer
 from sqlalchemy import Table, Column, Integer, String, Float, DateTime, Sequence, \
-    Boolean, UniqueConstraint, ForeignKey, PrimaryKeyConstraint
+    Boolean, UniqueConstraint, ForeignKey, PrimaryKeyConstraint, LargeBinary
 from sqlalchemy.exc import SQLAlchemyError as SqlError
 from sqlalchemy.exc import IntegrityError as SqlIntegrityError
 from sqlalchemy.exc import DataError as SqlDataError
 from sqlalchemy import desc as SqlDesc
 from sqlalchemy.dialects.postgresql import UUID as psql_UUID
+from sqlalchemy.dialects.postgresql import insert as psql_insert
 
 from settings import Settings
 
@@ -51,6 +52,8 @@ DatabaseError = SqlError
 DataError = SqlDataError
 # Same for the desc() function
 desc = SqlDesc
+# ...and the defer() query option, to avoid loading large columns
+defer = SqlDefer
 
 
 class Scraper_DB:
@@ -73,6 +76,26 @@ class Scraper_DB:
     def create_tables(self):
         """ Create all missing tables in the database """
         Base.metadata.create_all(self._engine)
+        self.migrate()
+
+    def migrate(self):
+        """ Bring columns of existing tables up to date with the models.
+            Returns True if any changes were made. """
+        # Article.tree was changed from a varchar column containing text
+        # dumps to a bytea column containing the binary encoding of
+        # tree.pack_tree(). Converted text trees are loaded as before,
+        # until their articles are reparsed.
+        data_type = self._engine.execute(text(
+            "select data_type from information_schema.columns "
+            "where table_name = 'articles' and column_name = 'tree'"
+        )).scalar()
+        if data_type is None or data_type == "bytea":
+            return False
+        self._engine.execute(text(
+            "alter table articles alter column tree type bytea "
+            "using convert_to(tree, 'UTF8')"
+        ))
+        return True
 
     def execute(self, sql, **kwargs):
         """ Execute raw SQL directly on the engine """
@@ -231,8 +254,10 @@ class Article(Base):
 
     # The HTML obtained in the last scrape
     html = Column(String)
-    # The parse tree obtained in the last parse
-    tree = Column(String)
+    # The parse tree obtained in the last parse, in the binary encoding
+    # created by tree.pack_tree(). Trees in the older text format are
+    # still loaded, after conversion of the column by Scraper_DB.migrate()
+    tree = Column(LargeBinary)
     # The tokens of the article in JSON string format
     tokens = Column(String)
 
@@ -356,6 +381,9 @@ class Word(Base):
         PrimaryKeyConstraint('article_id', 'stem', 'cat', name='words_pkey'),
     )
 
+    # Maximum number of rows in each multi-row statement
+    _BATCH_SIZE = 1000
+
     def __repr__(self):
         return "Word(stem='{0}', cat='{1}', cnt='{2}')" \
             .format(self.stem, self.cat, self.cnt)
@@ -364,6 +392,37 @@ class Word(Base):
     def table(cls):
         return cls.__table__
 
+    @classmethod
+    def counts(cls, session, article_id):
+        """ Return a dict of the (stem, cat) tuples stored for an article, with their counts """
+        q = session.execute(
+            text("select stem, cat, cnt from words where article_id = :a"),
+            dict(a = article_id))
+        return { (stem, cat) : cnt for stem, cat, cnt in q }
+
+    @classmethod
+    def insert_many(cls, session, article_id, words):
+        """ Insert an iterable of (stem, cat, cnt) tuples for an article,
+            using multi-row insert statements instead of one ORM object per row """
+        rows = [ dict(article_id = article_id, stem = stem, cat = cat, cnt = cnt)
+            for stem, cat, cnt in words ]
+        for i in range(0, len(rows), cls._BATCH_SIZE):
+            session.execute(cls.table().insert().values(rows[i:i + cls._BATCH_SIZE]))
+
+    @classmethod
+    def delete_many(cls, session, article_id, keys = None):
+        """ Delete the given (stem, cat) tuples for an article,
+            or all of its words if keys is None """
+        t = cls.table()
+        if keys is None:
+            session.execute(t.delete().where(t.c.article_id == article_id))
+            return
+        keys = list(keys)
+        for i in range(0, len(keys), cls._BATCH_SIZE):
+            session.execute(t.delete()
+                .where(t.c.article_id == article_id)
+                .where(tuple_(t.c.stem, t.c.cat).in_(keys[i:i + cls._BATCH_SIZE])))
+
 
 class Topic(Base):
 
@@ -430,6 +489,32 @@ class ArticleTopic(Base):
         return cls.__table__
 
 
+class _CopyStream:
+
+    """ A minimal read-only file object over an iterable of lines,
+        to be fed to the COPY ... FROM STDIN command of PostgreSQL """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buf = ""
+
+    def read(self, size = -1):
+        chunks = [ self._buf ]
+        length = len(self._buf)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        s = "".join(chunks)
+        if size < 0:
+            self._buf = ""
+            return s
+        self._buf = s[size:]
+        return s[0:size]
+
+
 class Trigram(Base):
 
     """ Represents a trigram of tokens from a parsed sentence """
@@ -458,6 +543,30 @@ class Trigram(Base):
             where tg.t1 = :t1 and tg.t2 = :t2 and tg.t3 = :t3;
         """
 
+    # Temporary staging table for bulk loading of trigram counts
+    _STAGING_Q = """
+        create temporary table if not exists trigrams_staging
+            (t1 varchar(64), t2 varchar(64), t3 varchar(64), frequency integer)
+            on commit drop;
+        """
+
+    # Merge the staging table into the trigrams table in a single statement.
+    # The staging table may contain several rows for the same trigram,
+    # which must be summed since ON CONFLICT can only update a row once.
+    _MERGE_Q = """
+        insert into trigrams as tg (t1, t2, t3, frequency)
+            select t1, t2, t3, sum(frequency) from trigrams_staging
+                group by t1, t2, t3
+            on conflict (t1, t2, t3)
+            do update set frequency = tg.frequency + excluded.frequency;
+        """
+
+    # Maximum number of rows in each multi-row statement
+    _BATCH_SIZE = 1000
+
+    # Escapes for the text format of the COPY command
+    _COPY_ESCAPES = str.maketrans({ "\\" : "\\\\", "\t" : "\\t", "\n" : "\\n", "\r" : "\\r" })
+
     __table_args__ = (
         PrimaryKeyConstraint('t1', 't2', 't3', name='trigrams_pkey'),
     )
@@ -469,14 +578,64 @@ class Trigram(Base):
         # that was introduced in PostgreSQL 9.5. This means that the upsert runs on the
         # server side and is atomic, either an insert of a new trigram or an update of
         # the frequency count of an existing identical trigram.
+        t1, t2, t3 = Trigram.key(t1, t2, t3)
+        session.execute(Trigram._Q, dict(t1 = t1, t2 = t2, t3 = t3))
+
+    @staticmethod
+    def key(t1, t2, t3):
+        """ Return a trigram tuple, with the tokens truncated to the maximum length """
         mwl = Trigram.MAX_WORD_LEN
-        if len(t1) > mwl:
-            t1 = t1[0:mwl]
-        if len(t2) > mwl:
-            t2 = t2[0:mwl]
-        if len(t3) > mwl:
-            t3 = t3[0:mwl]
-        session.execute(self._Q, dict(t1 = t1, t2 = t2, t3 = t3))
+        return (t1[0:mwl], t2[0:mwl], t3[0:mwl])
+
+    @staticmethod
+    def merge_counts(session, counts):
+        """ Add an iterable of (t1, t2, t3, count) tuples to the trigrams table.
+            The tuples are bulk loaded with COPY into a staging table, which is
+            then merged into the trigrams table with a single upsert. The tokens
+            are assumed to be truncated already (see Trigram.key()). """
+        esc = Trigram._COPY_ESCAPES
+        lines = (
+            "{0}\t{1}\t{2}\t{3}\n".format(t1.translate(esc), t2.translate(esc), t3.translate(esc), cnt)
+            for t1, t2, t3, cnt in counts
+        )
+        session.execute(Trigram._STAGING_Q)
+        # COPY is not supported by SQLAlchemy, so we use the underlying
+        # psycopg2 (or psycopg2cffi) connection of the session
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "copy trigrams_staging (t1, t2, t3, frequency) from stdin",
+                _CopyStream(lines), size = 64 * 1024)
+        finally:
+            cursor.close()
+        result = session.execute(Trigram._MERGE_Q)
+        session.execute("truncate trigrams_staging;")
+        return result.rowcount
+
+    @staticmethod
+    def adjust(session, deltas):
+        """ Apply a mapping of trigram tuples to (positive or negative)
+            frequency changes to the trigrams table, using one multi-row
+            upsert statement per batch. Trigrams whose frequency drops to
+            zero are deleted. """
+        # Sort the rows so that concurrent writers lock them in the same order
+        rows = [
+            dict(t1 = t1, t2 = t2, t3 = t3, frequency = delta)
+            for (t1, t2, t3), delta in sorted(deltas.items()) if delta
+        ]
+        t = Trigram.table()
+        for i in range(0, len(rows), Trigram._BATCH_SIZE):
+            q = psql_insert(t).values(rows[i:i + Trigram._BATCH_SIZE])
+            q = q.on_conflict_do_update(
+                index_elements = [ t.c.t1, t.c.t2, t.c.t3 ],
+                set_ = dict(frequency = t.c.frequency + q.excluded.frequency)
+            )
+            session.execute(q)
+        removed = [ (r["t1"], r["t2"], r["t3"]) for r in rows if r["frequency"] < 0 ]
+        for i in range(0, len(removed), Trigram._BATCH_SIZE):
+            session.execute(t.delete()
+                .where(tuple_(t.c.t1, t.c.t2, t.c.t3).in_(removed[i:i + Trigram._BATCH_SIZE]))
+                .where(t.c.frequency <= 0))
 
     @staticmethod
     def delete_all(session):
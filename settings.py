@@ -302,6 +302,40 @@ class DisallowedNames:
         cls.STEMS[name] = set(cases)
 
 
+class PhraseTrie:
+
+    """ A trie of multiword phrases, at the word (token) level, used by the
+        tokenizer to match phrases in a single pass over the token stream.
+        Nodes are identified by integers, the root being node 0. The trie
+        consists of plain lists and dicts and can thus be pickled. """
+
+    ROOT = 0
+
+    def __init__(self):
+        # Dictionary of child nodes, keyed by word, for each node
+        self.children = [ { } ]
+        # Index of the phrase ending at each node, or None
+        self.final = [ None ]
+
+    def add(self, words, ix):
+        """ Add a phrase, given as a list of words, with the index ix """
+        node = PhraseTrie.ROOT
+        for w in words:
+            d = self.children[node]
+            node = d.get(w)
+            if node is None:
+                node = d[w] = len(self.final)
+                self.children.append({ })
+                self.final.append(None)
+        if self.final[node] is None:
+            # If a phrase is repeated, its first occurrence prevails
+            self.final[node] = ix
+
+    def __len__(self):
+        """ Return the number of nodes in the trie """
+        return len(self.final)
+
+
 class StaticPhrases:
 
     """ Wrapper around dictionary of static phrases, initialized from the config file """
@@ -312,8 +346,8 @@ class StaticPhrases:
     MAP = { }
     # List of all static phrases and their meanings
     LIST = []
-    # Parsing dictionary keyed by first word of phrase
-    DICT = { }
+    # Trie of the phrases, for matching in the tokenizer
+    TRIE = PhraseTrie()
 
     @staticmethod
     def add (phrase):
@@ -331,19 +365,8 @@ class StaticPhrases:
         # Add to the main phrase dictionary
         StaticPhrases.MAP[phrase] = mtuple
 
-        # Dictionary structure: dict { firstword: [ (restword_list, phrase_index) ] }
-
-        # Split phrase into words
-        wlist = phrase.split()
-        # Dictionary is keyed by first word
-        w = wlist[0]
-        d = StaticPhrases.DICT
-        if w in d:
-            # First word already there: add a subsequent list
-            d[w].append((wlist[1:], ix))
-        else:
-            # Create a new entry for this first word
-            d[w] = [ (wlist[1:], ix) ]
+        # Add the words of the phrase to the trie
+        StaticPhrases.TRIE.add(phrase.split(), ix)
 
     @staticmethod
     def set_meaning(meaning):
@@ -367,8 +390,8 @@ class AmbigPhrases:
 
     # List of tuples of ambiguous phrases and their word category lists
     LIST = []
-    # Parsing dictionary keyed by first word of phrase
-    DICT = defaultdict(list)
+    # Trie of the phrases, for matching in the tokenizer
+    TRIE = PhraseTrie()
 
     @staticmethod
     def add (words, cats):
@@ -380,8 +403,8 @@ class AmbigPhrases:
         # Append the phrase as well as its meaning in tuple form
         AmbigPhrases.LIST.append((words, cats))
 
-        # Dictionary structure: dict { firstword: [ (restword_list, phrase_index) ] }
-        AmbigPhrases.DICT[words[0]].append((words[1:], ix))
+        # Add the words of the phrase to the trie
+        AmbigPhrases.TRIE.add(words, ix)
 
     @staticmethod
     def get_cats(ix):
@@ -538,6 +561,62 @@ class Settings:
     # Flask debug parameter
     DEBUG = False
 
+    # Use the embedded BIN lexicon file, if present, instead of the database
+    BIN_LEXICON = True
+
+    # Memory ceiling of the token/terminal matching cache in Fast_Parser, in bytes
+    MATCHING_CACHE_SIZE = 32 * 1024 * 1024
+
+    # Compute the full token/terminal match table of each sentence before
+    # parsing, instead of matching lazily via callbacks from the C++ parser
+    MATCH_TABLE = True
+
+    # Memory ceiling of the process-wide parse result cache, in bytes (0 to disable)
+    PARSE_CACHE_SIZE = 16 * 1024 * 1024
+
+    # Persist the parse result cache to disk between runs
+    PARSE_CACHE_PERSIST = False
+
+    # Collect performance metrics (see metrics.py)
+    METRICS = True
+
+    # Work budget for parsing a single sentence (0 means no limit)
+    PARSE_TIMEOUT = 15.0 # Wall-clock seconds
+    PARSE_MAX_STATES = 0 # Earley states
+    PARSE_MAX_NODES = 0 # Parse forest nodes
+
+    # Create the Python parse forest nodes lazily, on first access
+    LAZY_FOREST = True
+
+    # Reduce parse forests in the C++ parser module, before their
+    # conversion to Python (requires LAZY_FOREST)
+    NATIVE_REDUCER = True
+
+    # Number of article parsing processes in the scraper (0 means one per CPU)
+    PARSE_WORKERS = 0
+
+    # Recycle a parsing process after this many articles (0 means no limit)...
+    WORKER_MAX_ARTICLES = 100
+    # ...or when its current resident memory (RSS) exceeds this many bytes (0 means no limit)
+    WORKER_MAX_MEMORY = 2 * 1024 * 1024 * 1024
+
+    # Number of processes for parsing the sentences of a single text
+    # in parallel, e.g. in the web server (0 disables parallel parsing)
+    SENTENCE_WORKERS = 0
+
+    # When storing a reparsed article, only write the changes to its
+    # indexed word stems, instead of deleting and reinserting them all
+    WORDS_DIFF = True
+
+    # Keep the trigrams table up to date when articles are stored,
+    # by adding the trigrams of new parses and subtracting those of old ones
+    TRIGRAMS_INCREMENTAL = True
+
+    # Interval between checks for new rows in the process-wide entity
+    # name index of the tokenizer, in seconds (0 disables the index,
+    # whereupon entity names are looked up in the database)
+    ENTITY_INDEX_REFRESH = 60.0
+
     # Configuration settings from the Reynir.conf file
 
     @staticmethod
@@ -558,6 +637,72 @@ class Settings:
             Settings.HOST = val
         elif par == 'debug':
             Settings.DEBUG = bool(val)
+        elif par == 'bin_lexicon':
+            Settings.BIN_LEXICON = bool(val)
+        elif par == 'matching_cache_size':
+            try:
+                Settings.MATCHING_CACHE_SIZE = int(val)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid matching_cache_size value '{0}'".format(val))
+        elif par == 'match_table':
+            Settings.MATCH_TABLE = bool(val)
+        elif par == 'parse_cache_size':
+            try:
+                Settings.PARSE_CACHE_SIZE = int(val)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid parse_cache_size value '{0}'".format(val))
+        elif par == 'parse_cache_persist':
+            Settings.PARSE_CACHE_PERSIST = bool(val)
+        elif par == 'metrics':
+            Settings.METRICS = bool(val)
+        elif par == 'lazy_forest':
+            Settings.LAZY_FOREST = bool(val)
+        elif par == 'native_reducer':
+            Settings.NATIVE_REDUCER = bool(val)
+        elif par == 'parse_workers':
+            try:
+                Settings.PARSE_WORKERS = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid parse_workers value '{0}'".format(val))
+        elif par == 'worker_max_articles':
+            try:
+                Settings.WORKER_MAX_ARTICLES = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid worker_max_articles value '{0}'".format(val))
+        elif par == 'worker_max_memory':
+            try:
+                Settings.WORKER_MAX_MEMORY = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid worker_max_memory value '{0}'".format(val))
+        elif par == 'sentence_workers':
+            try:
+                Settings.SENTENCE_WORKERS = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid sentence_workers value '{0}'".format(val))
+        elif par == 'words_diff':
+            Settings.WORDS_DIFF = bool(val)
+        elif par == 'trigrams_incremental':
+            Settings.TRIGRAMS_INCREMENTAL = bool(val)
+        elif par == 'entity_index_refresh':
+            try:
+                Settings.ENTITY_INDEX_REFRESH = float(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid entity_index_refresh value '{0}'".format(val))
+        elif par == 'parse_timeout':
+            try:
+                Settings.PARSE_TIMEOUT = float(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid parse_timeout value '{0}'".format(val))
+        elif par == 'parse_max_states':
+            try:
+                Settings.PARSE_MAX_STATES = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid parse_max_states value '{0}'".format(val))
+        elif par == 'parse_max_nodes':
+            try:
+                Settings.PARSE_MAX_NODES = int(val or 0)
+            except (TypeError, ValueError):
+                raise ConfigError("Invalid parse_max_nodes value '{0}'".format(val))
         else:
             raise ConfigError("Unknown configuration parameter '{0}'".format(par))
 
@@ -28,6 +28,10 @@
     potential interpretations of the word, as retrieved
     from the BIN database of word forms.
 
+    The function tokenize_stream() does the same for a file object or
+    an iterable of text chunks, consuming the input as tokens are
+    requested, so that large texts need not be read into memory.
+
 """
 
 from contextlib import closing
@@ -41,7 +45,9 @@ import datetime
 from settings import Settings, StaticPhrases, Abbreviations, AmbigPhrases, DisallowedNames
 from settings import changedlocale
 from bindb import BIN_Db, BIN_Meaning
+from metrics import StageTimer
 from scraperdb import SessionContext, Entity
+from entityindex import EntityIndex
 
 
 # Recognized punctuation
@@ -59,6 +65,9 @@ SENTENCE_FINISHERS = frozenset([')', ']', '“', '»', '”', '’', '"', '[…]
 # Punctuation symbols that may occur inside words
 PUNCT_INSIDE_WORD = frozenset(['.', "'", '‘', "´", "’"]) # Period and apostrophes
 
+# Maximum number of tokens to buffer in annotate() before looking up their meanings
+ANNOTATE_LOOKAHEAD = 200
+
 # Hyphens that are cast to '-' for parsing and then re-cast
 # to normal hyphens, en or em dashes in final rendering
 HYPHENS = "—–-"
@@ -428,10 +437,44 @@ def parse_digits(w):
     return TOK.Unknown(w), len(w)
 
 
+def split_chunks(chunks):
+    """ Generator yielding the whitespace-separated words of a stream of
+        text chunks, as str.split() would for the concatenated text.
+        A word may be split across chunk boundaries; its beginning is then
+        carried over to the next chunk. """
+    carry = "" # Beginning of a word that ended a chunk
+    for chunk in chunks:
+        if not chunk:
+            continue
+        words = chunk.split()
+        if carry:
+            if chunk[0].isspace():
+                # The carried word was complete
+                yield carry
+            else:
+                # The chunk continues the carried word
+                # (if it isn't all whitespace, it has at least one word)
+                words[0] = carry + words[0]
+            carry = ""
+        if words and not chunk[-1].isspace():
+            # The last word may continue in the next chunk
+            carry = words.pop()
+        yield from words
+    if carry:
+        yield carry
+
+
+def read_chunks(f, chunk_size = 64 * 1024):
+    """ Generator yielding fixed-size text chunks read from a file object,
+        so that memory use does not depend on the length of its lines """
+    return iter(lambda: f.read(chunk_size), "")
+
+
 def parse_tokens(txt):
-    """ Generator that parses contiguous text into a stream of tokens """
+    """ Generator that parses contiguous text into a stream of tokens.
+        The text can be a string or an iterable of text chunks. """
 
-    rough = txt.split()
+    rough = txt.split() if isinstance(txt, str) else split_chunks(txt)
 
     for w in rough:
         # Handle each sequence of non-whitespace characters
@@ -722,27 +765,46 @@ def annotate(token_stream, auto_uppercase):
     at_sentence_start = False
 
     with closing(BIN_Db.get_db()) as db:
+
+        def lookahead(token_stream):
+            """ Generate lists of tokens, each ending with a sentence end or
+                at most ANNOTATE_LOOKAHEAD tokens long, after looking up the
+                unknown word forms in each list with a single batch query """
+            buf = []
+            for t in token_stream:
+                buf.append(t)
+                if t.kind == TOK.S_END or len(buf) >= ANNOTATE_LOOKAHEAD:
+                    db.lookup_words([ tb.txt for tb in buf if tb.kind == TOK.WORD and tb.val is None ],
+                        auto_uppercase)
+                    yield buf
+                    buf = []
+            if buf:
+                db.lookup_words([ tb.txt for tb in buf if tb.kind == TOK.WORD and tb.val is None ],
+                    auto_uppercase)
+                yield buf
+
         # Consume the iterable source in wlist (which may be a generator)
-        for t in token_stream:
-            if t.kind != TOK.WORD:
-                # Not a word: relay the token unchanged
-                yield t
-                if t.kind == TOK.S_BEGIN or (t.kind == TOK.PUNCTUATION and t.txt == ':'):
-                    at_sentence_start = True
-                elif t.kind != TOK.PUNCTUATION and t.kind != TOK.ORDINAL:
+        for buf in lookahead(token_stream):
+            for t in buf:
+                if t.kind != TOK.WORD:
+                    # Not a word: relay the token unchanged
+                    yield t
+                    if t.kind == TOK.S_BEGIN or (t.kind == TOK.PUNCTUATION and t.txt == ':'):
+                        at_sentence_start = True
+                    elif t.kind != TOK.PUNCTUATION and t.kind != TOK.ORDINAL:
+                        at_sentence_start = False
+                    continue
+                if t.val is not None:
+                    # Already have a meaning
+                    yield t
                     at_sentence_start = False
-                continue
-            if t.val is not None:
-                # Already have a meaning
-                yield t
+                    continue
+                # Look up word in BIN database (most likely already in the cache)
+                w, m = db.lookup_word(t.txt, at_sentence_start, auto_uppercase)
+                # Yield a word tuple with meanings
+                yield TOK.Word(w, m)
+                # No longer at sentence start
                 at_sentence_start = False
-                continue
-            # Look up word in BIN database
-            w, m = db.lookup_word(t.txt, at_sentence_start, auto_uppercase)
-            # Yield a word tuple with meanings
-            yield TOK.Word(w, m)
-            # No longer at sentence start
-            at_sentence_start = False
 
 
 # Recognize words that multiply numbers
@@ -1457,12 +1519,18 @@ def parse_static_phrases(token_stream, auto_uppercase):
     """ Parse a stream of tokens looking for static multiword phrases
         (i.e. phrases that are not affected by inflection).
         The algorithm implements N-token lookahead where N is the
-        length of the longest phrase.
+        length of the longest phrase. The phrases are matched by
+        walking the phrase trie, keeping a list of the trie nodes
+        of the phrases we're considering.
     """
 
     tq = [] # Token queue
-    state = defaultdict(list) # Phrases we're considering
-    pdict = StaticPhrases.DICT # The phrase dictionary
+    state = [] # Trie nodes of the phrases we're considering
+    newstate = [] # The next state, reused to avoid allocations
+    trie = StaticPhrases.TRIE
+    children = trie.children # List of child dictionaries, by node
+    final = trie.final # List of phrase indices, by node
+    root = children[trie.ROOT] # Words that start a phrase
 
     try:
 
@@ -1476,52 +1544,54 @@ def parse_static_phrases(token_stream, auto_uppercase):
                     for t in tq: yield t
                     tq = []
                 if state:
-                    state = defaultdict(list)
+                    state.clear()
                 yield token
                 continue
 
             # Look for matches in the current state and build a new state
-            newstate = defaultdict(list)
+            newstate.clear()
             wo = token.txt # Original word
             w = wo.lower() # Lower case
             if wo == w:
                 wo = w
 
-            def add_to_state(slist, index):
-                """ Add the list of subsequent words to the new parser state """
-                wrd = slist[0]
-                rest = slist[1:]
-                newstate[wrd].append((rest, index))
-
-            # First check for original (uppercase) word in the state, if any;
-            # if that doesn't match, check the lower case
-            wm = None
-            if wo is not w and wo in state:
-                wm = wo
-            elif w in state:
-                wm = w
-
-            if wm:
+            if state:
+                # First check for original (uppercase) word in the state, if any;
+                # if that doesn't match, check the lower case
+                if wo is not w:
+                    for node in state:
+                        child = children[node].get(wo)
+                        if child is not None:
+                            newstate.append(child)
+                if not newstate:
+                    for node in state:
+                        child = children[node].get(w)
+                        if child is not None:
+                            newstate.append(child)
+
+            if newstate:
                 # This matches an expected token:
                 # go through potential continuations
                 tq.append(token) # Add to lookahead token queue
                 token = None
-                for sl, ix in state[wm]:
-                    if not sl:
-                        # No subsequent word: this is a complete match
-                        # Reconstruct original text behind phrase
-                        w = " ".join([t.txt for t in tq])
-                        # Add the entire phrase as one 'word' to the token queue
-                        yield TOK.Word(w, [BIN_Meaning._make(r) for r in StaticPhrases.get_meaning(ix)])
-                        # Discard the state and start afresh
-                        newstate = defaultdict(list)
-                        w = wo = ""
-                        tq = []
-                        # Note that it is possible to match even longer phrases
-                        # by including a starting phrase in its entirety in
-                        # the static phrase dictionary
+                ix = None
+                for node in newstate:
+                    ix = final[node]
+                    if ix is not None:
                         break
-                    add_to_state(sl, ix)
+                if ix is not None:
+                    # This is a complete match
+                    # Reconstruct original text behind phrase
+                    w = " ".join([t.txt for t in tq])
+                    # Add the entire phrase as one 'word' to the token queue
+                    yield TOK.Word(w, [BIN_Meaning._make(r) for r in StaticPhrases.get_meaning(ix)])
+                    # Discard the state and start afresh
+                    # Note that it is possible to match even longer phrases
+                    # by including a starting phrase in its entirety in
+                    # the static phrase dictionary
+                    tq = []
+                    state.clear()
+                    continue
             elif tq:
                 for t in tq: yield t
                 tq = []
@@ -1531,33 +1601,33 @@ def parse_static_phrases(token_stream, auto_uppercase):
                 # If we are auto-uppercasing, leave single-letter lowercase
                 # phrases alone, i.e. 'g' for 'gram' and 'm' for 'meter'
                 pass
-            elif wo is not w and wo in pdict:
+            elif wo is not w and wo in root:
                 wm = wo
-            elif w in pdict:
+            elif w in root:
                 wm = w
 
-            # Add all possible new states for phrases that could be starting
+            # Add the new state for phrases that could be starting
             if wm:
                 # This word potentially starts a phrase
-                for sl, ix in pdict[wm]:
-                    if not sl:
-                        # Simple replace of a single word
-                        if tq:
-                            for t in tq: yield tq
-                            tq = []
-                        # Yield the replacement token
-                        yield TOK.Word(token.txt, [BIN_Meaning._make(r) for r in StaticPhrases.get_meaning(ix)])
-                        newstate = defaultdict(list)
-                        token = None
-                        break
-                    add_to_state(sl, ix)
-                if token:
-                    tq.append(token)
+                node = root[wm]
+                ix = final[node]
+                if ix is not None and token:
+                    # Simple replace of a single word
+                    if tq:
+                        for t in tq: yield t
+                        tq = []
+                    # Yield the replacement token
+                    yield TOK.Word(token.txt, [BIN_Meaning._make(r) for r in StaticPhrases.get_meaning(ix)])
+                    newstate.clear()
+                else:
+                    newstate.append(node)
+                    if token:
+                        tq.append(token)
             elif token:
                 yield token
 
             # Transition to the new state
-            state = newstate
+            state, newstate = newstate, state
 
     except StopIteration:
         # Token stream is exhausted
@@ -1573,12 +1643,17 @@ def disambiguate_phrases(token_stream):
         (i.e. phrases that have a well known very likely interpretation but
         other extremely uncommon ones are also grammatically correct).
         The algorithm implements N-token lookahead where N is the
-        length of the longest phrase.
+        length of the longest phrase. The phrases are matched by
+        walking the phrase trie, as in parse_static_phrases().
     """
 
     tq = [] # Token queue
-    state = defaultdict(list) # Phrases we're considering
-    pdict = AmbigPhrases.DICT # The phrase dictionary
+    state = [] # Trie nodes of the phrases we're considering
+    newstate = [] # The next state, reused to avoid allocations
+    trie = AmbigPhrases.TRIE
+    children = trie.children # List of child dictionaries, by node
+    final = trie.final # List of phrase indices, by node
+    root = children[trie.ROOT] # Words that start a phrase
 
     try:
 
@@ -1593,62 +1668,53 @@ def disambiguate_phrases(token_stream):
                     tq = []
                 # Discard the previous state, if any
                 if state:
-                    state = defaultdict(list)
+                    state.clear()
                 # ...and yield the non-matching token
                 yield token
                 continue
 
             # Look for matches in the current state and build a new state
-            newstate = defaultdict(list)
+            newstate.clear()
             w = token.txt.lower()
 
-            def add_to_state(slist, index):
-                """ Add the list of subsequent words to the new parser state """
-                wrd = slist[0]
-                rest = slist[1:]
-                newstate[wrd].append((rest, index))
+            for node in state:
+                child = children[node].get(w)
+                if child is not None:
+                    newstate.append(child)
 
-            if w in state:
+            if newstate:
                 # This matches an expected token:
                 # go through potential continuations
                 tq.append(token) # Add to lookahead token queue
                 token = None
-                for sl, ix in state[w]:
-                    if not sl:
-                        # No subsequent word: this is a complete match
-                        # Discard meanings of words in the token queue that are not
-                        # compatible with the category list specified
-                        cats = AmbigPhrases.get_cats(ix)
-                        # assert len(cats) == len(tq)
-                        # print("Matching ambiguous phrase")
-                        for t, cat in zip(tq, cats):
-                            # assert t.kind == TOK.WORD
-                            # Yield a new token with fewer meanings for each original token in the queue
-                            #print("Ambig word {0}:\n   original meanings {1}\n   restricted meanings {2}"
-                            #    .format(t.txt, t.val, [m for m in t.val if m.ordfl == cat]))
-                            yield TOK.Word(t.txt, [m for m in t.val if m.ordfl == cat])
-
-                        # Discard the state and start afresh
-                        if newstate:
-                            newstate = defaultdict(list)
-                        w = ""
-                        tq = []
-                        # Note that it is possible to match even longer phrases
-                        # by including a starting phrase in its entirety in
-                        # the static phrase dictionary
+                ix = None
+                for node in newstate:
+                    ix = final[node]
+                    if ix is not None:
                         break
-                    add_to_state(sl, ix)
+                if ix is not None:
+                    # This is a complete match
+                    # Discard meanings of words in the token queue that are not
+                    # compatible with the category list specified
+                    cats = AmbigPhrases.get_cats(ix)
+                    for t, cat in zip(tq, cats):
+                        # Yield a new token with fewer meanings for each original token in the queue
+                        yield TOK.Word(t.txt, [m for m in t.val if m.ordfl == cat])
+                    # Discard the state and start afresh
+                    tq = []
+                    state.clear()
+                    continue
             elif tq:
                 # This does not continue a started phrase:
                 # yield the accumulated token queue
                 for t in tq: yield t
                 tq = []
 
-            if w in pdict:
+            node = root.get(w)
+            if node is not None:
                 # This word potentially starts a new phrase
-                for sl, ix in pdict[w]:
-                    # assert sl
-                    add_to_state(sl, ix)
+                # (ambiguous phrases have at least two words)
+                newstate.append(node)
                 if token:
                     tq.append(token) # Start a lookahead queue with this token
             elif token:
@@ -1656,7 +1722,7 @@ def disambiguate_phrases(token_stream):
                 yield token
 
             # Transition to the new state
-            state = newstate
+            state, newstate = newstate, state
 
     except StopIteration:
         # Token stream is exhausted
@@ -1677,6 +1743,7 @@ def recognize_entities(token_stream, enclosing_session = None):
     state = defaultdict(list) # Phrases we're considering
     ecache = dict() # Entitiy definition cache
     lastnames = dict() # Last name to full name mapping ('Clinton' -> 'Hillary Clinton')
+    eindex = EntityIndex.instance() # Process-wide entity name index, if enabled
 
     with SessionContext(session = enclosing_session, commit = True) as session:
 
@@ -1694,7 +1761,11 @@ def recognize_entities(token_stream, enclosing_session = None):
             """ Return a list of entities matching the initial word given """
             e = ecache.get(w)
             if e is None:
-                ecache[w] = e = fetch_entities(w)
+                if eindex is not None:
+                    e = eindex.lookup(session, w)
+                else:
+                    e = fetch_entities(w)
+                ecache[w] = e
             return e
 
         def flush_match():
@@ -1868,31 +1939,72 @@ def recognize_entities(token_stream, enclosing_session = None):
 def tokenize(text, auto_uppercase = False, enclosing_session = None):
     """ Tokenize text in several phases, returning a generator (iterable sequence) of tokens
         that processes tokens on-demand. If auto_uppercase is True, the tokenizer
-        attempts to correct lowercase words that probably should be uppercase. """
+        attempts to correct lowercase words that probably should be uppercase.
+        The text can be a string or an iterable of text chunks (see tokenize_stream). """
 
     # Thank you Python for enabling this programming pattern ;-)
 
-    token_stream = parse_tokens(text)
+    # Time each phase separately (see metrics.py)
+    st = StageTimer("tokenize.")
+
+    token_stream = st.wrap("parse_tokens", parse_tokens(text))
 
-    token_stream = parse_particles(token_stream)
+    token_stream = st.wrap("parse_particles", parse_particles(token_stream))
 
-    token_stream = parse_sentences(token_stream)
+    token_stream = st.wrap("parse_sentences", parse_sentences(token_stream))
 
-    token_stream = parse_static_phrases(token_stream, auto_uppercase) # Static multiword phrases
+    token_stream = st.wrap("parse_static_phrases",
+        parse_static_phrases(token_stream, auto_uppercase)) # Static multiword phrases
 
-    token_stream = annotate(token_stream, auto_uppercase) # Lookup meanings from dictionary
+    token_stream = st.wrap("annotate",
+        annotate(token_stream, auto_uppercase)) # Lookup meanings from dictionary
 
-    token_stream = parse_phrases_1(token_stream) # First phrase pass
+    token_stream = st.wrap("parse_phrases_1", parse_phrases_1(token_stream)) # First phrase pass
 
-    token_stream = parse_phrases_2(token_stream) # Second phrase pass
+    token_stream = st.wrap("parse_phrases_2", parse_phrases_2(token_stream)) # Second phrase pass
 
-    token_stream = recognize_entities(token_stream, enclosing_session) # Recognize named entities from database
+    token_stream = st.wrap("recognize_entities",
+        recognize_entities(token_stream, enclosing_session)) # Recognize named entities from database
 
-    token_stream = disambiguate_phrases(token_stream) # Eliminate very uncommon meanings
+    token_stream = st.wrap("disambiguate_phrases",
+        disambiguate_phrases(token_stream)) # Eliminate very uncommon meanings
 
     return token_stream
 
 
+def tokenize_stream(source, auto_uppercase = False, enclosing_session = None):
+    """ Tokenize text from a file object or an iterable of text chunks,
+        such as a generator, without reading it all into memory first.
+        Words may be split across chunk boundaries. All tokenizer phases
+        have a bounded lookahead, so the tokens are generated as the source
+        is consumed. Use sentences() to obtain the tokens one sentence
+        at a time. """
+    if hasattr(source, "read"):
+        source = read_chunks(source)
+    return tokenize(iter(source), auto_uppercase, enclosing_session)
+
+
+def sentences(token_stream):
+    """ Generator yielding the sentences of a token stream, one at a time,
+        as lists of tokens not including the TOK.S_BEGIN and TOK.S_END tokens.
+        Paragraph markers are skipped, as are empty sentences. In contrast
+        to paragraphs(), this does not require the whole token list. """
+    sent = None
+    for t in token_stream:
+        t0 = t[0]
+        if t0 == TOK.S_BEGIN:
+            sent = []
+        elif t0 == TOK.S_END:
+            if sent:
+                yield sent
+            sent = None
+        elif sent is not None:
+            sent.append(t)
+    if sent:
+        # Unterminated sentence at the end of the stream
+        yield sent
+
+
 def paragraphs(toklist):
     """ Generator yielding paragraphs from a token list. Each paragraph is a list
         of sentence tuples. Sentence tuples consist of the index of the first token
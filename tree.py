@@ -11,6 +11,10 @@
     This module implements a data structure for parsed sentence trees that can
     be loaded from text strings and processed by plug-in processing functions.
 
+    The trees of an article are stored in the database in a compact binary
+    encoding of the text format, created by pack_tree() and converted back
+    to text by unpack_tree(). TreeBase.load() accepts either one.
+
     A set of provided utility functions allow the extraction of nominative, indefinite
     and canonical (nominative + indefinite + singular) forms of the text within any subtree.
 
@@ -339,6 +343,8 @@ class TerminalDescriptor:
     _GENDERS = { "kk", "kvk", "hk" }
     _NUMBERS = { "et", "ft" }
     _PERSONS = { "p1", "p2", "p3" }
+    _VERB_VARIANTS = frozenset(BIN_Token.VERB_VARIANTS)
+    _OTHER_VARIANTS = frozenset([ "p1", "p2", "p3", "esb", "evb", "mst", "vb", "sb", "gr" ])
 
     def __init__(self, terminal):
         self.terminal = terminal
@@ -390,6 +396,41 @@ class TerminalDescriptor:
         if number:
             self.number = next(iter(number))
 
+        # Precompile the variant checks into bit masks that are matched
+        # against the fbits of BIN meanings (cf. VariantHandler._compile())
+        vbit = BIN_Token.VBIT
+        required = 0
+        if self.gender is not None and self.cat != "no":
+            # Nouns have their gender in the word category instead
+            required |= vbit[self.gender]
+        if self.number is not None:
+            required |= vbit[self.number]
+        if self.is_verb:
+            # Variants that must be present in verb forms
+            verb_required = 0
+            for v in self.variants & self._VERB_VARIANTS:
+                verb_required |= vbit[v]
+            self._verb_required = verb_required
+            # Restrictive variants that must not be present unless specified
+            verb_forbidden = 0
+            for v in BIN_Token.VERB_RESTRICTIVE:
+                if v not in self.variants:
+                    verb_forbidden |= vbit[v]
+            self._verb_forbidden = verb_forbidden
+            # Cases that must be present in a so_lhþt form
+            lh_cases = 0
+            if "lhþt" in self.variants:
+                for c in self.variants & self._CASES:
+                    lh_cases |= vbit[c]
+            self._lh_cases = lh_cases
+            self._nargs = int(self.varlist[0]) if self.varlist and self.varlist[0] in "012" else None
+        else:
+            # Person, degree, declension and definite article
+            for v in self.variants & self._OTHER_VARIANTS:
+                required |= vbit[v]
+        self._fbits_required = required
+        self._case_bit = 0 if self.case is None else vbit[self.case]
+
     def has_t_base(self, s):
         """ Does the node have the given terminal base name? """
         return self.cat == s
@@ -403,52 +444,45 @@ class TerminalDescriptor:
         #print("_bin_filter checking meaning {0}".format(m))
         if self.bin_cat is not None and m.ordfl not in self.bin_cat:
             return False
-        if self.gender is not None:
+        if self.gender is not None and self.cat == "no":
             # Check gender match
-            if self.cat == "no":
-                if m.ordfl != self.gender:
-                    return False
-            elif self.gender.upper() not in m.beyging:
+            if m.ordfl != self.gender:
                 return False
+        fbits = BIN_Token.get_fbits(m.beyging)
         if self.case is not None:
             # Check case match
             if case_override is not None:
                 # Case override: we don't want other cases beside the given one
-                for c in TerminalNode._CASES:
-                    if c != case_override:
-                        if c.upper() in m.beyging:
-                            return False
-            elif self.case.upper() not in m.beyging:
-                return False
-        # Check number match
-        if self.number is not None:
-            if self.number.upper() not in m.beyging:
+                if fbits & BIN_Token.VBIT_CASES & ~BIN_Token.VBIT[case_override]:
+                    return False
+            elif not (fbits & self._case_bit):
                 return False
+        # Check gender (other than for nouns) and number match,
+        # as well as person, VB/SB/MST and definite article for non-verbs
+        required = self._fbits_required
+        if (fbits & required) != required:
+            return False
 
         if self.is_verb:
             # The following code is parallel to BIN_Token.verb_matches()
-            for v in self.varlist:
-                # Lookup variant to see if it is one of the required ones for verbs
-                rq = BIN_Token._VERB_FORMS.get(v)
-                if rq and rq not in m.beyging:
-                    # If this is required variant that is not found in the form we have,
-                    # return False
-                    return False
-            for v in [ "sagnb", "lhþt", "bh" ]:
-                if BIN_Token.VARIANT[v] in m.beyging and v not in self.variants:
-                    return False
+            required = self._verb_required
+            if (fbits & required) != required:
+                # A required variant was not found in the form we have
+                return False
+            if fbits & self._verb_forbidden:
+                return False
             if "bh" in self.variants and "ST" in m.beyging:
                 return False
-            if self.varlist[0] not in "012":
+            nargs = self._nargs
+            if nargs is None:
                 # No need for argument check: we're done, unless...
-                if "lhþt" in self.variants:
-                    # Special check for lhþt: may specify a case without it being an argument case
-                    if any(c in self.variants and BIN_Token.VARIANT[c] not in m.beyging for c in BIN_Token.CASES):
-                        # Terminal specified a non-argument case but the token doesn't have it:
-                        # no match
-                        return False
+                # Special check for lhþt: may specify a case without it being an argument case
+                lh_cases = self._lh_cases
+                if (fbits & lh_cases) != lh_cases:
+                    # Terminal specified a non-argument case but the token doesn't have it:
+                    # no match
+                    return False
                 return True
-            nargs = int(self.varlist[0])
             if m.stofn in VerbObjects.VERBS[nargs]:
                 if nargs == 0 or len(self.varlist) < 2:
                     # No arguments: we're done
@@ -465,32 +499,6 @@ class TerminalDescriptor:
             # Unknown verb: allow it to match
             return True
 
-        # Check person match
-        if self.person is not None:
-            person = self.person.upper()
-            person = person[1] + person[0] # Turn p3 into 3P
-            if person not in m.beyging:
-                return False
-        # Check VB/SB/MST for adjectives
-        if "esb" in self.variants:
-            if "ESB" not in m.beyging:
-                return False
-        if "evb" in self.variants:
-            if "EVB" not in m.beyging:
-                return False
-        if "mst" in self.variants:
-            if "MST" not in m.beyging:
-                return False
-        if self.variant_vb:
-            if "VB" not in m.beyging:
-                return False
-        if "sb" in self.variants:
-            if "SB" not in m.beyging:
-                return False
-        # Definite article
-        if self.variant_gr:
-            if "gr" not in m.beyging:
-                return False
         #print("_bin_filter returns True")
         return True
 
@@ -814,13 +822,18 @@ class NonterminalNode(Node):
 
     """ A Node corresponding to a nonterminal """
 
+    # Cache of the base names and variants of nonterminals, by name
+    _NT = dict()
+
     def __init__(self, nonterminal):
         super().__init__()
         self.nt = nonterminal
-        elems = nonterminal.split("_")
-        # Calculate the base name of this nonterminal (without variants)
-        self.nt_base = elems[0]
-        self.variants = set(elems[1:])
+        nt = self._NT.get(nonterminal)
+        if nt is None:
+            elems = nonterminal.split("_")
+            # Calculate the base name of this nonterminal (without variants)
+            nt = self._NT[nonterminal] = (elems[0], frozenset(elems[1:]))
+        self.nt_base, self.variants = nt
 
     def has_nt_base(self, s):
         """ Does the node have the given nonterminal base name? """
@@ -875,6 +888,260 @@ class NonterminalNode(Node):
         return result
 
 
+# Binary tree encoding
+#
+# The text format consists of lines separated by newline characters, each
+# beginning with a code letter and an integer, optionally followed by
+# a space and further data (see ParseForestDumper). The binary encoding
+# starts with a magic byte string including the format version. This is
+# followed by a table of the distinct strings (symbols) occurring in the
+# lines: the number of symbols and the length of the table in bytes, as
+# varints, followed by the UTF-8 encoded symbols separated by newlines.
+# Next is an index of the sentences: the length in bytes of any records
+# preceding the first sentence and the number of sentences, followed by
+# the sentence number, the length in bytes of its records and its status
+# for each sentence (0 = unfinished, 1 = parsed, k + 2 = error at token k).
+# The rest consists of one record per line: an opcode byte followed by
+# the integer of the line and the symbol indices of its data, as varints.
+# Symbol index 0 denotes a missing field. Lines that do not have the
+# expected form are stored as raw symbols, so the encoding is lossless.
+# Version 1 of the encoding lacks the sentence index.
+
+TREE_MAGIC = b"\x00RT" # Cannot begin a UTF-8 text dump
+TREE_FORMAT_VERSION = 2
+
+_OP_LINE = 0 # Raw line: symbol
+_OP_S = 1 # Start of sentence: index
+_OP_Q = 2 # End of sentence
+_OP_E = 3 # End of sentence with error: token index
+_OP_R = 4 # Version
+_OP_P = 5 # Epsilon node: level
+_OP_N = 6 # Nonterminal: level, name
+_OP_T = 7 # Terminal: level, terminal, token, token type, aux
+_OP_O = 8 # Option: level, index
+
+# Line codes having no data besides the integer, by opcode
+_INT_CODES = { "S" : _OP_S, "Q" : _OP_Q, "E" : _OP_E, "R" : _OP_R, "P" : _OP_P }
+_CODE_CHARS = { op : code for code, op in _INT_CODES.items() }
+_CODE_CHARS[_OP_N] = "N"
+_CODE_CHARS[_OP_T] = "T"
+_CODE_CHARS[_OP_O] = "O"
+
+
+def _put_varint(out, n):
+    """ Append a non-negative integer to a bytearray in LEB128 varint format """
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos, b):
+    """ Decode the rest of a varint whose first byte b (>= 0x80) has been read.
+        Returns the value and the position after it. """
+    result = b & 0x7F
+    shift = 7
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_varint(data, pos):
+    """ Decode a varint at the given position. Returns the value
+        and the position after it. """
+    b = data[pos]
+    if b < 0x80:
+        return b, pos + 1
+    return _get_varint(data, pos + 1, b)
+
+
+def _parse_int(s):
+    """ Return s as a non-negative integer if it is in canonical form, otherwise None """
+    try:
+        n = int(s)
+    except ValueError:
+        return None
+    return n if n >= 0 and str(n) == s else None
+
+
+def pack_tree(txt):
+    """ Convert a tree in text format to the binary encoding """
+    symbols = { } # Symbol -> index
+    def sym(s):
+        ix = symbols.get(s)
+        if ix is None:
+            ix = symbols[s] = len(symbols) + 1
+        return ix
+    out = bytearray()
+    index = [] # List of [sentence number, offset of records, status]
+    for line in txt.split("\n"):
+        code = line[0:1]
+        a = line[1:].split(" ", maxsplit = 1)
+        n = _parse_int(a[0])
+        if n is not None:
+            if len(a) == 1 and code in _INT_CODES:
+                if code == "S":
+                    index.append([n, len(out), 0])
+                elif index and not index[-1][2]:
+                    if code == "Q":
+                        index[-1][2] = 1
+                    elif code == "E":
+                        index[-1][2] = n + 2
+                out.append(_INT_CODES[code])
+                _put_varint(out, n)
+                continue
+            if len(a) == 2:
+                if code == "N":
+                    out.append(_OP_N)
+                    _put_varint(out, n)
+                    _put_varint(out, sym(a[1]))
+                    continue
+                if code == "O":
+                    ix = _parse_int(a[1])
+                    if ix is not None:
+                        out.append(_OP_O)
+                        _put_varint(out, n)
+                        _put_varint(out, ix)
+                        continue
+                if code == "T":
+                    try:
+                        terminal, token, tokentype, aux, _ = TreeBase._parse_T(a[1])
+                    except (IndexError, AttributeError):
+                        terminal, token, tokentype, aux = "", "", "", ""
+                    # Check whether the token type was explicit, and whether
+                    # the line can be reconstructed from its parts
+                    s = terminal + " " + token
+                    if s == a[1] and not aux:
+                        tokentype = None
+                    elif tokentype:
+                        s += " " + tokentype
+                        if aux:
+                            s += " " + aux
+                    if s == a[1]:
+                        out.append(_OP_T)
+                        _put_varint(out, n)
+                        _put_varint(out, sym(terminal))
+                        _put_varint(out, sym(token))
+                        _put_varint(out, sym(tokentype) if tokentype else 0)
+                        _put_varint(out, sym(aux) if aux else 0)
+                        continue
+        # Store the line as-is
+        out.append(_OP_LINE)
+        _put_varint(out, sym(line))
+    table = "\n".join(symbols).encode("utf-8")
+    header = bytearray(TREE_MAGIC)
+    header.append(TREE_FORMAT_VERSION)
+    _put_varint(header, len(symbols))
+    _put_varint(header, len(table))
+    header += table
+    _put_varint(header, index[0][1] if index else len(out))
+    _put_varint(header, len(index))
+    for i, (n, offset, status) in enumerate(index):
+        _put_varint(header, n)
+        _put_varint(header, (index[i + 1][1] if i + 1 < len(index) else len(out)) - offset)
+        _put_varint(header, status)
+    return bytes(header + out)
+
+
+def is_packed_tree(data):
+    """ Return True if data is a tree in the binary encoding """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[0:3]) == TREE_MAGIC
+
+
+def _unpack_header(data):
+    """ Decode the header of a binary tree. Returns a tuple of the number
+        of symbols, the position and length of the symbol table, the
+        sentence index (None for version 1) and the position of the records.
+        The index is a list of (sentence number, start, end, status) tuples,
+        where start and end delimit the records of the sentence. """
+    if not is_packed_tree(data):
+        raise ValueError("Not a binary tree")
+    version = data[3]
+    if version < 1 or version > TREE_FORMAT_VERSION:
+        raise ValueError("Unsupported binary tree format version {0}".format(version))
+    nsym, pos = _read_varint(data, 4)
+    nbytes, pos = _read_varint(data, pos)
+    table = pos
+    pos += nbytes
+    index = None
+    if version >= 2:
+        preamble, pos = _read_varint(data, pos)
+        nsent, pos = _read_varint(data, pos)
+        entries = []
+        for _ in range(nsent):
+            n, pos = _read_varint(data, pos)
+            length, pos = _read_varint(data, pos)
+            status, pos = _read_varint(data, pos)
+            entries.append((n, length, status))
+        # The records start here: convert lengths to absolute positions
+        start = pos + preamble
+        index = []
+        for n, length, status in entries:
+            index.append((n, start, start + length, status))
+            start += length
+    return nsym, table, nbytes, index, pos
+
+
+def _unpack_symbols(data, nsym, table, nbytes):
+    """ Decode the symbol table of a binary tree. Returns a list
+        of the symbols, with None at index 0. """
+    symbols = [ None ]
+    if nsym:
+        symbols.extend(bytes(data[table:table + nbytes]).decode("utf-8").split("\n"))
+    assert len(symbols) == nsym + 1
+    return symbols
+
+
+def tree_index(data):
+    """ Return the sentence index of a tree in the binary encoding,
+        as a list of (sentence number, start, end, status) tuples, or None
+        if the tree is in the text format or has no index """
+    if not is_packed_tree(data):
+        return None
+    return _unpack_header(data)[3]
+
+
+def unpack_tree(data):
+    """ Convert a tree in the binary encoding back to text format """
+    nsym, table, nbytes, _, pos = _unpack_header(data)
+    symbols = _unpack_symbols(data, nsym, table, nbytes)
+    lines = []
+    end = len(data)
+    while pos < end:
+        op = data[pos]
+        n = data[pos + 1]
+        pos += 2
+        if n >= 0x80:
+            n, pos = _get_varint(data, pos, n)
+        if op == _OP_LINE:
+            lines.append(symbols[n])
+            continue
+        v = [ ]
+        for _ in range({ _OP_N : 1, _OP_O : 1, _OP_T : 4 }.get(op, 0)):
+            x = data[pos]
+            pos += 1
+            if x >= 0x80:
+                x, pos = _get_varint(data, pos, x)
+            v.append(x)
+        line = "{0}{1}".format(_CODE_CHARS[op], n)
+        if op == _OP_N:
+            line += " " + symbols[v[0]]
+        elif op == _OP_O:
+            line += " {0}".format(v[0])
+        elif op == _OP_T:
+            line += " " + symbols[v[0]] + " " + symbols[v[1]]
+            if v[2]:
+                line += " " + symbols[v[2]]
+                if v[3]:
+                    line += " " + symbols[v[3]]
+        lines.append(line)
+    return "\n".join(lines)
+
+
 class TreeBase:
 
     """ A tree corresponding to a single parsed article """
@@ -905,18 +1172,18 @@ class TreeBase:
 
     def push(self, n, node):
         """ Add a node into the tree at the right level """
-        if n == len(self.stack):
+        stack = self.stack
+        if n == len(stack):
             # First child of parent
             if n:
-                self.stack[n-1].set_child(node)
-            self.stack.append(node)
+                stack[n-1].child = node
+            stack.append(node)
         else:
-            assert n < len(self.stack)
+            assert n < len(stack)
             # Next child of parent
-            self.stack[n].set_next(node)
-            self.stack[n] = node
-            if n + 1 < len(self.stack):
-                self.stack = self.stack[0:n + 1]
+            stack[n].nxt = node
+            stack[n] = node
+            del stack[n + 1:]
 
     def handle_R(self, n):
         """ Reynir version info """
@@ -979,7 +1246,10 @@ class TreeBase:
 
     def handle_T(self, n, s):
         """ Terminal """
-        terminal, token, tokentype, aux, cat = self._parse_T(s)
+        self.handle_terminal(n, *self._parse_T(s))
+
+    def handle_terminal(self, n, terminal, token, tokentype, aux, cat):
+        """ Terminal, with its descriptor already parsed """
         constructor = self._TC.get(cat, TerminalNode)
         self.push(n, constructor(terminal, token, tokentype, aux, self.at_start))
         self.at_start = False
@@ -988,24 +1258,125 @@ class TreeBase:
         """ Nonterminal """
         self.push(n, NonterminalNode(nonterminal))
 
-    def load(self, txt):
-        """ Loads a tree from the text format stored by the scraper """
-        for line in txt.split("\n"):
-            if not line:
-                continue
-            a = line.split(' ', maxsplit = 1)
-            if not a:
-                continue
-            code = a[0]
-            n = int(code[1:])
-            f = getattr(self, "handle_" + code[0], None)
-            if f:
-                if len(a) >= 2:
-                    f(n, a[1])
-                else:
-                    f(n)
+    def _load_line(self, line):
+        """ Load a single line of the text format """
+        if not line:
+            return
+        a = line.split(' ', maxsplit = 1)
+        if not a:
+            return
+        code = a[0]
+        n = int(code[1:])
+        f = getattr(self, "handle_" + code[0], None)
+        if f:
+            if len(a) >= 2:
+                f(n, a[1])
+            else:
+                f(n)
+        else:
+            print("*** No handler for {0}".format(line))
+
+    def _load_packed(self, data, sentences = None):
+        """ Load a tree from the binary encoding, invoking the handlers
+            directly without going through the text format. If sentences
+            is given, only the sentences having those numbers are loaded,
+            using the sentence index to skip the others. """
+        nsym, table, nbytes, index, pos = _unpack_header(data)
+        symbols = _unpack_symbols(data, nsym, table, nbytes)
+        cats = { } # Terminal symbol index -> category
+        if sentences is None or index is None:
+            self._load_records(data, symbols, cats, pos, len(data))
+            if sentences is not None:
+                self._drop_sentences(sentences)
+            return
+        for n, start, end, _ in index:
+            if n in sentences:
+                self._load_records(data, symbols, cats, start, end)
+
+    def _drop_sentences(self, sentences):
+        """ Remove loaded sentences whose numbers are not in sentences """
+        for n in [ n for n in self.s if n not in sentences ]:
+            del self.s[n]
+
+    def _load_records(self, data, symbols, cats, pos, end):
+        """ Load the records between the given positions of a binary tree """
+        handle_terminal = self.handle_terminal
+        handle_N = self.handle_N
+        handle_P = self.handle_P
+        while pos < end:
+            op = data[pos]
+            n = data[pos + 1]
+            pos += 2
+            if n >= 0x80:
+                n, pos = _get_varint(data, pos, n)
+            if op == _OP_T:
+                t = data[pos]
+                pos += 1
+                if t >= 0x80:
+                    t, pos = _get_varint(data, pos, t)
+                tk = data[pos]
+                pos += 1
+                if tk >= 0x80:
+                    tk, pos = _get_varint(data, pos, tk)
+                k = data[pos]
+                pos += 1
+                if k >= 0x80:
+                    k, pos = _get_varint(data, pos, k)
+                x = data[pos]
+                pos += 1
+                if x >= 0x80:
+                    x, pos = _get_varint(data, pos, x)
+                terminal = symbols[t]
+                cat = cats.get(t)
+                if cat is None:
+                    cat = cats[t] = terminal.split("_", maxsplit = 1)[0]
+                handle_terminal(n, terminal, symbols[tk],
+                    symbols[k] if k else "WORD", symbols[x] if x else "", cat)
+            elif op == _OP_N:
+                s = data[pos]
+                pos += 1
+                if s >= 0x80:
+                    s, pos = _get_varint(data, pos, s)
+                handle_N(n, symbols[s])
+            elif op == _OP_P:
+                handle_P(n)
+            elif op == _OP_S:
+                self.handle_S(n)
+            elif op == _OP_Q:
+                self.handle_Q(n)
+            elif op == _OP_E:
+                self.handle_E(n)
+            elif op == _OP_LINE:
+                self._load_line(symbols[n])
             else:
-                print("*** No handler for {0}".format(line))
+                # Rare records, such as versions and options, are
+                # handled as in the text format
+                if op == _OP_O:
+                    ix = data[pos]
+                    pos += 1
+                    if ix >= 0x80:
+                        ix, pos = _get_varint(data, pos, ix)
+                    self._load_line("O{0} {1}".format(n, ix))
+                else:
+                    self._load_line("{0}{1}".format(_CODE_CHARS[op], n))
+
+    def load(self, txt, sentences = None):
+        """ Loads a tree from the text format or the binary encoding
+            stored by the scraper. If sentences is given, it is a collection
+            of the numbers of the sentences to load; others are skipped. """
+        if isinstance(txt, (bytes, bytearray, memoryview)):
+            if is_packed_tree(txt):
+                self._load_packed(txt, sentences)
+                return
+            # Text format stored as bytes
+            txt = bytes(txt).decode("utf-8")
+        keep = True
+        for line in txt.split("\n"):
+            if sentences is not None and line[0:1] == "S":
+                # Start of sentence: check whether it is to be loaded
+                keep = int(line[1:].split(' ', maxsplit = 1)[0]) in sentences
+            if keep:
+                self._load_line(line)
 
 
 class Tree(TreeBase):
@@ -1068,6 +1439,23 @@ class TreeGist(TreeBase):
         # Dictionary of error token indices for sentences that weren't successfully parsed
         self._err_index = dict()
 
+    def load(self, txt, sentences = None):
+        """ Load the gist of a tree. For the binary encoding, this only
+            requires the sentence index, not the sentence records. """
+        index = tree_index(txt)
+        if index is None:
+            super().load(txt, sentences)
+            return
+        for n, _, _, status in index:
+            if sentences is not None and n not in sentences:
+                continue
+            if status == 1:
+                # Parsed sentence
+                self.s[n] = None
+            elif status >= 2:
+                # Error at token index status - 2
+                self._err_index[n] = status - 2
+
     def err_index(self, n):
         """ Return the error token index for an unparsed sentence, if any, or None """
         return self._err_index.get(n)
@@ -1091,6 +1479,10 @@ class TreeGist(TreeBase):
         # No need to store anything for gists
         pass
 
+    def handle_terminal(self, n, terminal, token, tokentype, aux, cat):
+        """ Terminal """
+        pass
+
     def handle_N(self, n, nonterminal):
         """ Nonterminal """
         # No need to store anything for gists
@@ -1111,9 +1503,8 @@ class TreeTokenList(TreeBase):
         self.s[self.n] = self.stack
         self.stack = None
 
-    def handle_T(self, n, s):
+    def handle_terminal(self, n, terminal, token, tokentype, aux, cat):
         """ Terminal """
-        terminal, token, tokentype, aux, cat = self._parse_T(s)
         # Append to token list for current sentence
         assert self.stack is not None
         self.stack.append(TreeToken(terminal = terminal, token = token, tokentype = tokentype, aux = aux, cat = cat))
@@ -1123,3 +1514,16 @@ class TreeTokenList(TreeBase):
         # No action required for token lists
         pass
 
+    def trigrams(self):
+        """ Generate the trigrams of the token texts in the sentences of
+            this tree, with each sentence starting and ending with two
+            empty strings. Trigrams consisting of empty strings only are
+            omitted. """
+        for ix, toklist in self.sentences():
+            if toklist:
+                words = [ "", "" ] + [ t.token[1:-1] for t in toklist ] + [ "", "" ]
+                for i in range(len(words) - 2):
+                    tg = tuple(words[i:i + 3])
+                    if any(tg):
+                        yield tg
+
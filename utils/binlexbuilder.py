@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+BIN lexicon builder
+
+Author: Vilhjalmur Thorsteinsson 2016
+
+Reads a CSV export of the BIN 'ord' table and writes the compact,
+memory-mapped lexicon file that is used by binlexicon.py instead of
+per-word queries to PostgreSQL.
+
+The CSV file can be created with the following statement:
+
+\c bin
+COPY ord TO '/home/user/github/Reynir/resources/ord.csv' WITH (FORMAT CSV, DELIMITER ';', ENCODING 'utf8');
+
+The columns are in the order stofn;utg;ordfl;fl;ordmynd;beyging.
+
+Example usage:
+
+python binlexbuilder.py resources/ord.csv resources/ord.lexicon
+
+"""
+
+import sys
+import csv
+import time
+import codecs
+
+from binlexicon import BIN_Lexicon
+
+
+def rows(infile):
+    """ Generate (stofn, utg, ordfl, fl, ordmynd, beyging) tuples from the CSV file """
+    with codecs.open(infile, "r", "utf-8") as inp:
+        for cnt, r in enumerate(csv.reader(inp, delimiter = ';')):
+            if len(r) != 6:
+                print("Skipping malformed line {0}: {1}".format(cnt + 1, r))
+                continue
+            yield (r[0], int(r[1]), r[2], r[3], r[4], r[5])
+            if cnt % 100000 == 0:
+                # Progress indicator
+                print("{0}...".format(cnt), end="\r")
+                sys.stdout.flush()
+
+
+def run(infile, outfile):
+    """ Build the lexicon file from the CSV input file """
+    print("Building BIN lexicon {0} from {1}".format(outfile, infile))
+    t0 = time.time()
+    num_records, num_forms = BIN_Lexicon.write(outfile, rows(infile))
+    t1 = time.time()
+    print("Wrote {0} meanings of {1} word forms in {2:.2f} seconds"
+        .format(num_records, num_forms, t1 - t0))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 3:
+        run(sys.argv[1], sys.argv[2])
+    else:
+        run("resources/ord.csv", BIN_Lexicon.LEXICON_FILE)
+
@@ -666,6 +666,13 @@ def run_bin():
 
     print("DAWG pickle file stored in {0:.2f} seconds".format(t1 - t0))
 
+    # Store DAWG as a packed binary file, to be memory-mapped by PackedDawgDictionary
+    t0 = time.time()
+    dawg.store_packed(os.path.abspath(os.path.join("resources", "ordalisti.dawg.bin")))
+    t1 = time.time()
+
+    print("DAWG packed file stored in {0:.2f} seconds".format(t1 - t0))
+
     print("DAWG builder run complete")
 
 
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+Scraper database migration
+
+Author: Vilhjalmur Thorsteinsson 2016
+
+Brings the columns of an existing scraper database up to date with
+the models in scraperdb.py, without touching the stored data otherwise.
+Currently this converts the articles.tree column from varchar to bytea,
+which is required before articles can be stored with trees in the
+binary encoding of tree.pack_tree(). The same step is also run by
+Scraper_DB.create_tables() when the scraper or processor starts.
+
+Example usage:
+
+PYTHONPATH=. python utils/migratedb.py
+
+"""
+
+import time
+
+from settings import Settings, ConfigError
+from scraperdb import Scraper_DB
+
+
+def run():
+    """ Run the migration steps on the scraper database """
+    print("Migrating the scraper database")
+    t0 = time.time()
+    changed = Scraper_DB().migrate()
+    t1 = time.time()
+    if changed:
+        print("Database migrated in {0:.2f} seconds".format(t1 - t0))
+    else:
+        print("Database is already up to date")
+
+
+if __name__ == "__main__":
+
+    try:
+        # Read configuration file
+        Settings.read("config/Reynir.conf")
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        quit()
+
+    run()
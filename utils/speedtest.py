@@ -8,6 +8,7 @@ from settings import Settings
 from scraperdb import SessionContext
 from article import Article
 from fastparser import Fast_Parser
+from metrics import Metrics
 
 
 def profile(func, *args, **kwargs):
@@ -32,6 +33,7 @@ def speed_test(uuid):
                 a.parse(session, verbose = True)
         t1 = time.time()
         print("Parsing finished in {0:.2f} seconds".format(t1 - t0))
+        print(Metrics.report())
     finally:
         Article.cleanup()
 
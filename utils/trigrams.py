@@ -11,19 +11,41 @@
     This module reads parse trees from stored articles and processes the words therein,
     to create trigram lists and statistical data.
 
+    The trigrams are counted in parallel worker processes, each handling a batch
+    of articles at a time. The parent process aggregates the counts in memory,
+    spilling sorted runs to temporary files if the number of distinct trigrams
+    grows too large (in the style of utils/sortfile.py). The merged counts are
+    finally bulk loaded into the trigrams table (see Trigram.merge_counts()).
+
 """
 
-from itertools import islice, tee
+import os
+import heapq
+import pickle
+import tempfile
+import multiprocessing
+from collections import Counter
 from contextlib import closing
 from random import randint
 
 from settings import Settings, ConfigError
 from tokenizer import correct_spaces
 from bindb import BIN_Db
-from scraperdb import SessionContext, Article, Trigram, DatabaseError, desc
+from scraperdb import SessionContext, Article, Trigram, desc
 from tree import TreeTokenList, TerminalDescriptor
 
 
+# Number of articles sent to a worker process at a time
+BATCH_SIZE = 200
+
+# Maximum number of distinct trigrams to count in memory
+# before spilling them to a sorted run on disk
+MAX_ENTRIES = 4 * 1000 * 1000
+
+# Number of items in each pickled block of a sorted run
+RUN_BLOCK = 10000
+
+
 def dump_tokens(limit):
     """ Iterate through parsed articles and print a list
         of tokens and their matched terminals """
@@ -32,7 +54,7 @@ def dump_tokens(limit):
     with closing(BIN_Db.get_db()) as db:
         with SessionContext(commit = True) as session:
             # Iterate through the articles
-            q = session.query(Article) \
+            q = session.query(Article.heading, Article.url, Article.timestamp, Article.tree) \
                 .filter(Article.tree != None) \
                 .order_by(Article.timestamp)
             if limit is None:
@@ -60,55 +82,148 @@ def dump_tokens(limit):
                             print("    {0.token} {0.cat} {0.terminal}".format(t))
 
 
-def make_trigrams(limit):
+def article_trigrams(tree_data):
+    """ Generate the trigrams of the successfully parsed sentences
+        in a stored article tree, with the tokens truncated to
+        the maximum length of the trigrams table """
+    tree = TreeTokenList()
+    tree.load(tree_data)
+    for tg in tree.trigrams():
+        yield Trigram.key(*tg)
+
+
+def _init_worker():
+    """ Initialize a trigram counting process """
+    # Do not share the database connection of the parent process
+    SessionContext.cleanup()
+
+
+def _count_batch(urls):
+    """ Count the trigrams in a batch of articles, within a worker process.
+        Returns a (number of articles, Counter) tuple. """
+    counts = Counter()
+    narticles = 0
+    with SessionContext(commit = False) as session:
+        q = session.query(Article.tree) \
+            .filter(Article.url.in_(urls)) \
+            .filter(Article.tree != None)
+        for a in q:
+            counts.update(article_trigrams(a.tree))
+            narticles += 1
+    return narticles, counts
+
+
+class TrigramCounter:
+
+    """ Aggregates trigram counts in memory, spilling sorted runs
+        to temporary files when the number of distinct trigrams
+        exceeds a given maximum """
+
+    def __init__(self, max_entries = MAX_ENTRIES, tempdir = None):
+        self._counts = Counter()
+        self._max_entries = max_entries
+        self._tempdir = tempdir
+        self._runs = [] # Temporary files containing sorted runs
+
+    def __enter__(self):
+        """ Python context manager protocol """
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Python context manager protocol """
+        self.close()
+        return False
+
+    def update(self, counts):
+        """ Add a mapping of trigrams to counts """
+        self._counts.update(counts)
+        if len(self._counts) >= self._max_entries:
+            self._spill()
+
+    def _spill(self):
+        """ Write the trigrams in memory to a sorted run on disk """
+        items = sorted(self._counts.items())
+        f = tempfile.TemporaryFile(dir = self._tempdir)
+        for i in range(0, len(items), RUN_BLOCK):
+            pickle.dump(items[i:i + RUN_BLOCK], f, pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        self._runs.append(f)
+        self._counts = Counter()
+        print("Wrote sorted run {0} with {1} trigrams".format(len(self._runs), len(items)))
+
+    @staticmethod
+    def _read_run(f):
+        """ Generate the (trigram, count) tuples of a sorted run """
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+    def items(self):
+        """ Generate (t1, t2, t3, count) tuples in sorted order,
+            merging the counts of each trigram across the runs """
+        runs = [ self._read_run(f) for f in self._runs ]
+        runs.append(iter(sorted(self._counts.items())))
+        key, total = None, 0
+        for tg, cnt in heapq.merge(*runs):
+            if tg == key:
+                total += cnt
+            else:
+                if key is not None:
+                    yield key + (total,)
+                key, total = tg, cnt
+        if key is not None:
+            yield key + (total,)
+
+    def close(self):
+        """ Delete the temporary files """
+        for f in self._runs:
+            f.close()
+        self._runs = []
+
+
+def make_trigrams(limit, processes = None):
     """ Iterate through parsed articles and extract trigrams from
         successfully parsed sentences """
 
-    with SessionContext(commit = True) as session:
-
-        # Delete existing trigrams
-        Trigram.delete_all(session)
-        # Iterate through the articles
-        q = session.query(Article.url, Article.timestamp, Article.tree) \
+    def batches(session):
+        """ Generate lists of article URLs to be processed by the workers """
+        q = session.query(Article.url) \
             .filter(Article.tree != None) \
             .order_by(Article.timestamp)
         if limit is None:
-            q = q.yield_per(200)
+            q = q.yield_per(BATCH_SIZE * 10)
         else:
             q = q[0:limit]
+        batch = []
+        for a in q:
+            batch.append(a.url)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
-        def tokens(q):
-            """ Generator for token stream """
-            for a in q:
-                print("Processing article from {0.timestamp}: {0.url}".format(a))
-                tree = TreeTokenList()
-                tree.load(a.tree)
-                for ix, toklist in tree.sentences():
-                    if toklist:
-                        # For each sentence, start and end with empty strings
-                        yield ""
-                        yield ""
-                        for t in toklist:
-                            yield t.token[1:-1]
-                        yield ""
-                        yield ""
-
-        def trigrams(iterable):
-            return zip(*((islice(seq, i, None) for i, seq in enumerate(tee(iterable, 3)))))
-
-        FLUSH_THRESHOLD = 0 # 200 # Flush once every 200 records
-        cnt = 0
-        for tg in trigrams(tokens(q)):
-            # print("{0}".format(tg))
-            if any(w for w in tg):
-                try:
-                    Trigram.upsert(session, *tg)
-                    cnt += 1
-                    if cnt == FLUSH_THRESHOLD:
-                        session.flush()
-                        cnt = 0
-                except DatabaseError as ex:
-                    print("*** Exception {0} on trigram {1}, skipped".format(ex, tg))
+    processes = processes or os.cpu_count() or 1
+    with TrigramCounter() as counter:
+
+        # Fork the workers before the parent process opens a database connection
+        with multiprocessing.Pool(processes, initializer = _init_worker) as pool:
+            with SessionContext(commit = False) as session:
+                narticles = 0
+                for n, counts in pool.imap_unordered(_count_batch, batches(session)):
+                    counter.update(counts)
+                    narticles += n
+                    print("Processed {0} articles".format(narticles))
+
+        with SessionContext(commit = True) as session:
+            # Replace the existing trigrams in a single transaction
+            Trigram.delete_all(session)
+            cnt = Trigram.merge_counts(session, counter.items())
+            print("Stored {0} trigrams".format(cnt))
 
 
 def spin_trigrams(num):